@@ -0,0 +1,82 @@
+import contextlib
+import glob
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import image_cache
+import png_parser
+import result_store
+
+
+# Expands a directory (searched recursively for *.png) or a glob pattern into a sorted list of files
+def find_png_files(path_or_pattern):
+    if os.path.isdir(path_or_pattern):
+        pattern = os.path.join(path_or_pattern, "**", "*.png")
+    else:
+        pattern = path_or_pattern
+
+    return sorted(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+
+# Analyzes a single file: metadata from all chunks and statistics of the decoded image.
+# Metadata comes from png_parser.scan_metadata, which seeks past IDAT. With a ResultStore, the
+# image statistics of content seen before are reused, so an unchanged file is never read whole.
+def analyze_file(file_path, store=None):
+    try:
+        metadata = png_parser.scan_metadata(file_path)
+
+        ihdr = metadata["IHDR"]
+        if ihdr["interlace"] != 0:
+            raise ValueError("Interlaced images are not supported")
+
+        image = None
+        if store is not None:
+            key = store.get_file_hash(file_path)
+            if key is None:
+                key = result_store.content_hash(png_parser.load_chunks(file_path))
+                store.put_file_hash(file_path, key)
+            image = store.get(key)
+
+        if image is None:
+            image = png_parser.parse_image(file_path)
+            if store is not None:
+                store.put(key, image)
+
+        return {"path": file_path, "metadata": metadata, "image": image}
+    except Exception as e:
+        return {"path": file_path, "error": f"{type(e).__name__}: {e}"}
+
+# Runs in worker processes. Every file is analyzed once, so what it left in image_cache would only
+# hold up to the whole cache budget per worker without ever being reused; it is dropped right away.
+def _analyze_batch(file_paths, store_path=None):
+    with contextlib.ExitStack() as stack:
+        store = stack.enter_context(result_store.ResultStore(store_path)) if store_path is not None else None
+
+        results = []
+        for file_path in file_paths:
+            results.append(analyze_file(file_path, store))
+            image_cache.invalidate(file_path)
+        return results
+
+# Analyzes files in worker processes, yielding results as soon as each batch of
+# `chunksize` files is finished (not in input order). store_path names an SQLite
+# ResultStore shared by the workers and later runs.
+def analyze_files(file_paths, workers=None, chunksize=8, store_path=None):
+    batches = [file_paths[i:i + chunksize] for i in range(0, len(file_paths), chunksize)]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_analyze_batch, batch, store_path) for batch in batches]
+        for future in as_completed(futures):
+            yield from future.result()
+
+# Writes analysis results as NDJSON, one line per file, flushed as soon as it is written.
+# Returns the number of files that failed.
+def write_ndjson(results, output):
+    failed = 0
+
+    for result in results:
+        if "error" in result:
+            failed += 1
+        output.write(json.dumps(result, default=str) + "\n")
+        output.flush()
+
+    return failed
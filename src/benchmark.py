@@ -0,0 +1,271 @@
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+import numpy as np
+from chunks import PngChunk
+import png_parser
+from png_anonymizator import anonymize_png
+from rsa import generate_keypair
+import modes_ecb as ecb
+import modes_cbc as cbc
+import modes_ctr as ctr
+import modes_hybrid as hybrid
+import rsa_lib
+
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "assets")
+
+# Edge lengths of the synthetic square RGB images
+SYNTHETIC_SIZES = (64, 256, 1024)
+
+# Cipher modes are skipped for images with more raw (inflated IDAT) bytes than this
+CIPHER_MAX_BYTES = 1 << 20
+
+# Allowed slowdown against the baseline before a result counts as a regression
+REGRESSION_TOLERANCE = 0.25
+
+# Slowdowns smaller than this are timer noise, never regressions
+MIN_REGRESSION_SECONDS = 0.002
+
+# (name, encrypt, decrypt) of every cipher mode
+CIPHER_MODES = (
+    ("ecb", ecb.encrypt_png_ecb, ecb.decrypt_png_ecb),
+    ("cbc", cbc.encrypt_png_cbc, cbc.decrypt_png_cbc),
+    ("cbc_segmented", cbc.encrypt_png_cbc_segmented, cbc.decrypt_png_cbc_segmented),
+    ("ctr", ctr.encrypt_png_ctr, ctr.decrypt_png_ctr),
+    ("rsa_lib", rsa_lib.encrypt_png_rsa_lib, rsa_lib.decrypt_png_rsa_lib),
+    ("hybrid", hybrid.encrypt_png_hybrid, hybrid.decrypt_png_hybrid),
+)
+
+# Times generate_keypair for every bit size, returns {bits: {"mean": s, "median": s, "min": s}}
+def benchmark_keygen(bit_sizes=(1024, 2048, 4096), rounds=5, workers=None):
+    results = {}
+
+    for bits in bit_sizes:
+        times = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            generate_keypair(bits, workers)
+            times.append(time.perf_counter() - start)
+        results[bits] = {"mean": statistics.mean(times), "median": statistics.median(times), "min": min(times)}
+
+    return results
+
+# Bundled original images (encryption outputs in assets/ are left out)
+def find_asset_images(assets_dir=ASSETS_DIR):
+    return sorted(path for path in glob.glob(os.path.join(assets_dir, "*.png"))
+                  if not path.endswith(("_encrypted.png", "_decrypted.png")))
+
+# Writes a size x size RGB gradient with noise as a PNG with a single IDAT chunk
+def write_synthetic_image(path, size, seed=0):
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size]
+    pixels = np.stack([x * 255 // size, y * 255 // size, (x + y) * 127 // size], axis=-1)
+    pixels = (pixels + rng.integers(0, 8, pixels.shape)).clip(0, 255).astype(np.uint8)
+
+    image_info = {"width": size, "height": size, "color_type": 2, "bit_depth": 8}
+    ihdr = (size.to_bytes(4, "big") + size.to_bytes(4, "big") + bytes([8, 2, 0, 0, 0]))
+    idat = zlib.compress(png_parser.apply_png_filters(pixels.tobytes(), image_info, png_parser.ADAPTIVE_FILTER))
+
+    png_parser.write_chunks(path, [PngChunk(len(ihdr), "IHDR", ihdr), PngChunk(len(idat), "IDAT", idat),
+                                   PngChunk(0, "IEND", b"")])
+
+# Decodes everything the stages need from one image
+def prepare_input(path, work_dir):
+    chunks = png_parser.read_chunks(path)
+    ihdr = png_parser.parse_IHDR(next(chunk for chunk in chunks if chunk.type == "IHDR"))
+    idat_chunks = [bytes(chunk.data) for chunk in chunks if chunk.type == "IDAT"]
+    filtered = zlib.decompress(b"".join(idat_chunks))
+
+    context = {"path": path, "chunks": chunks, "ihdr": ihdr, "idat": idat_chunks, "filtered": filtered,
+               "raw_bytes": len(filtered), "work_dir": work_dir}
+    if ihdr["interlace"] == 0:
+        context["pixels"] = png_parser.remove_png_filters(filtered, ihdr)
+
+    return context
+
+def stage_read_chunks(context):
+    png_parser.read_chunks(context["path"])
+
+def stage_extract_metadata(context):
+    png_parser.extract_metadata(context["chunks"])
+
+def stage_parse_IDAT(context):
+    ihdr = context["ihdr"]
+    png_parser.parse_IDAT(context["idat"], ihdr["width"], ihdr["height"], ihdr["bit_depth"], ihdr["color_type"])
+
+def stage_apply_png_filters(context):
+    png_parser.apply_png_filters(context["pixels"], context["ihdr"], png_parser.ADAPTIVE_FILTER)
+
+def stage_remove_png_filters(context):
+    png_parser.remove_png_filters(context["filtered"], context["ihdr"])
+
+def stage_anonymize_png(context):
+    anonymize_png(context["path"], os.path.join(context["work_dir"], "anonymized.png"))
+
+# Encrypt and decrypt stages of one mode. Decryption reads the file written by the last encryption.
+def cipher_stages(name, encrypt, decrypt):
+    def encrypt_stage(context):
+        ecb.clear_block_caches()
+        encrypt(context["path"], os.path.join(context["work_dir"], f"{name}.png"), context["public_key"])
+
+    def decrypt_stage(context):
+        ecb.clear_block_caches()
+        decrypt(os.path.join(context["work_dir"], f"{name}.png"), os.path.join(context["work_dir"], f"{name}_decrypted.png"),
+                context["private_key"])
+
+    return {f"{name}_encrypt": encrypt_stage, f"{name}_decrypt": decrypt_stage}
+
+# All stages in the order they run; a cipher mode's encryption always runs before its decryption
+STAGES = {
+    "read_chunks": stage_read_chunks,
+    "extract_metadata": stage_extract_metadata,
+    "parse_IDAT": stage_parse_IDAT,
+    "apply_png_filters": stage_apply_png_filters,
+    "remove_png_filters": stage_remove_png_filters,
+    "anonymize_png": stage_anonymize_png,
+}
+for mode in CIPHER_MODES:
+    STAGES.update(cipher_stages(*mode))
+
+# Runs a stage once under tracemalloc (which also warms it up), then `repeat` timed runs.
+# Peak memory covers this process only, not block_engine workers.
+def measure(stage, context, repeat):
+    with contextlib.redirect_stdout(io.StringIO()):
+        tracemalloc.start()
+        try:
+            stage(context)
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            stage(context)
+            times.append(time.perf_counter() - start)
+
+    seconds = statistics.median(times)
+    return {"seconds": seconds, "min_seconds": min(times),
+            "mb_per_s": context["raw_bytes"] / seconds / 1e6 if seconds else None,
+            "peak_memory_bytes": peak_memory}
+
+# Runs the selected stages on every image, returns one result dict per (stage, input)
+def run_benchmarks(paths, stage_names, repeat=3, key_bits=512, cipher_max_bytes=CIPHER_MAX_BYTES):
+    public_key, private_key = generate_keypair(key_bits)
+    results = []
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        for path in paths:
+            context = prepare_input(path, work_dir)
+            context["public_key"], context["private_key"] = public_key, private_key
+            name = os.path.basename(path)
+
+            for stage_name in stage_names:
+                result = {"stage": stage_name, "input": name, "raw_bytes": context["raw_bytes"]}
+                is_cipher = stage_name.endswith(("_encrypt", "_decrypt"))
+                if is_cipher and context["raw_bytes"] > cipher_max_bytes:
+                    result["skipped"] = f"more than {cipher_max_bytes} raw bytes"
+                elif stage_name.endswith("_filters") and "pixels" not in context:
+                    result["skipped"] = "interlaced image"
+                else:
+                    try:
+                        result.update(measure(STAGES[stage_name], context, repeat))
+                    except Exception as e:
+                        result["error"] = f"{type(e).__name__}: {e}"
+                results.append(result)
+                print(format_result(result), file=sys.stderr)
+
+    return results
+
+def format_result(result):
+    label = f"{result['stage']:<24} {result['input']:<20}"
+    if "seconds" in result:
+        return (f"{label} {result['seconds'] * 1000:10.2f} ms {result['mb_per_s'] or 0:10.2f} MB/s"
+                f" {result['peak_memory_bytes'] / 2**20:8.2f} MiB peak")
+    return f"{label} {result.get('error') or 'skipped: ' + result['skipped']}"
+
+# Lists results slower than the baseline by more than `tolerance`, or failing where the baseline did not.
+# Minimum times are compared, being the least noisy.
+def compare_results(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    baseline_results = {(result["stage"], result["input"]): result for result in baseline["results"]}
+    regressions = []
+
+    for result in results:
+        reference = baseline_results.get((result["stage"], result["input"]))
+        if reference is None or "seconds" not in reference:
+            continue
+
+        label = f"{result['stage']} on {result['input']}"
+        if "error" in result:
+            regressions.append(f"{label}: {result['error']}")
+        elif "seconds" in result:
+            limit = reference["min_seconds"] * (1 + tolerance)
+            if result["min_seconds"] > limit and result["min_seconds"] - reference["min_seconds"] > MIN_REGRESSION_SECONDS:
+                regressions.append(f"{label}: {result['min_seconds'] * 1000:.2f} ms, "
+                                   f"baseline {reference['min_seconds'] * 1000:.2f} ms")
+
+    return regressions
+
+# Usage: benchmark.py [--stages ...] [--inputs assets|synthetic|all] [--output results.json]
+#                     [--baseline baseline.json] [--save-baseline baseline.json] [--keygen]
+def main(args):
+    parser = argparse.ArgumentParser(prog="benchmark.py")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES))
+    parser.add_argument("--inputs", choices=("assets", "synthetic", "all"), default="all")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--key-bits", type=int, default=512, help="Bits of each RSA prime")
+    parser.add_argument("--cipher-max-bytes", type=int, default=CIPHER_MAX_BYTES)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="Fail if results regress against this JSON file")
+    parser.add_argument("--save-baseline", help="Write the results as the new baseline to this file")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    parser.add_argument("--keygen", action="store_true", help="Only benchmark key generation")
+    args = parser.parse_args(args)
+
+    if args.keygen:
+        for bits, result in benchmark_keygen().items():
+            print(f"generate_keypair({bits}): mean {result['mean']:.3f}s, median {result['median']:.3f}s, min {result['min']:.3f}s")
+        return 0
+
+    # Stages run in registry order, so decryption always follows encryption
+    stage_names = [name for name in STAGES if name in args.stages]
+
+    with tempfile.TemporaryDirectory() as synthetic_dir:
+        paths = find_asset_images() if args.inputs in ("assets", "all") else []
+        if args.inputs in ("synthetic", "all"):
+            for size in SYNTHETIC_SIZES:
+                path = os.path.join(synthetic_dir, f"synthetic_{size}.png")
+                write_synthetic_image(path, size)
+                paths.append(path)
+
+        results = run_benchmarks(paths, stage_names, args.repeat, args.key_bits, args.cipher_max_bytes)
+
+    report = {"python": platform.python_version(), "machine": platform.machine(), "cpu_count": os.cpu_count(),
+              "repeat": args.repeat, "key_bits": args.key_bits, "results": results}
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_results(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+
+    return 0
+
+if __name__ == "__main__":
+    exit(main(sys.argv[1:]))
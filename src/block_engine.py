@@ -0,0 +1,37 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Number of cipher blocks handed to a worker process at once
+BLOCKS_PER_BATCH = 256
+
+# worker count -> process pool. Pools are never shut down while the process runs, since
+# another thread (e.g. a KeyPool) may be submitting to the same pool; they exit with the interpreter.
+_executors = {}
+_executors_lock = threading.Lock()
+
+# Returns the process pool shared by all modes for this worker count, created on first use
+def get_executor(workers=None):
+    workers = workers or os.cpu_count() or 1
+    with _executors_lock:
+        executor = _executors.get(workers)
+        if executor is None:
+            executor = _executors[workers] = ProcessPoolExecutor(max_workers=workers)
+    return executor
+
+# Runs batch_function on every item of batches in worker processes, returns the results in order.
+# batch_function must be picklable: a module-level function or a functools.partial of one.
+# With workers=1, or a single batch, the work runs in this process.
+def map_batches(batch_function, batches, workers=None):
+    if workers == 1 or len(batches) <= 1:
+        return [batch_function(batch) for batch in batches]
+
+    return list(get_executor(workers).map(batch_function, batches))
+
+# Splits data into batches of whole blocks, runs batch_function on every batch
+# with map_batches and joins the results in input order.
+def map_blocks(batch_function, data, block_size, workers=None, blocks_per_batch=BLOCKS_PER_BATCH):
+    batch_size = block_size * blocks_per_batch
+    batches = [data[i:i + batch_size] for i in range(0, len(data), batch_size)]
+
+    return b"".join(map_batches(batch_function, batches, workers))
@@ -1,9 +1,58 @@
+import os
+import zlib
+
+
 class PngChunk:
-    def __init__(self, length, chunk_type, data, crc):
+    __slots__ = ("length", "type", "source", "offset", "_data", "_crc")
+
+    # data and crc may be omitted when the payload lives in `source`, starting at `offset`.
+    # The source is either a buffer (e.g. a memoryview of a mapped file), sliced without copying,
+    # or a file path, read on first access. The CRC is read from the source, or computed from
+    # the data for chunks without a source, only when it is asked for.
+    def __init__(self, length, chunk_type, data=None, crc=None, source=None, offset=None):
         self.length = length
         self.type = chunk_type
-        self.data = data
-        self.crc = crc
+        self.source = source
+        self.offset = offset
+        self._data = data
+        self._crc = crc
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = self._read_source(self.offset, self.length)
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+
+    @property
+    def crc(self):
+        if self._crc is None:
+            if self.source is not None:
+                self._crc = int.from_bytes(self._read_source(self.offset + self.length, 4), "big")
+            else:
+                self._crc = zlib.crc32(self.data, zlib.crc32(self.type.encode("ascii"))) & 0xFFFFFFFF
+        return self._crc
+
+    @crc.setter
+    def crc(self, crc):
+        self._crc = crc
+
+    def _read_source(self, start, size):
+        if self.source is None:
+            raise ValueError(f"Chunk {self.type} has no data")
+
+        if isinstance(self.source, (str, os.PathLike)):
+            with open(self.source, "rb") as f:
+                f.seek(start)
+                data = f.read(size)
+            if len(data) < size:
+                raise ValueError("Unexpected end of PNG file")
+            return data
+
+        return self.source[start:start + size]
 
     def __str__(self):
         return f"Chunk {self.type} ({self.length} bytes)"
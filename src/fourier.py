@@ -1,20 +1,273 @@
+import contextlib
+import itertools
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from PIL import Image
-import matplotlib.pyplot as plt
+import image_cache
+import instrumentation
+import png_parser
 
-def display_fourier_spectrum(image_path):
-    # Open image and convert to grayscale
-    img = Image.open(image_path).convert('L')
-    img_array = np.array(img)
+# Edge length of the Welch tiles; tiles overlap by half
+WELCH_TILE_SIZE = 256
+
+# Number of radial frequency bins between 0 and 0.5 cycles per pixel in the feature vector
+RADIAL_BINS = 32
+
+# ITU-R 601-2 luma weights, as used by Pillow's convert('L')
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+# Pillow's fixed-point form of LUMA_WEIGHTS for 8-bit values, (R, G, B) * weights + 0x8000 >> 16
+LUMA_WEIGHTS_FIXED = np.array([19595, 38470, 7471], dtype=np.uint32)
+
+def _load_grayscale(image_path):
+    chunks = png_parser.load_chunks(image_path)
+    ihdr = png_parser.parse_IHDR(next(chunk for chunk in chunks if chunk.type == "IHDR"))
+    color_type = ihdr["color_type"]
+
+    # Pillow opens 16-bit grayscale as I;16 and its convert('L') clips the samples at 255 instead of
+    # keeping the high byte, so that case is left to Pillow too, to keep its spectra unchanged
+    if ihdr["interlace"] != 0 or ihdr["bit_depth"] < 8 or (ihdr["bit_depth"] == 16 and color_type == 0):
+        img_array = np.array(Image.open(image_path).convert('L'))
+    else:
+        # Same result as Pillow's convert('L') on the decoded image shared through png_parser.load_image;
+        # 16-bit colour samples keep their high byte
+        pixels = png_parser.load_image(image_path)
+        if ihdr["bit_depth"] == 16:
+            pixels = (pixels >> 8).astype(np.uint8)
+
+        if color_type == 3:
+            plte = next(chunk for chunk in chunks if chunk.type == "PLTE")
+            palette = np.frombuffer(bytes(plte.data), dtype=np.uint8).reshape(-1, 3)
+            gray_palette = np.zeros(256, dtype=np.uint8)
+            gray_palette[:len(palette)] = (palette @ LUMA_WEIGHTS_FIXED + 0x8000) >> 16
+            img_array = gray_palette[pixels]
+        elif color_type in (2, 6):
+            img_array = ((pixels[..., :3] @ LUMA_WEIGHTS_FIXED + 0x8000) >> 16).astype(np.uint8)
+        elif color_type == 4:
+            img_array = pixels[..., 0].copy()
+        else:
+            img_array = pixels.copy()
+
+    # Shared by every caller, so it must not be modified in place
+    img_array.flags.writeable = False
+    return img_array
+
+# Grayscale image of a file, once per file through image_cache
+def load_grayscale(image_path):
+    return image_cache.load("grayscale", image_path, _load_grayscale, lambda img_array: img_array.nbytes)
+
+# Forward 2D real FFT of a grayscale array in float32. Only the non-negative frequencies of the
+# last axis are kept (shape (h, w // 2 + 1), complex64); the rest follow from Hermitian symmetry.
+def compute_spectrum(img_array):
+    with instrumentation.timer("fourier.fft"):
+        return np.fft.rfft2(np.asarray(img_array, dtype=np.float32))
+
+def _load_spectrum(image_path):
+    img_array = load_grayscale(image_path)
+    instrumentation.count("fourier.pixels", img_array.size)
+    spectrum = compute_spectrum(img_array)
+    spectrum.flags.writeable = False
+    return spectrum
+
+# Spectrum of an image file, computed once per file through image_cache
+def load_spectrum(image_path):
+    with instrumentation.timer("fourier.load"):
+        return image_cache.load("spectrum", image_path, _load_spectrum, lambda spectrum: spectrum.nbytes)
+
+# Log-scaled magnitude of the full spectrum, zero frequency in the center, as float32 of `shape`.
+# The missing negative frequencies are mirrored from the half spectrum: X[-u, -v] = conj(X[u, v]).
+def log_magnitude_spectrum(spectrum, shape):
+    height, width = shape
+    half = np.log1p(np.abs(spectrum))
+
+    full = np.empty((height, width), dtype=np.float32)
+    full[:, :half.shape[1]] = half
+    mirrored = width - half.shape[1]
+    if mirrored:
+        rows = -np.arange(height) % height
+        full[:, half.shape[1]:] = half[rows, 1:mirrored + 1][:, ::-1]
+
+    return np.fft.fftshift(full)
+
+# Image recovered from the half spectrum by the inverse real FFT
+def inverse_spectrum(spectrum, shape):
+    with instrumentation.timer("fourier.ifft"):
+        return np.fft.irfft2(spectrum, s=shape)
+
+# Writes a 2D array as .npy (raw values) or as an 8-bit grayscale image scaled to its range,
+# without any GUI backend
+def save_array(path, array):
+    if path.endswith(".npy"):
+        np.save(path, array)
+        return
+
+    low, high = float(array.min()), float(array.max())
+    scaled = (array - low) * (255 / (high - low)) if high > low else np.zeros_like(array)
+    Image.fromarray(scaled.astype(np.uint8), mode='L').save(path)
+
+# Saves the log-magnitude spectrum of an image to output_path (.png or .npy)
+def save_fourier_spectrum(image_path, output_path):
+    shape = load_grayscale(image_path).shape
+    save_array(output_path, log_magnitude_spectrum(load_spectrum(image_path), shape))
+    return output_path
+
+# Output file of every image: <name>_spectrum.<file_format> under output_dir, in the image's directory
+# relative to the deepest directory all images share, so a/x.png and b/x.png do not overwrite each other
+def spectrum_output_paths(image_paths, output_dir, file_format):
+    if not image_paths:
+        return []
+
+    abs_paths = [os.path.abspath(path) for path in image_paths]
+    base_dir = os.path.commonpath({os.path.dirname(path) for path in abs_paths})
+    # Every path starts with base_dir and a separator (base_dir may be the root itself)
+    prefix_length = len(base_dir.rstrip(os.sep)) + 1
+    output_paths = [os.path.join(output_dir, f"{os.path.splitext(path[prefix_length:])[0]}_spectrum.{file_format}")
+                    for path in abs_paths]
+
+    duplicates = [path for path, count in Counter(output_paths).items() if count > 1]
+    if duplicates:
+        raise ValueError(f"Several images map to the same output file: {', '.join(sorted(duplicates))}")
+    return output_paths
 
-    # Apply 2D Fourier Transform
-    fft_result = np.fft.fft2(img_array)
-    # Shift zero frequency component to the center    
-    fft_shifted = np.fft.fftshift(fft_result)
+def _save_spectrum_file(image_path, output_path):
+    try:
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        return {"path": image_path, "output": save_fourier_spectrum(image_path, output_path)}
+    except Exception as e:
+        return {"path": image_path, "error": f"{type(e).__name__}: {e}"}
 
-    # Compute magnitude spectrum and apply logarithmic scaling for visibility
-    magnitude_spectrum = np.abs(fft_shifted)
-    log_magnitude = np.log1p(magnitude_spectrum)
+# Saves the spectrum of every image (see spectrum_output_paths for the file names) in worker processes.
+# Yields {"path", "output"} or {"path", "error"} per file, in input order.
+def save_fourier_spectra(image_paths, output_dir, file_format="png", workers=None):
+    output_paths = spectrum_output_paths(image_paths, output_dir, file_format)
+    os.makedirs(output_dir, exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(_save_spectrum_file, image_paths, output_paths, chunksize=4)
+
+# The image as float32 grayscale strips of rows scaled to [0, 1], straight from the IDAT decoder.
+# The file is mapped (png_parser.iter_chunks) rather than read, and IDAT payloads are inflated as
+# the strips are consumed, so neither the compressed nor the decoded image is held whole and
+# nothing goes through image_cache. Bit depths below 8 and interlaced images are decoded whole
+# with Pillow. Returns ((height, width), iterator over strips).
+def read_grayscale_rows(image_path):
+    chunks = png_parser.iter_chunks(image_path)
+    ihdr = png_parser.parse_IHDR(next(chunks))
+    width, height, bit_depth, color_type = ihdr["width"], ihdr["height"], ihdr["bit_depth"], ihdr["color_type"]
+
+    if ihdr["interlace"] != 0 or bit_depth < 8:
+        chunks.close()
+        img_array = np.array(Image.open(image_path).convert('L'))
+        return (height, width), iter([img_array.astype(np.float32) / 255])
+
+    # PLTE comes before the first IDAT; the generator stays open at that IDAT
+    scale = np.float32(1 / ((1 << bit_depth) - 1))
+    gray_palette = None
+    first_idat = []
+    for chunk in chunks:
+        if chunk.type == "PLTE":
+            palette = np.frombuffer(chunk.data, dtype=np.uint8).reshape(-1, 3).astype(np.float32)
+            gray_palette = np.zeros(256, dtype=np.float32)
+            gray_palette[:len(palette)] = palette @ LUMA_WEIGHTS * scale
+        elif chunk.type == "IDAT":
+            first_idat.append(chunk)
+            break
+
+    if color_type == 3 and gray_palette is None:
+        chunks.close()
+        raise ValueError("Missing PLTE chunk")
+
+    def grayscale_rows():
+        with contextlib.closing(chunks):
+            idat_chunks = (chunk.data for chunk in itertools.chain(first_idat, chunks) if chunk.type == "IDAT")
+            for rows in png_parser.iter_IDAT_rows(idat_chunks, width, height, bit_depth, color_type):
+                if color_type == 3:
+                    yield gray_palette[rows]
+                elif color_type in (2, 6):
+                    yield rows[..., :3].astype(np.float32) @ LUMA_WEIGHTS * scale
+                elif color_type == 4:
+                    yield rows[..., 0].astype(np.float32) * scale
+                else:
+                    yield rows.astype(np.float32) * scale
+
+    return (height, width), grayscale_rows()
+
+# Welch estimate of the power spectrum: the mean periodogram of Hann-windowed tiles of
+# tile_size x tile_size overlapping by half, each with its mean removed. Rows are streamed
+# from the decoder and only a band of about tile_size rows is kept, so memory depends on the
+# image width, not its height. Tiles shrink to fit images smaller than tile_size.
+# Returns (power of shape (tile, tile // 2 + 1) from rfft2, number of tiles).
+def welch_spectrum(image_path, tile_size=WELCH_TILE_SIZE):
+    (height, width), strips = read_grayscale_rows(image_path)
+
+    tile = min(tile_size, height, width)
+    step = max(1, tile // 2)
+    hann = np.hanning(tile).astype(np.float32) if tile > 1 else np.ones(1, dtype=np.float32)
+    window = np.outer(hann, hann)
+
+    power = np.zeros((tile, tile // 2 + 1))
+    tiles = 0
+    band = np.empty((0, width), dtype=np.float32)
+    for rows in strips:
+        band = np.concatenate((band, rows))
+        while len(band) >= tile:
+            # All tiles across the top of the band at once, shape (count, tile, tile)
+            band_tiles = np.lib.stride_tricks.sliding_window_view(band[:tile], (tile, tile))[0, ::step]
+            band_tiles = (band_tiles - band_tiles.mean(axis=(1, 2), keepdims=True)) * window
+            with instrumentation.timer("fourier.fft"):
+                power += np.square(np.abs(np.fft.rfft2(band_tiles))).sum(axis=0)
+            tiles += len(band_tiles)
+            band = band[step:]
+
+    return power / (tiles * np.square(window).sum()), tiles
+
+# Averages an rfft2 power spectrum over rings of equal spatial frequency.
+# Returns (bin centers in cycles per pixel, mean power per bin); empty bins are 0.
+def radial_power_spectrum(power, bins=RADIAL_BINS):
+    tile = power.shape[0]
+    radius = np.hypot(np.fft.fftfreq(tile)[:, None], np.fft.rfftfreq(tile)[None, :])
+
+    # Columns other than 0 and Nyquist stand for two frequencies, +v and -v
+    weights = np.full(power.shape, 2.0)
+    weights[:, 0] = 1
+    if tile % 2 == 0:
+        weights[:, -1] = 1
+
+    index = (radius * (2 * bins)).astype(np.intp)
+    valid = index < bins
+    total = np.bincount(index[valid], weights=(power * weights)[valid], minlength=bins)
+    counts = np.bincount(index[valid], weights=weights[valid], minlength=bins)
+
+    centers = (np.arange(bins) + 0.5) / (2 * bins)
+    return centers, np.divide(total, counts, out=np.zeros(bins), where=counts > 0)
+
+# Compact spectral signature of an image: log10 of the radially averaged Welch power spectrum, float32
+def spectrum_features(image_path, tile_size=WELCH_TILE_SIZE, bins=RADIAL_BINS):
+    power, _ = welch_spectrum(image_path, tile_size)
+    _, radial_power = radial_power_spectrum(power, bins)
+    return np.log10(radial_power + 1e-12).astype(np.float32)
+
+def _spectrum_features_file(image_path, tile_size, bins):
+    try:
+        return {"path": image_path, "features": spectrum_features(image_path, tile_size, bins).tolist()}
+    except Exception as e:
+        return {"path": image_path, "error": f"{type(e).__name__}: {e}"}
+
+# spectrum_features of many files in worker processes, yielding {"path", "features"} or
+# {"path", "error"} per file, in input order
+def spectrum_features_files(image_paths, tile_size=WELCH_TILE_SIZE, bins=RADIAL_BINS, workers=None):
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(_spectrum_features_file, image_paths, [tile_size] * len(image_paths),
+                                [bins] * len(image_paths), chunksize=4)
+
+def display_fourier_spectrum(image_path):
+    import matplotlib.pyplot as plt
+
+    # Transform of the grayscale image, shared with test_fourier_transformation
+    img_array = load_grayscale(image_path)
+    log_magnitude = log_magnitude_spectrum(load_spectrum(image_path), img_array.shape)
 
     # Display the spectrum
     plt.figure(figsize=(8, 8))
@@ -24,18 +277,11 @@ def display_fourier_spectrum(image_path):
     plt.show()
 
 def test_fourier_transformation(image_path):
-    # Open image and convert to grayscale
-    img = Image.open(image_path).convert('L')
-    img_array = np.array(img)
-
-    # Forward 2D Fourier Transform
-    fft_result = np.fft.fft2(img_array)
-
-    # Inverse 2D Fourier Transform
-    ifft_result = np.fft.ifft2(fft_result)
-    
-    # Extract real part of the result (imaginary part should be negligible)
-    recovered_image = np.real(ifft_result)
+    import matplotlib.pyplot as plt
+
+    # Forward transform is reused from load_spectrum, only the inverse is computed here
+    img_array = load_grayscale(image_path)
+    recovered_image = inverse_spectrum(load_spectrum(image_path), img_array.shape)
 
     # Compute pixel-wise absolute difference between original and recovered image
     difference = np.abs(img_array - recovered_image)
@@ -0,0 +1,87 @@
+import os
+from collections import OrderedDict
+
+# Default memory budget of the process-wide cache
+CACHE_BUDGET_BYTES = 256 << 20
+
+# Process-local LRU cache of values derived from files (chunk tables, decoded pixels).
+# Entries are keyed by kind, path, mtime and size, so a rewritten file is never served stale.
+# The least recently used entries are evicted once the byte budget is exceeded.
+class ImageCache:
+    def __init__(self, budget_bytes=CACHE_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self.entries = OrderedDict()  # key -> (value, size)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, value, size):
+        # Values larger than the whole budget are not kept
+        if size > self.budget_bytes:
+            return
+        if key in self.entries:
+            self.size -= self.entries.pop(key)[1]
+
+        self.entries[key] = (value, size)
+        self.size += size
+        while self.size > self.budget_bytes:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+
+    # Drops every entry derived from path
+    def invalidate(self, path):
+        path = os.path.realpath(path)
+        for key in [key for key in self.entries if key[1] == path]:
+            self.size -= self.entries.pop(key)[1]
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "entries": len(self.entries), "bytes": self.size, "budget_bytes": self.budget_bytes}
+
+_cache = ImageCache()
+
+def get_cache():
+    return _cache
+
+# Changes the byte budget, evicting entries if the cache is now over it
+def set_budget(budget_bytes):
+    _cache.budget_bytes = budget_bytes
+    while _cache.size > budget_bytes:
+        _, (_, evicted_size) = _cache.entries.popitem(last=False)
+        _cache.size -= evicted_size
+        _cache.evictions += 1
+
+def file_key(kind, path):
+    stat = os.stat(path)
+    return kind, os.path.realpath(path), stat.st_mtime_ns, stat.st_size
+
+# Returns load(path) for the current state of the file, computing it only on a miss.
+# size_of(value) gives the bytes charged against the budget.
+def load(kind, path, loader, size_of):
+    key = file_key(kind, path)
+    value = _cache.get(key)
+    if value is None:
+        value = loader(path)
+        _cache.put(key, value, size_of(value))
+    return value
+
+def invalidate(path):
+    _cache.invalidate(path)
+
+def stats():
+    return _cache.stats()
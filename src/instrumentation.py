@@ -0,0 +1,112 @@
+import json
+import time
+from contextlib import contextmanager
+
+# Stage timers and byte/block counters for the hot paths. Off by default: timer() then returns
+# a shared no-op context manager and count()/log() return after one flag check.
+# Only the calling process is measured; work done inside block_engine workers is
+# timed as a whole by the stage that dispatched it.
+
+_report = None
+_log_enabled = False
+
+class Report:
+    def __init__(self):
+        self.timers = {}    # stage -> [calls, seconds]
+        self.counters = {}  # name -> total
+
+    def add_time(self, stage, seconds):
+        timer = self.timers.setdefault(stage, [0, 0.0])
+        timer[0] += 1
+        timer[1] += seconds
+
+    def add_count(self, name, value):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self):
+        return {
+            "timers": {stage: {"calls": calls, "seconds": seconds} for stage, (calls, seconds) in sorted(self.timers.items())},
+            "counters": dict(sorted(self.counters.items()))
+        }
+
+    def to_json(self, indent=2):
+        return json.dumps(self.to_dict(), indent=indent)
+
+    # Prometheus text exposition format
+    def to_prometheus(self, prefix="png"):
+        lines = [
+            f"# HELP {prefix}_stage_seconds_total Time spent in each stage.",
+            f"# TYPE {prefix}_stage_seconds_total counter",
+        ]
+        lines += [f'{prefix}_stage_seconds_total{{stage="{stage}"}} {seconds}' for stage, (_, seconds) in sorted(self.timers.items())]
+        lines += [
+            f"# HELP {prefix}_stage_calls_total Number of times each stage ran.",
+            f"# TYPE {prefix}_stage_calls_total counter",
+        ]
+        lines += [f'{prefix}_stage_calls_total{{stage="{stage}"}} {calls}' for stage, (calls, _) in sorted(self.timers.items())]
+        lines += [
+            f"# HELP {prefix}_events_total Bytes, blocks and chunks processed.",
+            f"# TYPE {prefix}_events_total counter",
+        ]
+        lines += [f'{prefix}_events_total{{name="{name}"}} {value}' for name, value in sorted(self.counters.items())]
+        return "\n".join(lines) + "\n"
+
+class _Timer:
+    __slots__ = ("report", "stage", "start")
+
+    def __init__(self, report, stage):
+        self.report = report
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.report.add_time(self.stage, time.perf_counter() - self.start)
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return None
+
+_NULL_TIMER = _NullTimer()
+
+def enabled():
+    return _report is not None
+
+# Context manager timing its body under `stage`
+def timer(stage):
+    if _report is None:
+        return _NULL_TIMER
+    return _Timer(_report, stage)
+
+# Adds value to the counter `name`
+def count(name, value=1):
+    if _report is not None:
+        _report.add_count(name, value)
+
+# Progress messages, printed only while logging is on
+def log(message):
+    if _log_enabled:
+        print(message)
+
+# Collects timers and counters for the body and yields the Report, e.g.
+#     with instrumentation.instrument() as report:
+#         ecb.encrypt_png_ecb(...)
+#     print(report.to_prometheus())
+# log=True also prints the per-chunk progress messages.
+@contextmanager
+def instrument(log=False):
+    global _report, _log_enabled
+
+    previous = _report, _log_enabled
+    _report, _log_enabled = Report(), log
+    try:
+        yield _report
+    finally:
+        _report, _log_enabled = previous
@@ -0,0 +1,95 @@
+import os
+import queue
+import threading
+from Crypto.PublicKey import RSA
+from rsa import PrivateKey, generate_keypair
+
+# Default location of the keypair used by main.py
+KEY_FILE = os.path.join("keys", "private_key.pem")
+
+# Converts a keypair to a pycryptodome RSA key (the private key carries the public part)
+def to_rsa_key(private_key):
+    return RSA.construct((private_key.n, private_key.e, private_key.d, private_key.p, private_key.q))
+
+# Converts a pycryptodome RSA private key back to ((e, n), PrivateKey)
+def from_rsa_key(rsa_key):
+    if not rsa_key.has_private():
+        raise ValueError("Key file does not contain a private key")
+    return (rsa_key.e, rsa_key.n), PrivateKey(rsa_key.d, rsa_key.n, rsa_key.e, rsa_key.p, rsa_key.q)
+
+# Saves a keypair as a PEM file readable only by the owner, optionally encrypted with a passphrase
+def save_keypair(path, private_key, passphrase=None):
+    if passphrase is None:
+        pem = to_rsa_key(private_key).export_key("PEM")
+    else:
+        pem = to_rsa_key(private_key).export_key("PEM", passphrase=passphrase, pkcs=8,
+                                                 protection="scryptAndAES128-CBC")
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(pem)
+
+# Loads a keypair saved with save_keypair, returns ((e, n), PrivateKey)
+def load_keypair(path, passphrase=None):
+    with open(path, "rb") as f:
+        rsa_key = RSA.import_key(f.read(), passphrase=passphrase)
+    return from_rsa_key(rsa_key)
+
+# Loads the keypair from path, generating and saving a new one on first use
+def load_or_create_keypair(path=KEY_FILE, bits=1024, passphrase=None):
+    if os.path.exists(path):
+        return load_keypair(path, passphrase)
+
+    public_key, private_key = generate_keypair(bits)
+    save_keypair(path, private_key, passphrase)
+    return public_key, private_key
+
+# Keeps up to `size` fresh keypairs ready, generated by a background thread.
+# get() is a queue pop when the pool is warm, and waits for the generator otherwise.
+# If generation fails, the thread stops and get() raises its exception.
+class KeyPool:
+    def __init__(self, size=4, bits=1024, workers=None):
+        self.bits = bits
+        self.workers = workers
+        self.keypairs = queue.Queue(maxsize=size)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._fill, daemon=True)
+        self._thread.start()
+
+    def _fill(self):
+        while not self._stop.is_set():
+            try:
+                item = generate_keypair(self.bits, self.workers)
+            except Exception as e:
+                item = e
+            while not self._stop.is_set():
+                try:
+                    self.keypairs.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if isinstance(item, Exception):
+                return
+
+    # Returns a keypair that has never been handed out before
+    def get(self, timeout=None):
+        item = self.keypairs.get(timeout=timeout)
+        if isinstance(item, Exception):
+            # Put back for the next caller, nothing else will be added once the thread failed
+            self.keypairs.put(item)
+            raise item
+        return item
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,12 +1,17 @@
 import png_parser
+import argparse
 import sys
 import os
+import batch
+import instrumentation
 import fourier
 from png_anonymizator import anonymize_png
-from rsa import generate_keypair
+import key_store
 import modes_ecb as ecb
 import modes_cbc as cbc
+import modes_ctr as ctr
 import rsa_lib
+import modes_hybrid as hybrid
 
 def fourier_utils(file_path):
     fourier.display_fourier_spectrum(file_path)
@@ -15,13 +20,18 @@ def fourier_utils(file_path):
 def anonymization_utils(filename ,file_path):
     anonymized_file_path = os.path.join("assets", f"{filename}_anonymized.png")
 
-    anonymize_png(file_path, anonymized_file_path)
-    chunks_anonymized = png_parser.read_chunks(anonymized_file_path)
+    # Per-chunk progress messages and stage timings
+    with instrumentation.instrument(log=True) as report:
+        anonymize_png(file_path, anonymized_file_path)
+    print(report.to_json())
+
+    chunks_anonymized = png_parser.load_chunks(anonymized_file_path)
 
     for chunk in chunks_anonymized:
         print(chunk)
 
-    png_parser.extract_metadata(chunks_anonymized)
+    with instrumentation.instrument(log=True):
+        png_parser.extract_metadata(chunks_anonymized)
 
 def ecb_utils(filename, file_path, public_key, private_key):
     encrypted_path = os.path.join("assets", f"{filename}_ecb_encrypted.png")
@@ -29,13 +39,13 @@ def ecb_utils(filename, file_path, public_key, private_key):
 
     ecb.encrypt_png_ecb(file_path, encrypted_path, public_key)
 
-    encrypted_chunks = png_parser.read_chunks(encrypted_path)
+    encrypted_chunks = png_parser.load_chunks(encrypted_path)
     for chunk in encrypted_chunks:
         print(chunk)
 
     ecb.decrypt_png_ecb(encrypted_path, decrypted_path, private_key)
 
-    decrypted_chunks = png_parser.read_chunks(decrypted_path)
+    decrypted_chunks = png_parser.load_chunks(decrypted_path)
     for chunk in decrypted_chunks:
         print(chunk)
 
@@ -45,13 +55,45 @@ def cbc_utils(filename, file_path, public_key, private_key):
 
     cbc.encrypt_png_cbc(file_path, encrypted_path, public_key)
 
-    encrypted_chunks = png_parser.read_chunks(encrypted_path)
+    encrypted_chunks = png_parser.load_chunks(encrypted_path)
     for chunk in encrypted_chunks:
         print(chunk)
 
     cbc.decrypt_png_cbc(encrypted_path, decrypted_path, private_key)
 
-    decrypted_chunks = png_parser.read_chunks(decrypted_path)
+    decrypted_chunks = png_parser.load_chunks(decrypted_path)
+    for chunk in decrypted_chunks:
+        print(chunk)
+
+def cbc_segmented_utils(filename, file_path, public_key, private_key):
+    encrypted_path = os.path.join("assets", f"{filename}_cbc_segmented_encrypted.png")
+    decrypted_path = os.path.join("assets", f"{filename}_cbc_segmented_decrypted.png")
+
+    cbc.encrypt_png_cbc_segmented(file_path, encrypted_path, public_key)
+
+    encrypted_chunks = png_parser.load_chunks(encrypted_path)
+    for chunk in encrypted_chunks:
+        print(chunk)
+
+    cbc.decrypt_png_cbc_segmented(encrypted_path, decrypted_path, private_key)
+
+    decrypted_chunks = png_parser.load_chunks(decrypted_path)
+    for chunk in decrypted_chunks:
+        print(chunk)
+
+def ctr_utils(filename, file_path, public_key, private_key):
+    encrypted_path = os.path.join("assets", f"{filename}_ctr_encrypted.png")
+    decrypted_path = os.path.join("assets", f"{filename}_ctr_decrypted.png")
+
+    ctr.encrypt_png_ctr(file_path, encrypted_path, public_key)
+
+    encrypted_chunks = png_parser.load_chunks(encrypted_path)
+    for chunk in encrypted_chunks:
+        print(chunk)
+
+    ctr.decrypt_png_ctr(encrypted_path, decrypted_path, private_key)
+
+    decrypted_chunks = png_parser.load_chunks(decrypted_path)
     for chunk in decrypted_chunks:
         print(chunk)
 
@@ -61,28 +103,121 @@ def rsa_lib_utils(filename, file_path, public_key, private_key):
 
     rsa_lib.encrypt_png_rsa_lib(file_path, encrypted_path, public_key)
 
-    encrypted_chunks = png_parser.read_chunks(encrypted_path)
+    encrypted_chunks = png_parser.load_chunks(encrypted_path)
     for chunk in encrypted_chunks:
         print(chunk)
 
     rsa_lib.decrypt_png_rsa_lib(encrypted_path, decrypted_path, private_key)
 
-    decrypted_chunks = png_parser.read_chunks(decrypted_path)
+    decrypted_chunks = png_parser.load_chunks(decrypted_path)
     for chunk in decrypted_chunks:
         print(chunk)
 
+def hybrid_utils(filename, file_path, public_key, private_key):
+    encrypted_path = os.path.join("assets", f"{filename}_hybrid_encrypted.png")
+    decrypted_path = os.path.join("assets", f"{filename}_hybrid_decrypted.png")
+
+    hybrid.encrypt_png_hybrid(file_path, encrypted_path, public_key)
+
+    encrypted_chunks = png_parser.load_chunks(encrypted_path)
+    for chunk in encrypted_chunks:
+        print(chunk)
+
+    hybrid.decrypt_png_hybrid(encrypted_path, decrypted_path, private_key)
+
+    decrypted_chunks = png_parser.load_chunks(decrypted_path)
+    for chunk in decrypted_chunks:
+        print(chunk)
+
+def verify_utils(file_paths):
+    corrupted = 0
+
+    for file_path, report in png_parser.verify_files(file_paths):
+        if report is None:
+            print(f"OK {file_path}")
+            continue
+
+        corrupted += 1
+        if "error" in report:
+            print(f"BAD {file_path}: {report['error']}")
+        else:
+            print(f"BAD {file_path}: chunk #{report['index']} {report['type']} at offset {report['offset']} "
+                  f"(stored CRC {report['stored_crc']:08x}, computed {report['computed_crc']:08x})")
+
+    return 1 if corrupted else 0
+
+def batch_utils(args):
+    parser = argparse.ArgumentParser(prog="main.py batch", description="Analyze many PNG files, writing NDJSON to stdout")
+    parser.add_argument("paths", nargs="+", help="directories (searched recursively) or glob patterns")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--chunksize", type=int, default=8, help="files handed to a worker at once")
+    parser.add_argument("--store", default=None, help="SQLite file keeping results between runs")
+    args = parser.parse_args(args)
+
+    file_paths = []
+    for path in args.paths:
+        file_paths.extend(batch.find_png_files(path))
+
+    results = batch.analyze_files(file_paths, workers=args.workers, chunksize=args.chunksize, store_path=args.store)
+    failed = batch.write_ndjson(results, sys.stdout)
+
+    print(f"Analyzed {len(file_paths)} files, {failed} failed", file=sys.stderr)
+    return 1 if failed else 0
+
+def fourier_batch_utils(args):
+    parser = argparse.ArgumentParser(prog="main.py fourier", description="Save the Fourier spectrum of many PNG files")
+    parser.add_argument("paths", nargs="+", help="directories (searched recursively) or glob patterns")
+    parser.add_argument("--output", default="spectra", help="directory for the <name>_spectrum files")
+    parser.add_argument("--format", choices=("png", "npy"), default="png")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--features", action="store_true",
+                        help="write radially averaged Welch spectra as NDJSON to stdout instead of saving spectra")
+    parser.add_argument("--tile-size", type=int, default=fourier.WELCH_TILE_SIZE, help="Welch tile edge length")
+    args = parser.parse_args(args)
+
+    file_paths = []
+    for path in args.paths:
+        file_paths.extend(batch.find_png_files(path))
+
+    if args.features:
+        results = fourier.spectrum_features_files(file_paths, args.tile_size, workers=args.workers)
+        return 1 if batch.write_ndjson(results, sys.stdout) else 0
+
+    failed = 0
+    for result in fourier.save_fourier_spectra(file_paths, args.output, args.format, args.workers):
+        if "error" in result:
+            failed += 1
+            print(f"{result['path']}: {result['error']}", file=sys.stderr)
+        else:
+            print(result["output"])
+
+    return 1 if failed else 0
 
 if __name__ == "__main__":
-    if len(sys.argv) < 1:
+    if len(sys.argv) < 2:
         print("Filename argument is missing")
         exit(1)
 
+    # Usage: main.py verify <file.png> [<file.png> ...]
+    if sys.argv[1] == "verify":
+        exit(verify_utils(sys.argv[2:]))
+
+    # Usage: main.py batch <directory or glob> [...] [--workers N] [--chunksize K] [--store results.db]
+    if sys.argv[1] == "batch":
+        exit(batch_utils(sys.argv[2:]))
+
+    # Usage: main.py fourier <directory or glob> [...] [--output DIR] [--format png|npy] [--workers N]
+    #        main.py fourier <directory or glob> [...] --features [--tile-size N] [--workers N]
+    if sys.argv[1] == "fourier":
+        exit(fourier_batch_utils(sys.argv[2:]))
+
     filename = sys.argv[1]
     file_path = os.path.join("assets", f"{filename}.png")
 
-    public_key, private_key = generate_keypair(bits=1024)
+    # Keys persist in keys/, so files encrypted by an earlier run can still be decrypted
+    public_key, private_key = key_store.load_or_create_keypair(key_store.KEY_FILE, bits=1024)
 
-    #chunks = png_parser.read_chunks(file_path)
+    #chunks = png_parser.load_chunks(file_path)
     #for chunk in chunks:
         #print(chunk)
     
@@ -96,4 +231,10 @@ if __name__ == "__main__":
 
     cbc_utils(filename, file_path, public_key, private_key)
 
-    rsa_lib_utils(filename, file_path, public_key, private_key)
\ No newline at end of file
+    cbc_segmented_utils(filename, file_path, public_key, private_key)
+
+    ctr_utils(filename, file_path, public_key, private_key)
+
+    rsa_lib_utils(filename, file_path, public_key, private_key)
+
+    hybrid_utils(filename, file_path, public_key, private_key)
\ No newline at end of file
@@ -1,20 +1,99 @@
 import os
+import struct
 import zlib
+from functools import partial
+import numpy as np
 from chunks import PngChunk
 import png_parser
+import block_engine
+import instrumentation
 
 # Initialization vector
 IV = os.urandom(245)
 
+# Private ancillary chunk of the segmented mode: segment size in blocks, plaintext length
+# and one IV per segment. Uppercase 4th letter: unsafe to copy, it belongs to the IDAT data.
+IV_CHUNK_TYPE = "cbIV"
+
+# Plaintext blocks per segment in the segmented mode
+SEGMENT_BLOCKS = 256
+
 # Computes CRC for a given PNG chunk type and data
 def compute_crc(chunk_type, data):
     check_bytes = chunk_type.encode('ascii') + data
     crc = zlib.crc32(check_bytes) & 0xffffffff
     return crc
 
-# XORs two byte sequences
+# XORs two byte sequences (truncated to the shorter one) as whole buffers
 def xor_bytes(a, b):
-    return bytes(x ^ y for x, y in zip(a, b))
+    length = min(len(a), len(b))
+    return np.bitwise_xor(np.frombuffer(a, dtype=np.uint8, count=length),
+                          np.frombuffer(b, dtype=np.uint8, count=length)).tobytes()
+
+# RSA-decrypts consecutive ciphertext blocks without the CBC XOR, runs in block_engine workers
+def decrypt_blocks_cbc(data, private_key, block_size, chunk_size):
+    decrypted_data = bytearray()
+
+    for i in range(0, len(data), block_size):
+        c = int.from_bytes(data[i:i + block_size], byteorder='big')  # Convert encrypted block to int
+        m = private_key.decrypt(c)  # RSA decryption: c^d mod n, computed with CRT
+        decrypted_data.extend(m.to_bytes(chunk_size, byteorder='big'))  # Convert block back to bytes
+
+    return bytes(decrypted_data)
+
+# Returns (block_size, chunk_size): ciphertext and plaintext block sizes for the RSA modulus
+def get_block_sizes(key):
+    n_bits = key[1].bit_length()
+    block_size = n_bits // 8
+    if n_bits % 8 != 0:
+        block_size += 1
+
+    return block_size, block_size - 11
+
+# CBC-encrypts data made of whole chunk_size blocks, starting from iv
+def cbc_encrypt(data, public_key, iv, block_size, chunk_size):
+    if len(iv) < chunk_size:
+        raise ValueError("IV is shorter than the CBC block")
+
+    encrypted_data = bytearray()
+    shift = 8 * (block_size - chunk_size)
+    prev_block = int.from_bytes(iv[:chunk_size], byteorder='big')  # Start CBC with initial vector
+
+    # Encrypt data, XOR-ing blocks as integers
+    for i in range(0, len(data), chunk_size):
+        m = int.from_bytes(data[i:i + chunk_size], byteorder='big') ^ prev_block  # XOR current block with a previous one or IV (if first iteration)
+        c = pow(m, public_key[0], public_key[1])  # RSA encryption: c = m^e mod n
+        encrypted_data.extend(c.to_bytes(block_size, byteorder='big'))  # Convert block back to bytes
+        prev_block = c >> shift  # First chunk_size bytes of the encrypted block, for the next iteration
+
+    return bytes(encrypted_data)
+
+# CBC-decrypts data made of whole block_size blocks, starting from iv.
+# The RSA step of all blocks is independent and is spread over `workers`, then the XOR is
+# undone for the whole buffer at once: plaintext i = D(c_i) XOR c_(i-1), with the IV as c_(-1)
+def cbc_decrypt(data, private_key, iv, block_size, chunk_size, workers=1):
+    if len(iv) < chunk_size:
+        raise ValueError("IV is shorter than the CBC block")
+
+    decrypt_batch = partial(decrypt_blocks_cbc, private_key=private_key, block_size=block_size, chunk_size=chunk_size)
+    decrypted = np.frombuffer(block_engine.map_blocks(decrypt_batch, data, block_size, workers), dtype=np.uint8)
+
+    blocks = np.frombuffer(data, dtype=np.uint8).reshape((-1, block_size))
+    prev_blocks = np.empty((len(blocks), chunk_size), dtype=np.uint8)
+    prev_blocks[:1] = np.frombuffer(iv, dtype=np.uint8, count=chunk_size)
+    prev_blocks[1:] = blocks[:-1, :chunk_size]
+
+    return np.bitwise_xor(decrypted, prev_blocks.reshape(-1)).tobytes()
+
+# Encrypts one (iv, plaintext) segment of the segmented mode, runs in block_engine workers
+def encrypt_segment_cbc(segment, public_key, block_size, chunk_size):
+    iv, data = segment
+    return cbc_encrypt(data, public_key, iv, block_size, chunk_size)
+
+# Decrypts one (iv, ciphertext) segment of the segmented mode, independent of all other segments
+def decrypt_segment_cbc(segment, private_key, block_size, chunk_size):
+    iv, data = segment
+    return cbc_decrypt(data, private_key, iv, block_size, chunk_size)
 
 # Encrypts a single PNG chunk
 def encrypt_chunk_cbc(chunk: PngChunk, public_key, iv: bytes) -> PngChunk:
@@ -23,74 +102,52 @@ def encrypt_chunk_cbc(chunk: PngChunk, public_key, iv: bytes) -> PngChunk:
         return chunk
 
     # Determine block size from RSA modulus
-    n_bits = public_key[1].bit_length()
-    block_size = n_bits // 8
-    if n_bits % 8 != 0:
-        block_size += 1
-
-    chunk_size = block_size - 11
-    data = zlib.decompress(chunk.data)
+    block_size, chunk_size = get_block_sizes(public_key)
+    with instrumentation.timer("cbc.inflate"):
+        data = zlib.decompress(chunk.data)
 
     if len(data) % chunk_size != 0:
         padding_size = chunk_size - len(data) % chunk_size
         data += b'\x00' * padding_size
+    instrumentation.count("cbc.bytes", len(data))
+    instrumentation.count("cbc.blocks", len(data) // chunk_size)
 
-    encrypted_data = bytearray()
-    prev_block = iv  # Start CBC with initial vector
+    with instrumentation.timer("cbc.encrypt_rsa"):
+        encrypted_data = cbc_encrypt(data, public_key, iv, block_size, chunk_size)
 
-    # Encrypt data
-    for i in range(0, len(data), chunk_size):
-        block = data[i:i + chunk_size]
-        block = xor_bytes(block, prev_block[:chunk_size])  # XOR current block with a previous one or IV (if first iteration)
-        m = int.from_bytes(block, byteorder='big')  # Convert block to int
-        c = pow(m, public_key[0], public_key[1])  # RSA encryption: c = m^e mod n
-        encrypted_block = c.to_bytes(block_size, byteorder='big')  # Convert block back to bytes
-        encrypted_data.extend(encrypted_block)
-        prev_block = encrypted_block  # Update previous block for next iteration
-
-    encrypted_data = zlib.compress(encrypted_data)
+    with instrumentation.timer("cbc.deflate"):
+        encrypted_data = zlib.compress(encrypted_data)
     new_crc = compute_crc(chunk.type, encrypted_data)
     return PngChunk(length=len(encrypted_data), chunk_type=chunk.type, data=encrypted_data, crc=new_crc)
 
 # Decrypts a single PNG chunk
-def decrypt_chunk_cbc(chunk: PngChunk, private_key, iv: bytes) -> PngChunk:
+def decrypt_chunk_cbc(chunk: PngChunk, private_key, iv: bytes, workers=None) -> PngChunk:
     # Decrypt only IDAT chunks
     if chunk.type != 'IDAT':
         return chunk
 
-    n_bits = private_key[1].bit_length()
-    block_size = n_bits // 8
-    if n_bits % 8 != 0:
-        block_size += 1
-
-    data = zlib.decompress(chunk.data)
+    block_size, chunk_size = get_block_sizes(private_key)
+    with instrumentation.timer("cbc.inflate"):
+        data = zlib.decompress(chunk.data)
 
     if len(data) % block_size != 0:
         raise ValueError(f"Chunk {chunk.type} has invalid encrypted length")
+    instrumentation.count("cbc.bytes", len(data))
+    instrumentation.count("cbc.blocks", len(data) // block_size)
 
-    decrypted_data = bytearray()
-    prev_block = iv
-    chunk_size = block_size - 11
-
-    # Decrypt data
-    for i in range(0, len(data), block_size):
-        block = data[i:i + block_size]
-        c = int.from_bytes(block, byteorder='big')  # Convert encrypted block to int
-        m = pow(c, private_key[0], private_key[1])  # RSA decryption: c^d mod n
-        decrypted_block = m.to_bytes(chunk_size, byteorder='big')  # Convert block back to bytes
-        decrypted_block = xor_bytes(decrypted_block, prev_block[:chunk_size])  # XOR with a previous block
-        decrypted_data.extend(decrypted_block)
-        prev_block = block  # Update the previous block for next iteration
+    with instrumentation.timer("cbc.decrypt_rsa"):
+        decrypted_data = bytearray(cbc_decrypt(data, private_key, iv, block_size, chunk_size, workers))
 
     decrypted_data = decrypted_data.rstrip(b'\x00')
 
-    decrypted_data = zlib.compress(decrypted_data)
+    with instrumentation.timer("cbc.deflate"):
+        decrypted_data = zlib.compress(decrypted_data)
     new_crc = compute_crc(chunk.type, decrypted_data)
     return PngChunk(length=len(decrypted_data), chunk_type=chunk.type, data=decrypted_data, crc=new_crc)
 
 # Encrypt PNG file
 def encrypt_png_cbc(input_path: str, output_path: str, public_key) -> None:
-    chunks = png_parser.read_chunks(input_path)
+    chunks = png_parser.load_chunks(input_path)
 
     encrypted_chunks = []
     for chunk in chunks:
@@ -101,13 +158,95 @@ def encrypt_png_cbc(input_path: str, output_path: str, public_key) -> None:
     print(f"Encrypted with CBC successfully - {output_path}")
 
 # Decrypt PNG file
-def decrypt_png_cbc(input_path: str, output_path: str, private_key) -> None:
-    chunks = png_parser.read_chunks(input_path)
+def decrypt_png_cbc(input_path: str, output_path: str, private_key, workers=None) -> None:
+    chunks = png_parser.load_chunks(input_path)
 
     decrypted_chunks = []
     for chunk in chunks:
-        decrypted_chunk = decrypt_chunk_cbc(chunk, private_key, IV)
+        decrypted_chunk = decrypt_chunk_cbc(chunk, private_key, IV, workers)
         decrypted_chunks.append(decrypted_chunk)
 
     png_parser.write_chunks(output_path, decrypted_chunks)
-    print(f"Decrypted with CBC successfully - {output_path}")
\ No newline at end of file
+    print(f"Decrypted with CBC successfully - {output_path}")
+
+# Encrypt PNG file in segmented CBC mode. The IDAT stream is split into segments of
+# SEGMENT_BLOCKS blocks, each chained from its own random IV, so segments are encrypted
+# in parallel and any segment can be decrypted on its own. The IVs are stored in a cbIV chunk.
+def encrypt_png_cbc_segmented(input_path: str, output_path: str, public_key, workers=None) -> None:
+    chunks = png_parser.load_chunks(input_path)
+    block_size, chunk_size = get_block_sizes(public_key)
+
+    with instrumentation.timer("cbc.inflate"):
+        data = zlib.decompress(b''.join(chunk.data for chunk in chunks if chunk.type == 'IDAT'))
+    padded_data = data + b'\x00' * (-len(data) % chunk_size)
+    instrumentation.count("cbc.bytes", len(padded_data))
+    instrumentation.count("cbc.blocks", len(padded_data) // chunk_size)
+
+    segment_size = SEGMENT_BLOCKS * chunk_size
+    segments = [(os.urandom(chunk_size), padded_data[i:i + segment_size])
+                for i in range(0, len(padded_data), segment_size)]
+
+    encrypt_segment = partial(encrypt_segment_cbc, public_key=public_key, block_size=block_size, chunk_size=chunk_size)
+    with instrumentation.timer("cbc.encrypt_rsa"):
+        encrypted_data = b''.join(block_engine.map_batches(encrypt_segment, segments, workers))
+    with instrumentation.timer("cbc.deflate"):
+        encrypted_data = zlib.compress(encrypted_data)
+    iv_data = struct.pack(">IQ", SEGMENT_BLOCKS, len(data)) + b''.join(iv for iv, _ in segments)
+
+    encrypted_chunks = []
+    for chunk in chunks:
+        if chunk.type == 'IDAT':
+            # IV chunk and the single encrypted IDAT go where the first IDAT was
+            if encrypted_data is not None:
+                encrypted_chunks.append(PngChunk(len(iv_data), IV_CHUNK_TYPE, iv_data, compute_crc(IV_CHUNK_TYPE, iv_data)))
+                encrypted_chunks.append(PngChunk(len(encrypted_data), 'IDAT', encrypted_data, compute_crc('IDAT', encrypted_data)))
+                encrypted_data = None
+        else:
+            encrypted_chunks.append(chunk)
+
+    png_parser.write_chunks(output_path, encrypted_chunks)
+    print(f"Encrypted with segmented CBC successfully - {output_path}")
+
+# Decrypt PNG file encrypted in segmented CBC mode
+def decrypt_png_cbc_segmented(input_path: str, output_path: str, private_key, workers=None) -> None:
+    chunks = png_parser.load_chunks(input_path)
+    block_size, chunk_size = get_block_sizes(private_key)
+
+    iv_chunk = next((chunk for chunk in chunks if chunk.type == IV_CHUNK_TYPE), None)
+    if iv_chunk is None:
+        raise ValueError(f"Missing {IV_CHUNK_TYPE} chunk, file is not encrypted in segmented CBC mode")
+
+    iv_data = bytes(iv_chunk.data)
+    segment_blocks, data_length = struct.unpack_from(">IQ", iv_data)
+    ivs = iv_data[struct.calcsize(">IQ"):]
+    if len(ivs) % chunk_size != 0:
+        raise ValueError(f"Chunk {IV_CHUNK_TYPE} does not match the key size")
+
+    with instrumentation.timer("cbc.inflate"):
+        data = zlib.decompress(b''.join(chunk.data for chunk in chunks if chunk.type == 'IDAT'))
+    segment_size = segment_blocks * block_size
+    if len(data) % block_size != 0 or -(-len(data) // segment_size) != len(ivs) // chunk_size:
+        raise ValueError("IDAT has invalid encrypted length")
+
+    segments = [(ivs[k * chunk_size:(k + 1) * chunk_size], data[k * segment_size:(k + 1) * segment_size])
+                for k in range(len(ivs) // chunk_size)]
+
+    decrypt_segment = partial(decrypt_segment_cbc, private_key=private_key, block_size=block_size, chunk_size=chunk_size)
+    instrumentation.count("cbc.bytes", len(data))
+    instrumentation.count("cbc.blocks", len(data) // block_size)
+    with instrumentation.timer("cbc.decrypt_rsa"):
+        decrypted_data = b''.join(block_engine.map_batches(decrypt_segment, segments, workers))[:data_length]
+    with instrumentation.timer("cbc.deflate"):
+        decrypted_data = zlib.compress(decrypted_data)
+
+    decrypted_chunks = []
+    for chunk in chunks:
+        if chunk.type == 'IDAT':
+            if decrypted_data is not None:
+                decrypted_chunks.append(PngChunk(len(decrypted_data), 'IDAT', decrypted_data, compute_crc('IDAT', decrypted_data)))
+                decrypted_data = None
+        elif chunk.type != IV_CHUNK_TYPE:
+            decrypted_chunks.append(chunk)
+
+    png_parser.write_chunks(output_path, decrypted_chunks)
+    print(f"Decrypted with segmented CBC successfully - {output_path}")
@@ -0,0 +1,127 @@
+import hashlib
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import numpy as np
+from chunks import PngChunk
+import png_parser
+import block_engine
+from modes_hybrid import wrap_key, unwrap_key
+
+# Private ancillary chunk holding the RSA-wrapped keystream nonce.
+# Uppercase 4th letter: unsafe to copy, it belongs to the IDAT data.
+KEY_CHUNK_TYPE = "ctKY"
+
+COUNTER_SIZE = 8
+
+# Computes CRC for a given PNG chunk type and data
+def compute_crc(chunk_type, data):
+    check_bytes = chunk_type.encode('ascii') + data
+    crc = zlib.crc32(check_bytes) & 0xFFFFFFFF
+    return crc
+
+# Keystream bytes produced per counter block. The most significant byte of an RSA
+# output is biased (the value is below n), so it is dropped.
+def get_keystream_block_size(public_key):
+    return (public_key[1].bit_length() + 7) // 8 - 1
+
+# RSA input of one counter block: SHAKE-256 of (nonce || counter), as wide as n and reduced mod n.
+# Raw (nonce || counter) values would be short and differ by 1: with e = 3 their cubes stay below n,
+# so a known keystream block gives away the nonce by a cube root, and related inputs under one key
+# are open to the Franklin-Reiter attack.
+def counter_block(nonce, counter, n):
+    digest = hashlib.shake_256(nonce + counter.to_bytes(COUNTER_SIZE, byteorder='big')).digest((n.bit_length() + 7) // 8)
+    return int.from_bytes(digest, byteorder='big') % n
+
+# Keystream blocks [first_block, first_block + count): RSA-encrypted counter blocks, runs in block_engine workers
+def keystream_blocks(block_range, public_key, nonce):
+    first_block, count = block_range
+    e, n = public_key
+    keystream_block_size = get_keystream_block_size(public_key)
+    mask = (1 << (8 * keystream_block_size)) - 1
+
+    keystream = bytearray()
+    for counter in range(first_block, first_block + count):
+        c = pow(counter_block(nonce, counter, n), e, n)
+        keystream.extend((c & mask).to_bytes(keystream_block_size, byteorder='big'))
+
+    return bytes(keystream)
+
+# Generates at least `length` keystream bytes starting at counter first_block, spread over workers.
+# Independent of the data, so it can be computed ahead of time.
+def generate_keystream(public_key, nonce, length, workers=None, first_block=0):
+    keystream_block_size = get_keystream_block_size(public_key)
+    blocks = -(-length // keystream_block_size)
+    batch_blocks = block_engine.BLOCKS_PER_BATCH
+
+    block_ranges = [(first_block + start, min(batch_blocks, blocks - start)) for start in range(0, blocks, batch_blocks)]
+    keystream_batch = partial(keystream_blocks, public_key=public_key, nonce=nonce)
+
+    return b''.join(block_engine.map_batches(keystream_batch, block_ranges, workers))
+
+# XORs data with the start of the keystream
+def apply_keystream(data, keystream):
+    return np.bitwise_xor(np.frombuffer(data, dtype=np.uint8),
+                          np.frombuffer(keystream, dtype=np.uint8, count=len(data))).tobytes()
+
+# Size of the inflated IDAT stream predicted from IHDR, or 0 if it cannot be predicted
+def expected_idat_length(ihdr):
+    if ihdr["interlace"] != 0:
+        return 0
+    bytes_per_scanline = png_parser.get_bytes_per_scanline(ihdr["width"], ihdr["color_type"], ihdr["bit_depth"])
+    return ihdr["height"] * (bytes_per_scanline + 1)
+
+# Replaces all IDAT chunks with a single one holding `data`, preceded by `key_chunk` if given
+def replace_idat(chunks, data, key_chunk=None):
+    new_chunks = []
+    for chunk in chunks:
+        if chunk.type == 'IDAT':
+            if data is not None:
+                if key_chunk is not None:
+                    new_chunks.append(key_chunk)
+                new_chunks.append(PngChunk(len(data), 'IDAT', data, compute_crc('IDAT', data)))
+                data = None
+        elif chunk.type != KEY_CHUNK_TYPE:
+            new_chunks.append(chunk)
+
+    return new_chunks
+
+# Encrypt PNG file in counter mode. The keystream nonce is derived from a random RSA-wrapped
+# value, so only the private key holder can rebuild the keystream.
+def encrypt_png_ctr(input_path: str, output_path: str, public_key, workers=None) -> None:
+    chunks = png_parser.load_chunks(input_path)
+    ihdr = png_parser.parse_IHDR(next(chunk for chunk in chunks if chunk.type == 'IHDR'))
+    nonce, wrapped_nonce = wrap_key(public_key)
+
+    # Generate the keystream in the background while the IDAT stream is inflated
+    with ThreadPoolExecutor(max_workers=1) as background:
+        keystream_future = background.submit(generate_keystream, public_key, nonce, expected_idat_length(ihdr), workers)
+        data = zlib.decompress(b''.join(chunk.data for chunk in chunks if chunk.type == 'IDAT'))
+        keystream = keystream_future.result()
+
+    if len(keystream) < len(data):
+        first_block = len(keystream) // get_keystream_block_size(public_key)
+        keystream += generate_keystream(public_key, nonce, len(data) - len(keystream), workers, first_block)
+
+    encrypted_data = zlib.compress(apply_keystream(data, keystream))
+    key_chunk = PngChunk(len(wrapped_nonce), KEY_CHUNK_TYPE, wrapped_nonce, compute_crc(KEY_CHUNK_TYPE, wrapped_nonce))
+
+    png_parser.write_chunks(output_path, replace_idat(chunks, encrypted_data, key_chunk))
+    print(f"Encrypted with CTR successfully - {output_path}")
+
+# Decrypt PNG file encrypted in counter mode
+def decrypt_png_ctr(input_path: str, output_path: str, private_key, workers=None) -> None:
+    chunks = png_parser.load_chunks(input_path)
+    key_chunk = next((chunk for chunk in chunks if chunk.type == KEY_CHUNK_TYPE), None)
+    if key_chunk is None:
+        raise ValueError(f"Missing {KEY_CHUNK_TYPE} chunk, file is not encrypted in CTR mode")
+
+    nonce = unwrap_key(bytes(key_chunk.data), private_key)
+    public_key = (private_key.e, private_key.n)
+
+    data = zlib.decompress(b''.join(chunk.data for chunk in chunks if chunk.type == 'IDAT'))
+    keystream = generate_keystream(public_key, nonce, len(data), workers)
+    decrypted_data = zlib.compress(apply_keystream(data, keystream))
+
+    png_parser.write_chunks(output_path, replace_idat(chunks, decrypted_data))
+    print(f"Decrypted with CTR successfully - {output_path}")
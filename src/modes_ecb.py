@@ -1,6 +1,11 @@
+import hashlib
 import zlib
+from collections import OrderedDict
+from functools import partial
 from chunks import PngChunk
 import png_parser
+import block_engine
+import instrumentation
 
 
 # Computes the CRC checksum for a given PNG chunk
@@ -9,18 +14,99 @@ def compute_crc(chunk_type, data):
     crc = zlib.crc32(check_bytes) & 0xFFFFFFFF
     return crc
 
-def encrypt_chunk_ecb(chunk, public_key):
-    if chunk.type != "IDAT":
-        return chunk
-    
-    # Determine RSA key block size
-    n_bits = public_key[1].bit_length()
-    block_size = n_bits // 8 - 1
-    
+# Maximum number of blocks kept per key in a BlockCache
+BLOCK_CACHE_SIZE = 65536
+
+# Bounded LRU map from input block to output block for one key and direction.
+# ECB is deterministic, so repeated blocks (flat image areas) only need one exponentiation.
+class BlockCache:
+    def __init__(self, max_size=BLOCK_CACHE_SIZE):
+        self.max_size = max_size
+        self.blocks = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, block):
+        result = self.blocks.get(block)
+        if result is not None:
+            self.blocks.move_to_end(block)
+        return result
+
+    def put(self, block, result):
+        self.blocks[block] = result
+        self.blocks.move_to_end(block)
+        if len(self.blocks) > self.max_size:
+            self.blocks.popitem(last=False)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.blocks)}
+
+# Maximum number of keys (per direction) with a BlockCache; the least recently used is dropped
+BLOCK_CACHE_KEYS = 4
+
+# (direction, key digest) -> BlockCache, least recently used first
+_block_caches = OrderedDict()
+
+# Returns the cache for a key. Caches are found by a digest of the key numbers, so the
+# private exponent itself is not kept as a dict key.
+def get_block_cache(direction, key):
+    cache_key = (direction, hashlib.sha256(repr(tuple(key)).encode("ascii")).digest())
+    cache = _block_caches.get(cache_key)
+    if cache is None:
+        cache = _block_caches[cache_key] = BlockCache()
+        if len(_block_caches) > BLOCK_CACHE_KEYS:
+            _block_caches.popitem(last=False)
+    _block_caches.move_to_end(cache_key)
+    return cache
+
+# Hit/miss counters of every cache, e.g. {"encrypt": {"hits": .., "misses": .., "size": ..}, ...}
+def get_cache_stats():
+    stats = {}
+    for (direction, _), cache in _block_caches.items():
+        total = stats.setdefault(direction, {"hits": 0, "misses": 0, "size": 0})
+        for name, value in cache.stats().items():
+            total[name] += value
+    return stats
+
+# Drops every cached block. Decrypt caches hold plaintext blocks, so call this once a key
+# is no longer in use to release them instead of waiting for BLOCK_CACHE_KEYS newer keys.
+def clear_block_caches():
+    _block_caches.clear()
+
+# Runs batch_function only on blocks not seen before (in the cache or earlier in data),
+# then assembles the output from the per-block results. A short last block stays last
+# among the missing blocks, so they can still be batched by map_blocks.
+def map_blocks_cached(batch_function, data, block_size, output_block_size, cache, workers=None):
+    blocks = [bytes(data[i:i + block_size]) for i in range(0, len(data), block_size)]
+
+    results = {}
+    missing = []
+    for block in blocks:
+        if block in results:
+            cache.hits += 1
+            continue
+        result = cache.get(block)
+        if result is None:
+            cache.misses += 1
+            missing.append(block)
+        else:
+            cache.hits += 1
+        results[block] = result
+
+    instrumentation.count("ecb.blocks", len(blocks))
+    instrumentation.count("ecb.rsa_blocks", len(missing))
+    computed = block_engine.map_blocks(batch_function, b''.join(missing), block_size, workers)
+    for i, block in enumerate(missing):
+        result = computed[i * output_block_size:(i + 1) * output_block_size]
+        results[block] = result
+        cache.put(block, result)
+
+    return b''.join(results[block] for block in blocks)
+
+# Encrypts consecutive plaintext blocks, runs in block_engine workers
+def encrypt_blocks_ecb(data, public_key, block_size):
     encrypted_data = bytearray()
-    data = zlib.decompress(chunk.data)
-    
-    # Encrypt each plaintext block
+
     for i in range(0, len(data), block_size):
         block = data[i:i+block_size]
         m = int.from_bytes(block, byteorder='big')
@@ -29,51 +115,85 @@ def encrypt_chunk_ecb(chunk, public_key):
         encrypted_block = c.to_bytes(block_size+1, byteorder='big')
 
         encrypted_data.extend(encrypted_block)
+
+    return bytes(encrypted_data)
+
+# Decrypts consecutive ciphertext blocks, runs in block_engine workers
+def decrypt_blocks_ecb(data, private_key, block_size):
+    decrypted_data = bytearray()
+
+    for i in range(0, len(data), block_size):
+        block = data[i:i+block_size]
+        c = int.from_bytes(block, byteorder='big')
+        m = private_key.decrypt(c)
+        decrypted_block = m.to_bytes(block_size-1, byteorder='big')
+        decrypted_data.extend(decrypted_block)
+
+    return bytes(decrypted_data)
+
+def encrypt_chunk_ecb(chunk, public_key, workers=None):
+    if chunk.type != "IDAT":
+        return chunk
     
-    encrypted_chunk_data = zlib.compress(encrypted_data)
+    # Determine RSA key block size
+    n_bits = public_key[1].bit_length()
+    block_size = n_bits // 8 - 1
+    
+    with instrumentation.timer("ecb.inflate"):
+        data = zlib.decompress(chunk.data)
+    instrumentation.count("ecb.bytes", len(data))
+    
+    # Encrypt each plaintext block
+    encrypt_batch = partial(encrypt_blocks_ecb, public_key=public_key, block_size=block_size)
+    cache = get_block_cache("encrypt", public_key)
+    with instrumentation.timer("ecb.encrypt_rsa"):
+        encrypted_data = map_blocks_cached(encrypt_batch, data, block_size, block_size + 1, cache, workers)
+    
+    with instrumentation.timer("ecb.deflate"):
+        encrypted_chunk_data = zlib.compress(encrypted_data)
     new_crc = compute_crc(chunk.type, encrypted_chunk_data)
     
     return PngChunk(len(encrypted_chunk_data), chunk.type, encrypted_chunk_data, new_crc)
 
-def decrypt_chunk_ecb(chunk, private_key):
+def decrypt_chunk_ecb(chunk, private_key, workers=None):
     if chunk.type != "IDAT":
         return chunk
     
     n_bits = private_key[1].bit_length()
     block_size = n_bits // 8
     
-    data = zlib.decompress(chunk.data)
+    with instrumentation.timer("ecb.inflate"):
+        data = zlib.decompress(chunk.data)
+    instrumentation.count("ecb.bytes", len(data))
     
-    decrypted_data = bytearray()
-    for i in range(0, len(data), block_size):
-        block = data[i:i+block_size]
-        c = int.from_bytes(block, byteorder='big')
-        m = pow(c, private_key[0], private_key[1])
-        decrypted_block = m.to_bytes(block_size-1, byteorder='big')
-        decrypted_data.extend(decrypted_block)
+    decrypt_batch = partial(decrypt_blocks_ecb, private_key=private_key, block_size=block_size)
+    cache = get_block_cache("decrypt", private_key)
+    with instrumentation.timer("ecb.decrypt_rsa"):
+        decrypted_data = map_blocks_cached(decrypt_batch, data, block_size, block_size - 1, cache, workers)
     
-    decrypted_chunk_data = zlib.compress(decrypted_data)
+    with instrumentation.timer("ecb.deflate"):
+        decrypted_chunk_data = zlib.compress(decrypted_data)
     
     new_crc = compute_crc(chunk.type, decrypted_chunk_data)
     return PngChunk(len(decrypted_chunk_data), chunk.type, decrypted_chunk_data, new_crc)
 
-def encrypt_png_ecb(input_path, output_path, public_key):
-    chunks = png_parser.read_chunks(input_path)
+def encrypt_png_ecb(input_path, output_path, public_key, workers=None):
+    chunks = png_parser.load_chunks(input_path)
     
     encrypted_chunks = []
     for chunk in chunks:
-        encrypted_chunk = encrypt_chunk_ecb(chunk, public_key)
+        encrypted_chunk = encrypt_chunk_ecb(chunk, public_key, workers)
         encrypted_chunks.append(encrypted_chunk)
     
     png_parser.write_chunks(output_path, encrypted_chunks)
     print(f"Encrypted with ECB successfully - {output_path}")
 
-def decrypt_png_ecb(input_path, output_path, private_key):
-    chunks = png_parser.read_chunks(input_path)
+def decrypt_png_ecb(input_path, output_path, private_key, workers=None):
+    chunks = png_parser.load_chunks(input_path)
     
     decrypted_chunks = []
     for chunk in chunks:
-        decrypted_chunk = decrypt_chunk_ecb(chunk, private_key)
+        decrypted_chunk = decrypt_chunk_ecb(chunk, private_key, workers)
         decrypted_chunks.append(decrypted_chunk)
     
     png_parser.write_chunks(output_path, decrypted_chunks)
@@ -0,0 +1,95 @@
+import hashlib
+import secrets
+from Crypto.Cipher import AES
+from chunks import PngChunk
+import png_parser
+
+# Private ancillary chunk holding the RSA-wrapped AES key, GCM nonce and tag.
+# Lowercase 1st/2nd letters: ancillary, private. Uppercase 4th letter: unsafe to copy,
+# since it is only valid together with the encrypted IDAT data.
+KEY_CHUNK_TYPE = "enKY"
+
+NONCE_SIZE = 12
+TAG_SIZE = 16
+
+# RSA-KEM: encrypts a random integer with the public key and derives the AES key from it.
+# Returns (aes_key, wrapped_key).
+def wrap_key(public_key):
+    e, n = public_key
+    key_size = (n.bit_length() + 7) // 8
+
+    r = secrets.randbelow(n - 2) + 2
+    wrapped_key = pow(r, e, n).to_bytes(key_size, byteorder='big')
+    aes_key = hashlib.sha256(r.to_bytes(key_size, byteorder='big')).digest()
+
+    return aes_key, wrapped_key
+
+# Recovers the AES key from the wrapped key with the private key
+def unwrap_key(wrapped_key, private_key):
+    key_size = (private_key.n.bit_length() + 7) // 8
+    if len(wrapped_key) != key_size:
+        raise ValueError("Wrapped key does not match the private key size")
+
+    r = private_key.decrypt(int.from_bytes(wrapped_key, byteorder='big'))
+    return hashlib.sha256(r.to_bytes(key_size, byteorder='big')).digest()
+
+# Encrypts the whole IDAT stream with AES-GCM under a fresh RSA-wrapped key.
+# IDAT chunks are merged into one; IHDR is authenticated along with the data.
+def encrypt_png_hybrid(input_path: str, output_path: str, public_key) -> None:
+    chunks = png_parser.load_chunks(input_path)
+    ihdr = next(chunk for chunk in chunks if chunk.type == "IHDR")
+    idat_data = b"".join(chunk.data for chunk in chunks if chunk.type == "IDAT")
+
+    aes_key, wrapped_key = wrap_key(public_key)
+    nonce = secrets.token_bytes(NONCE_SIZE)
+    cipher = AES.new(aes_key, AES.MODE_GCM, nonce=nonce)
+    cipher.update(ihdr.data)
+    encrypted_data, tag = cipher.encrypt_and_digest(idat_data)
+
+    key_data = wrapped_key + nonce + tag
+    encrypted_chunks = []
+    for chunk in chunks:
+        if chunk.type == "IDAT":
+            # Key chunk and merged IDAT go where the first IDAT was
+            if encrypted_data is not None:
+                encrypted_chunks.append(PngChunk(len(key_data), KEY_CHUNK_TYPE, key_data))
+                encrypted_chunks.append(PngChunk(len(encrypted_data), "IDAT", encrypted_data))
+                encrypted_data = None
+        else:
+            encrypted_chunks.append(chunk)
+
+    png_parser.write_chunks(output_path, encrypted_chunks)
+    print(f"Encrypted with RSA-KEM + AES-GCM successfully - {output_path}")
+
+def decrypt_png_hybrid(input_path: str, output_path: str, private_key) -> None:
+    chunks = png_parser.load_chunks(input_path)
+    ihdr = next(chunk for chunk in chunks if chunk.type == "IHDR")
+    key_chunk = next((chunk for chunk in chunks if chunk.type == KEY_CHUNK_TYPE), None)
+    if key_chunk is None:
+        raise ValueError(f"Missing {KEY_CHUNK_TYPE} chunk, file is not encrypted in hybrid mode")
+
+    key_data = bytes(key_chunk.data)
+    wrapped_key = key_data[:-(NONCE_SIZE + TAG_SIZE)]
+    nonce = key_data[-(NONCE_SIZE + TAG_SIZE):-TAG_SIZE]
+    tag = key_data[-TAG_SIZE:]
+
+    aes_key = unwrap_key(wrapped_key, private_key)
+    cipher = AES.new(aes_key, AES.MODE_GCM, nonce=nonce)
+    cipher.update(ihdr.data)
+    encrypted_data = b"".join(chunk.data for chunk in chunks if chunk.type == "IDAT")
+    try:
+        decrypted_data = cipher.decrypt_and_verify(encrypted_data, tag)
+    except ValueError:
+        raise ValueError("Decryption failed: wrong key or the file was modified")
+
+    decrypted_chunks = []
+    for chunk in chunks:
+        if chunk.type == "IDAT":
+            if decrypted_data is not None:
+                decrypted_chunks.append(PngChunk(len(decrypted_data), "IDAT", decrypted_data))
+                decrypted_data = None
+        elif chunk.type != KEY_CHUNK_TYPE:
+            decrypted_chunks.append(chunk)
+
+    png_parser.write_chunks(output_path, decrypted_chunks)
+    print(f"Decrypted with RSA-KEM + AES-GCM successfully - {output_path}")
@@ -1,5 +1,6 @@
 from struct import unpack, pack
 from zlib import crc32
+import instrumentation
 
 # PNG signature (1st 8 bytes of every valid PNG file)
 PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
@@ -24,7 +25,7 @@ def anonymize_png(input_filepath: str, output_filepath: str) -> None:
     color_type = None  # Will be extracted IHDR chunk
     idat_data = b''  # Will collect IDAT chunks data to merge it
 
-    with open(input_filepath, 'rb') as f_in, open(output_filepath, 'wb') as f_out:
+    with open(input_filepath, 'rb') as f_in, open(output_filepath, 'wb') as f_out, instrumentation.timer("anonymizer.anonymize_png"):
         signature = f_in.read(8)
         if signature != PNG_SIGNATURE:
             # File with bad signature won't be handled
@@ -32,7 +33,7 @@ def anonymize_png(input_filepath: str, output_filepath: str) -> None:
 
         f_out.write(signature)  # Start the output file with the signature
 
-        print(f"Starting anonymization of \"{input_filepath}\"...")
+        instrumentation.log(f"Starting anonymization of \"{input_filepath}\"...")
         while True:
             length_bytes = f_in.read(4)
             if len(length_bytes) == 0:
@@ -43,53 +44,57 @@ def anonymize_png(input_filepath: str, output_filepath: str) -> None:
             chunk_type_str = chunk_type.decode('ascii')  # Convert chunk type to ASCII
             data = f_in.read(length)
             crc = unpack(">I", f_in.read(4))[0]
+            instrumentation.count("anonymizer.chunks")
+            instrumentation.count("anonymizer.bytes_read", length + 12)
 
             # Handle IHDR chunk
             if chunk_type_str == 'IHDR':
                 color_type = data[9]  # Extract color type from header
-                print(f"Detected color_type: {color_type}")
-                print("Writing IHDR chunk...")
+                instrumentation.log(f"Detected color_type: {color_type}")
+                instrumentation.log("Writing IHDR chunk...")
                 f_out.write(pack(">I", length))
                 f_out.write(chunk_type)
                 f_out.write(data)
                 f_out.write(pack(">I", crc))
-                print("IHDR has been written.")
+                instrumentation.log("IHDR has been written.")
 
             # Handle IDAT chunk
             elif chunk_type_str == 'IDAT':
                 # Collect current IDAT data to merge later
                 idat_data += data
-                print("Collected IDAT chunk data.")
+                instrumentation.count("anonymizer.idat_bytes", length)
+                instrumentation.log("Collected IDAT chunk data.")
 
             # Handle IEND chunk
             elif chunk_type_str == 'IEND':
                 if idat_data:
                     # Write a single merged IDAT chunk just before IEND
-                    print("Writing merged IDAT chunk...")
+                    instrumentation.log("Writing merged IDAT chunk...")
                     f_out.write(pack(">I", len(idat_data)))
                     f_out.write(b'IDAT')
                     f_out.write(idat_data)
                     f_out.write(pack(">I", crc32(b'IDAT' + idat_data) & 0xffffffff))
-                    print("Merged IDAT chunk has been written.")
+                    instrumentation.log("Merged IDAT chunk has been written.")
 
-                print("Writing IEND chunk...")
+                instrumentation.log("Writing IEND chunk...")
                 f_out.write(pack(">I", 0))
                 f_out.write(chunk_type)
                 f_out.write(pack(">I", crc))
-                print("IEND chunk has been written.")
+                instrumentation.log("IEND chunk has been written.")
                 break  # IEND must be the last chunk
 
             elif is_critical_chunk(chunk_type_str, color_type):
                 # Preserve other critical chunks (like PLTE if it's necessary)
-                print(f"{chunk_type_str} is a critical chunk. Writing...")
+                instrumentation.log(f"{chunk_type_str} is a critical chunk. Writing...")
                 f_out.write(pack(">I", length))
                 f_out.write(chunk_type)
                 f_out.write(data)
                 f_out.write(pack(">I", crc))
-                print(f"{chunk_type_str} has been written.")
+                instrumentation.log(f"{chunk_type_str} has been written.")
 
             else:
                 # Ancillary chunks are skipped
-                print(f"Removing {chunk_type_str} chunk (ancillary chunk).")
+                instrumentation.log(f"Removing {chunk_type_str} chunk (ancillary chunk).")
+                instrumentation.count("anonymizer.chunks_removed")
 
-    print("Anonymization complete!")
+    instrumentation.log("Anonymization complete!")
@@ -1,73 +1,229 @@
 from chunks import PngChunk
+import contextlib
+import image_cache
+import instrumentation
+import mmap
+import os
 import struct
 import zlib
 import piexif
 import numpy as np
-from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
 
 # PNG file signature (magic number)
 PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
 
-def read_chunks(file_path):
-    chunks = []
-
+# Yields chunks one by one from a memory-mapped file, without copying any payload.
+# Chunk data is a read-only memoryview into the mapping and is only valid while the generator
+# runs: once it is exhausted or closed, the mapping is released and chunks that did not read
+# their data yet raise ValueError. Keep it open explicitly when stopping early (e.g. after IHDR):
+#     with contextlib.closing(iter_chunks(path)) as chunks:
+#         for chunk in chunks: ...
+# and copy (bytes(chunk.data)) anything needed afterwards. read_chunks does that for every chunk.
+def iter_chunks(file_path):
     with open(file_path, "rb") as f:
-        signature = f.read(8)
-        if signature != PNG_SIGNATURE:
+        if os.fstat(f.fileno()).st_size < len(PNG_SIGNATURE):
             raise ValueError("Not a valid PNG file.")
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
 
-        while True:
-            length_bytes = f.read(4)
-            if len(length_bytes) == 0:
-                break
+    view = memoryview(mapped)
+    try:
+        if view[:len(PNG_SIGNATURE)] != PNG_SIGNATURE:
+            raise ValueError("Not a valid PNG file.")
 
-            length = struct.unpack(">I", length_bytes)[0]
-            chunk_type = f.read(4).decode("ascii")
-            data = f.read(length)
-            crc = struct.unpack(">I", f.read(4))[0]
+        offset = len(PNG_SIGNATURE)
+        while offset < len(view):
+            if offset + 8 > len(view):
+                raise ValueError("Unexpected end of PNG file")
+
+            length = struct.unpack_from(">I", view, offset)[0]
+            chunk_type = bytes(view[offset + 4:offset + 8]).decode("ascii")
+            data_end = offset + 8 + length
+            if data_end + 4 > len(view):
+                raise ValueError("Unexpected end of PNG file")
+
+            chunk = PngChunk(length, chunk_type, source=view, offset=offset + 8)
+            offset = data_end + 4
 
-            chunk = PngChunk(length, chunk_type, data, crc)
-            chunks.append(chunk)
+            yield chunk
 
             if chunk_type == "IEND":
                 break
-
+    finally:
+        view.release()
+        # Payload views the caller still holds keep the file mapped until they are freed
+        with contextlib.suppress(BufferError):
+            mapped.close()
+
+# Reads all chunks of a file. Every chunk owns a copy of its payload, so the chunks
+# stay valid when the file is rewritten, including by write_chunks to the same path.
+def read_chunks(file_path):
+    with instrumentation.timer("png_parser.read_chunks"):
+        chunks = [PngChunk(chunk.length, chunk.type, bytes(chunk.data), chunk.crc) for chunk in iter_chunks(file_path)]
+    instrumentation.count("png_parser.chunks", len(chunks))
     return chunks
 
+# Like read_chunks, but shared through image_cache: a file is read once per process while it is unchanged
+def load_chunks(file_path):
+    chunks = image_cache.load("chunks", file_path, read_chunks, lambda chunks: sum(chunk.length for chunk in chunks))
+    return list(chunks)
+
+def _decode_file(file_path):
+    chunks = load_chunks(file_path)
+    ihdr = parse_IHDR(next(chunk for chunk in chunks if chunk.type == "IHDR"))
+    if ihdr["interlace"] != 0:
+        raise ValueError("Interlaced images are not supported")
+
+    arr = decode_IDAT([chunk.data for chunk in chunks if chunk.type == "IDAT"],
+                      ihdr["width"], ihdr["height"], ihdr["bit_depth"], ihdr["color_type"])
+    # Shared by every caller, so it must not be modified in place
+    arr.flags.writeable = False
+    return arr
+
+# Decoded pixel array of a file (see decode_IDAT), shared through image_cache
+def load_image(file_path):
+    return image_cache.load("pixels", file_path, _decode_file, lambda arr: arr.nbytes)
+
+# Walks the chunk headers of an open PNG file, yielding (length, chunk_type, payload offset).
+# Payloads are skipped with seek(); the caller may read the current payload before the next step.
+def _iter_chunk_headers(f):
+    if f.read(len(PNG_SIGNATURE)) != PNG_SIGNATURE:
+        raise ValueError("Not a valid PNG file.")
+
+    offset = len(PNG_SIGNATURE)
+    while True:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) == 0:
+            break
+        if len(header) < 8:
+            raise ValueError("Unexpected end of PNG file")
+
+        length, chunk_type = struct.unpack(">I4s", header)
+        chunk_type = chunk_type.decode("ascii")
+        yield length, chunk_type, offset + 8
+
+        offset += 12 + length
+        if chunk_type == "IEND":
+            break
+
+# Builds a chunk index from headers only. Chunks keep the file path and payload offset,
+# and read their data and CRC from the file on first access.
+def index_chunks(file_path):
+    with open(file_path, "rb") as f:
+        return [PngChunk(length, chunk_type, source=file_path, offset=offset)
+                for length, chunk_type, offset in _iter_chunk_headers(f)]
+
+# Size of the blocks verify_chunks reads payloads in
+VERIFY_BLOCK_SIZE = 1 << 20
+
+# Checks the CRC of every chunk, streaming payloads in blocks with an incremental CRC.
+# Returns None if all chunks are valid, otherwise a dict describing the first bad chunk.
+def verify_chunks(file_path):
+    with open(file_path, "rb") as f, instrumentation.timer("png_parser.verify_chunks"):
+        for index, (length, chunk_type, offset) in enumerate(_iter_chunk_headers(f)):
+            instrumentation.count("png_parser.verified_bytes", length)
+            crc = zlib.crc32(chunk_type.encode("ascii"))
+            remaining = length
+            while remaining:
+                block = f.read(min(remaining, VERIFY_BLOCK_SIZE))
+                if len(block) == 0:
+                    raise ValueError("Unexpected end of PNG file")
+                crc = zlib.crc32(block, crc)
+                remaining -= len(block)
+
+            crc_bytes = f.read(4)
+            if len(crc_bytes) < 4:
+                raise ValueError("Unexpected end of PNG file")
+
+            stored_crc = struct.unpack(">I", crc_bytes)[0]
+            if stored_crc != crc:
+                return {
+                    "index": index,
+                    "type": chunk_type,
+                    "offset": offset - 8,
+                    "stored_crc": stored_crc,
+                    "computed_crc": crc
+                }
+
+    return None
+
+def _verify_file(file_path):
+    try:
+        return file_path, verify_chunks(file_path)
+    except (OSError, ValueError) as e:
+        return file_path, {"error": str(e)}
+
+# Verifies many files in worker processes, yielding (file_path, report) in input order.
+# The report is None for a valid file, the first bad chunk, or {"error": ...} for unreadable files.
+def verify_files(file_paths, workers=None):
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(_verify_file, file_paths, chunksize=16)
+
+# Chunks read by the metadata functions, everything else is skipped
+METADATA_CHUNKS = ("IHDR", "tEXt", "iTXt", "zTXt", "tIME", "eXIf", "pHYs", "PLTE")
+
+# Chunks that may appear more than once, collected into lists
+REPEATABLE_METADATA_CHUNKS = ("tEXt", "iTXt", "zTXt")
+
+# Parses a single metadata chunk, ihdr_data is needed to interpret PLTE
+def parse_metadata_chunk(chunk, ihdr_data):
+    if chunk.type == "IHDR":
+        return parse_IHDR(chunk)
+    elif chunk.type == "tEXt":
+        return parse_tEXt(chunk)
+    elif chunk.type == "iTXt":
+        return parse_iTXt(chunk)
+    elif chunk.type == "tIME":
+        return parse_tIME(chunk)
+    elif chunk.type == "eXIf":
+        return parse_eXIf(chunk)
+    elif chunk.type == "pHYs":
+        return parse_pHYs(chunk)
+    elif chunk.type == "zTXt":
+        return parse_zTXt(chunk)
+    elif chunk.type == "PLTE":
+        return parse_PLTE(chunk, ihdr_data["color_type"])
+    raise ValueError(f"Chunk {chunk.type} does not carry metadata")
+
+def _add_metadata(metadata, chunk_type, value):
+    if chunk_type in REPEATABLE_METADATA_CHUNKS:
+        metadata.setdefault(chunk_type, []).append(value)
+    else:
+        metadata[chunk_type] = value
+
+# Returns metadata of already read chunks. Each entry is also logged (see instrumentation.log).
 def extract_metadata(chunks):
-    ihdr_data = None
-    idat_data = b""
+    metadata = {}
 
     for chunk in chunks:
-        if chunk.type == "IHDR":
-            ihdr_data = parse_IHDR(chunk)
-            print("IHDR metadata: " + str(ihdr_data))
+        if chunk.type in METADATA_CHUNKS:
+            value = parse_metadata_chunk(chunk, metadata.get("IHDR"))
+            instrumentation.log(f"{chunk.type} metadata: {value}")
+            _add_metadata(metadata, chunk.type, value)
+
+    return metadata
 
-        elif chunk.type == "tEXt":
-            print("tEXt metadata: " + str(parse_tEXt(chunk)))
+# Metadata-only scan of a file: reads chunk headers and metadata chunks,
+# seeking past IDAT and other payloads without reading them.
+# Returns a dict keyed by chunk type; tEXt, iTXt and zTXt map to lists.
+def scan_metadata(file_path):
+    metadata = {}
 
-        elif chunk.type == "iTXt":
-            print("iTXt metadata: " + str(parse_iTXt(chunk)))
-        
-        elif chunk.type == "tIME":
-            print("tIME metadata: " + str(parse_tIME(chunk)))
+    with open(file_path, "rb") as f:
+        for length, chunk_type, _ in _iter_chunk_headers(f):
+            if chunk_type not in METADATA_CHUNKS:
+                continue
 
-        elif chunk.type == "eXIf":
-            print("eXIf metadata: " + str(parse_eXIf(chunk)))
-        
-        elif chunk.type == "pHYs":
-            print("pHYs metadata: " + str(parse_pHYs(chunk)))
+            data = f.read(length)
+            if len(data) < length:
+                raise ValueError("Unexpected end of PNG file")
 
-        elif chunk.type == "zTXt":
-            print("zTXt metadata: " + str(parse_zTXt(chunk)))
-        
-        elif chunk.type == "IDAT":
-            idat_data += chunk.data
+            chunk = PngChunk(length, chunk_type, data)
+            _add_metadata(metadata, chunk_type, parse_metadata_chunk(chunk, metadata.get("IHDR")))
 
-        elif chunk.type == "PLTE":
-            color_type = ihdr_data["color_type"]
-            print("PLTE metadata: " + str(parse_PLTE(chunk, color_type)))
+    return metadata
 
 
 # Parses the IHDR chunk which contains basic image information
@@ -93,9 +249,10 @@ def parse_tEXt(chunk):
     if(chunk.type != "tEXt"):
         raise ValueError("Chunk is not type of tEXt")
 
-    null_pos = chunk.data.find(b'\x00')
-    keyword = chunk.data[:null_pos].decode('latin1')
-    text = chunk.data[null_pos+1:].decode('latin1')
+    data = bytes(chunk.data)
+    null_pos = data.find(b'\x00')
+    keyword = data[:null_pos].decode('latin1')
+    text = data[null_pos+1:].decode('latin1')
 
     return {"keyword": keyword, "text": text}
 
@@ -104,7 +261,7 @@ def parse_iTXt(chunk):
     if(chunk.type != "iTXt"):
         raise ValueError("Chunk is not type of iTXt")
 
-    parts = chunk.data.split(b'\x00', 5)
+    parts = bytes(chunk.data).split(b'\x00', 5)
     if len(parts) < 6:
         return None
     
@@ -150,7 +307,7 @@ def parse_eXIf(chunk):
         raise ValueError("Chunk is not type of eXIf")
     
     try:
-        exif_dict = piexif.load(chunk.data)
+        exif_dict = piexif.load(bytes(chunk.data))
         readable_exif = {}
 
         for ifd in exif_dict:
@@ -162,7 +319,7 @@ def parse_eXIf(chunk):
         return readable_exif
 
     except Exception as e:
-        print(f"Error parsing EXIF: {e}")
+        instrumentation.log(f"Error parsing EXIF: {e}")
         return None
 
 # Parses zTXt chunk (compressed text)
@@ -170,10 +327,11 @@ def parse_zTXt(chunk):
     if(chunk.type != "zTXt"):
         raise ValueError("Chunk is not type of zTXt")
 
-    null_pos = chunk.data.find(b'\x00')
-    keyword = chunk.data[:null_pos].decode('latin1')
-    compression_method = chunk.data[null_pos + 1]
-    compressed_text = chunk.data[null_pos + 2:]
+    data = bytes(chunk.data)
+    null_pos = data.find(b'\x00')
+    keyword = data[:null_pos].decode('latin1')
+    compression_method = data[null_pos + 1]
+    compressed_text = data[null_pos + 2:]
 
     if compression_method != 0:
         raise ValueError("Unsupported compression method in zTXt")
@@ -221,98 +379,274 @@ def parse_PLTE(chunk, color_type):
         "colors": palette
     }
 
+# Largest key range counted with np.bincount; wider keys (packed RGB) are counted with np.unique
+BINCOUNT_MAX_KEYS = 1 << 16
+
+# Counts of every distinct key in a flat integer array, as (sorted keys, counts)
+def _count_keys(keys, key_range):
+    if key_range <= BINCOUNT_MAX_KEYS:
+        counts = np.bincount(keys, minlength=key_range)
+        values = np.flatnonzero(counts)
+        return values, counts[values]
+    return np.unique(keys, return_counts=True)
+
+# Keys _first_occurrences looks at per step
+FIRST_OCCURRENCE_BLOCK = 1 << 16
+
+# Position of the first occurrence in keys of each of the sorted distinct `values`, len(keys) if not
+# found. Keys are scanned from the start in blocks, stopping as soon as every value marked in
+# `required` and `wanted` of the others have been found: those are the earliest of the others.
+def _first_occurrences(keys, values, required, wanted):
+    first = np.full(len(values), len(keys))
+    for start in range(0, len(keys), FIRST_OCCURRENCE_BLOCK):
+        block = keys[start:start + FIRST_OCCURRENCE_BLOCK]
+        index = np.minimum(np.searchsorted(values, block), len(values) - 1)
+        hits = np.flatnonzero(values[index] == block)
+
+        # Earliest hit of every value in the block, kept for values not found in earlier blocks
+        hit_values, earliest = np.unique(index[hits], return_index=True)
+        new = first[hit_values] == len(keys)
+        first[hit_values[new]] = start + hits[earliest[new]]
+
+        found = first < len(keys)
+        if found[required].all() and np.count_nonzero(found & ~required) >= wanted:
+            break
+
+    return first
+
+# The top_n most common keys as [(key, count)], ordered like collections.Counter.most_common:
+# by count, then by first occurrence in the image
+def _most_common_keys(keys, key_range, top_n):
+    values, counts = _count_keys(keys, key_range)
+    if len(values) == 0:
+        return []
+
+    threshold = np.partition(counts, -top_n)[-top_n] if len(values) > top_n else counts.min()
+    selected = counts >= threshold
+    values, counts = values[selected], counts[selected]
+
+    # First occurrences only order equal counts, so they are not looked up when all counts differ.
+    # Of the keys at the threshold, only the earliest ones that still fit in top_n are needed.
+    if len(np.unique(counts)) < len(counts):
+        above = counts > threshold
+        first = _first_occurrences(keys, values, above, min(top_n, len(values)) - np.count_nonzero(above))
+        found = np.flatnonzero(first < len(keys))
+        order = found[np.lexsort((first[found], -counts[found]))][:top_n]
+    else:
+        order = np.argsort(-counts)[:top_n]
+
+    return [(int(values[i]), int(counts[i])) for i in order]
+
+# Packs the RGB channels of every pixel into one integer key per pixel
+def _pack_rgb(arr):
+    bits = 8 * arr.dtype.itemsize
+    pixels = arr.reshape(-1, arr.shape[-1])
+    key_dtype = np.uint32 if bits == 8 else np.uint64
+    keys = pixels[:, 0].astype(key_dtype) << (2 * bits)
+    keys |= pixels[:, 1].astype(key_dtype) << bits
+    keys |= pixels[:, 2].astype(key_dtype)
+    return keys, bits
+
 def get_dominant_colors(arr, color_type, top_n=5):
     # For palette images, count palette indices
     if color_type == 3:
-        flat = arr.flatten()
-        return {f"Palette index {k}": v for k, v in Counter(flat).most_common(top_n)}
-    # For RGB/RGBA, count RGB triples
+        common = _most_common_keys(arr.ravel(), 256, top_n)
+        return {f"Palette index {k}": v for k, v in common}
+    # For RGB/RGBA, count RGB triples packed into one key per pixel
     elif color_type in (2, 6):
-        pixels = arr.reshape(-1, arr.shape[-1])[:, :3]
-        pixels = [(int(p[0]), int(p[1]), int(p[2])) for p in pixels]
-        color_counts = Counter(pixels)
-        return {f"RGB{color}": count for color, count in color_counts.most_common(top_n)}
+        keys, bits = _pack_rgb(arr)
+        mask = (1 << bits) - 1
+        common = _most_common_keys(keys, 1 << (3 * bits), top_n)
+        return {f"RGB{(k >> 2 * bits, (k >> bits) & mask, k & mask)}": v for k, v in common}
+    # For grayscale (with or without alpha), count gray levels
+    elif color_type in (0, 4):
+        gray = arr[..., 0] if color_type == 4 else arr
+        common = _most_common_keys(gray.ravel(), 1 << (8 * arr.dtype.itemsize), top_n)
+        return {f"Gray {k}": v for k, v in common}
     return None
 
+# Names of the channels of a decoded image, in array order
+CHANNEL_NAMES = {0: ("Gray",), 2: ("R", "G", "B"), 3: ("Index",), 4: ("Gray", "A"), 6: ("R", "G", "B", "A")}
+
+# Per-channel histograms, one count per possible value (256 for 8-bit, 65536 for 16-bit images)
+def get_histograms(arr, color_type):
+    names = CHANNEL_NAMES[color_type]
+    values = 1 << (8 * arr.dtype.itemsize)
+    channels = arr.reshape(-1, len(names))
+
+    return {name: np.bincount(channels[:, i], minlength=values) for i, name in enumerate(names)}
+
+# Size of the pieces get_compression_info inflates at a time
+COMPRESSION_INFO_BLOCK_SIZE = 1 << 20
+
 def get_compression_info(idat_data):
-    # Compare compressed and decompressed sizes
-    original_size = len(idat_data)
-    decompressed = zlib.decompress(idat_data)
-    ratio = original_size / len(decompressed)
+    idat_chunks = _as_idat_chunks(idat_data)
+
+    # Compare compressed and decompressed sizes, inflating in blocks so the
+    # decompressed image is never held in memory
+    original_size = sum(len(data) for data in idat_chunks)
+    decompressed_size = 0
+    decompressor = zlib.decompressobj()
+    for data in idat_chunks:
+        while data:
+            decompressed_size += len(decompressor.decompress(data, COMPRESSION_INFO_BLOCK_SIZE))
+            data = decompressor.unconsumed_tail
+    decompressed_size += len(decompressor.flush())
+
+    ratio = original_size / decompressed_size
     return {
         "compressed_size": original_size,
-        "uncompressed_size": len(decompressed),
+        "uncompressed_size": decompressed_size,
         "compression_ratio": round(ratio, 2)
     }
 
 def has_transparency(arr, color_type):
-    # Check if any alpha values are not 255 (fully opaque)
-    if color_type not in (4, 6):
-        return False
-    alpha_channel = arr[..., -1] if color_type == 6 else arr[..., 1]
-    if np.any(alpha_channel < 255):
-        return True
-    return False
-
-def get_image_stats(arr, color_type):
-    stats = {
-        "min_value": float(np.min(arr)),
-        "max_value": float(np.max(arr)),
-        "mean_value": float(np.mean(arr)),
-        "std_dev": float(np.std(arr)),
-        "unique_values": len(np.unique(arr)) if color_type == 3 else None
-    }
-    
-    if color_type in (2, 6):  # RGB/RGBA
-        stats["channel_stats"] = {
-            "R": {"min": float(np.min(arr[..., 0])), "max": float(np.max(arr[..., 0]))},
-            "G": {"min": float(np.min(arr[..., 1])), "max": float(np.max(arr[..., 1]))},
-            "B": {"min": float(np.min(arr[..., 2])), "max": float(np.max(arr[..., 2]))}
+    return ImageStats(color_type).update(arr).has_transparency()
+
+# Pixels in each strip ImageStats.update works on, so a strip and its keys stay in cache
+STATS_STRIP_PIXELS = 1 << 16
+
+# Per-channel count, min, max, mean and sum of squared deviations (M2), computed in one walk
+# over row strips. An 8-bit strip is reduced to a per-channel histogram with a single bincount,
+# which gives its exact min, max, mean and M2; wider samples would need 65536 bins per channel,
+# so their strips are reduced directly to min, max, sum and sum of squares instead. Partial results
+# from different strips, streams or files combine with merge() (Chan et al. parallel variance),
+# so rows can be fed as they are decoded.
+class ImageStats:
+    def __init__(self, color_type):
+        channels = get_channels_from_color_type(color_type)
+        self.color_type = color_type
+        self.count = 0
+        self.min = np.full(channels, np.inf)
+        self.max = np.full(channels, -np.inf)
+        self.mean = np.zeros(channels)
+        self.m2 = np.zeros(channels)
+        # Palette indices present, for the number of distinct values
+        self.palette_seen = np.zeros(256, dtype=bool) if color_type == 3 else None
+
+    # Adds rows shaped (rows, width, channels), or (rows, width) for single channel images
+    def update(self, rows):
+        channels = len(self.mean)
+        pixels = rows.reshape(-1, channels)
+        strip_stats = self._histogram_strip_stats if rows.dtype.itemsize == 1 else self._reduced_strip_stats
+
+        for start in range(0, len(pixels), STATS_STRIP_PIXELS):
+            self.merge(strip_stats(pixels[start:start + STATS_STRIP_PIXELS]))
+
+        return self
+
+    def _histogram_strip_stats(self, strip):
+        channels = strip.shape[1]
+        offsets = np.arange(channels, dtype=np.intp) * 256
+        values = np.arange(256, dtype=np.float64)
+        histogram = np.bincount((strip + offsets).ravel(), minlength=channels * 256).reshape(channels, 256)
+        present = histogram > 0
+
+        partial = ImageStats(self.color_type)
+        partial.count = len(strip)
+        partial.min = present.argmax(axis=1).astype(np.float64)
+        partial.max = (255 - present[:, ::-1].argmax(axis=1)).astype(np.float64)
+        partial.mean = histogram @ values / len(strip)
+        partial.m2 = (histogram * np.square(values - partial.mean[:, None])).sum(axis=1)
+        if self.palette_seen is not None:
+            partial.palette_seen = present[0]
+        return partial
+
+    # Reduces channel-major native copies of the strip, so every reduction runs over contiguous
+    # memory. Sums of 16-bit samples and of their squares over a strip are exact in float64.
+    def _reduced_strip_stats(self, strip):
+        channels = np.ascontiguousarray(strip.T, dtype=strip.dtype.newbyteorder("="))
+        values = channels.astype(np.float64)
+        sums = values.sum(axis=1)
+
+        partial = ImageStats(self.color_type)
+        partial.count = len(strip)
+        partial.min = channels.min(axis=1).astype(np.float64)
+        partial.max = channels.max(axis=1).astype(np.float64)
+        partial.mean = sums / len(strip)
+        partial.m2 = np.einsum("ij,ij->i", values, values) - sums * partial.mean
+        return partial
+
+    def merge(self, other):
+        count = self.count + other.count
+        if other.count == 0:
+            return self
+
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * (other.count / count)
+        self.m2 = self.m2 + other.m2 + np.square(delta) * (self.count * other.count / count)
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        self.count = count
+        if self.palette_seen is not None:
+            self.palette_seen |= other.palette_seen
+
+        return self
+
+    def variance(self):
+        return self.m2 / self.count
+
+    # Mean and population standard deviation over all channels together
+    def overall_mean_std(self):
+        mean = self.mean.mean()
+        m2 = self.m2.sum() + self.count * np.square(self.mean - mean).sum()
+        return float(mean), float(np.sqrt(m2 / (self.count * len(self.mean))))
+
+    def has_transparency(self):
+        # Any alpha value not 255 (fully opaque)
+        if self.color_type not in (4, 6):
+            return False
+        return bool(self.min[-1] < 255)
+
+    # Same layout as get_image_stats always returned, plus per-channel mean and variance
+    def to_dict(self):
+        mean, std_dev = self.overall_mean_std()
+        stats = {
+            "min_value": float(self.min.min()),
+            "max_value": float(self.max.max()),
+            "mean_value": mean,
+            "std_dev": std_dev,
+            "unique_values": int(self.palette_seen.sum()) if self.palette_seen is not None else None
         }
-        if color_type == 6:  # RGBA
-            stats["channel_stats"]["A"] = {
-                "min": float(np.min(arr[..., 3])),
-                "max": float(np.max(arr[..., 3]))
+
+        if self.color_type in (2, 6):  # RGB/RGBA
+            variance = self.variance()
+            stats["channel_stats"] = {
+                name: {"min": float(self.min[i]), "max": float(self.max[i]),
+                       "mean": float(self.mean[i]), "variance": float(variance[i])}
+                for i, name in enumerate(CHANNEL_NAMES[self.color_type])
             }
-    
-    return stats
 
-def parse_IDAT(idat_data, width, height, bit_depth, color_type):
-    try:
-        decompressed = zlib.decompress(idat_data)
-    except zlib.error as e:
-        raise ValueError(f"Decompression failed: {e}")
+        return stats
 
+def get_image_stats(arr, color_type):
+    return ImageStats(color_type).update(arr).to_dict()
+
+# IDAT functions accept either the concatenated IDAT payload or a list of IDAT chunk payloads
+def _as_idat_chunks(idat_data):
+    if isinstance(idat_data, (bytes, bytearray, memoryview)):
+        return [idat_data]
+    return list(idat_data)
+
+# Compressed bytes handed to the decompressor at a time
+INFLATE_BLOCK_SIZE = 1 << 16
+
+# Decoded rows as an array of shape (rows, width, channels), or (rows, width) for single channel images
+def _as_pixels(pixel_rows, width, channels, dtype):
+    arr = pixel_rows.view(dtype)
+    if channels > 1:
+        return arr.reshape((len(pixel_rows), width, channels))
+    return arr.reshape((len(pixel_rows), width))
+
+# Inflates IDAT payloads one chunk at a time and yields the unfiltered scanlines in strips of
+# at most UNFILTER_STRIP_ROWS rows, shaped like decode_IDAT's result. Only one strip of
+# decompressed data is pending at a time. Without `out`, strips share one buffer that is
+# overwritten by the next strip, so memory does not grow with the image height; with `out`
+# (height x bytes per scanline, uint8) every row is unfiltered into it.
+def iter_IDAT_rows(idat_data, width, height, bit_depth, color_type, out=None):
     # Determine number of channels based on color type
     channels = get_channels_from_color_type(color_type)
 
-    # Calculate number of bytes per scanline (excluding filter byte)
-    bits_per_scanline = width * channels * bit_depth
-    bytes_per_scanline = (bits_per_scanline + 7) // 8
-
-    pixels = []
-    prev_scanline = None
-    offset = 0
-    
-    # Iterate over all scanlines
-    for _ in range(height):
-        if offset + 1 + bytes_per_scanline > len(decompressed):
-            raise ValueError("Unexpected end of IDAT data")
-
-        filter_type = decompressed[offset]
-        offset += 1
-        
-        scanline = decompressed[offset:offset + bytes_per_scanline]
-        offset += bytes_per_scanline
-
-        # Reconstruct unfiltered scanline
-        unfiltered = undo_filter(filter_type, scanline, prev_scanline, (channels * bit_depth + 7) // 8)
-        pixels.append(unfiltered)
-        prev_scanline = unfiltered
-
-    # Merge all scanlines into single byte buffer
-    pixel_data = b''.join(pixels)
-
     # Determine correct NumPy dtype
     if bit_depth == 8:
         dtype = np.uint8
@@ -321,37 +655,121 @@ def parse_IDAT(idat_data, width, height, bit_depth, color_type):
     else:
         raise ValueError(f"Unsupported bit depth: {bit_depth}")
 
-    arr = np.frombuffer(pixel_data, dtype=dtype)
+    # Calculate number of bytes per scanline (excluding filter byte)
+    bytes_per_scanline = (width * channels * bit_depth + 7) // 8
+    bytes_per_pixel = (channels * bit_depth + 7) // 8
+    row_size = bytes_per_scanline + 1
+
+    buffer = np.empty((min(UNFILTER_STRIP_ROWS, height), bytes_per_scanline), dtype=np.uint8) if out is None else None
+    decompressor = zlib.decompressobj()
+    pending = bytearray()  # Decompressed scanlines not yet unfiltered, at most one strip
+    strip_size = UNFILTER_STRIP_ROWS * row_size
+    prev_scanline = None
+    row = 0
+
+    def unfilter_pending():
+        nonlocal row, prev_scanline
+        rows = min(len(pending) // row_size, height - row)
+        target = out[row:row + rows] if out is not None else buffer[:rows]
+        with instrumentation.timer("png_parser.unfilter"):
+            unfilter_scanlines(pending, rows, bytes_per_scanline, bytes_per_pixel, prev_scanline, out=target)
+        del pending[:rows * row_size]
+        row += rows
+        # The shared buffer is overwritten by the next strip, so keep a copy of the last row
+        prev_scanline = target[-1] if out is not None else target[-1].copy()
+        return _as_pixels(target, width, channels, dtype)
+
+    # Payloads are taken one at a time as decoding proceeds, so idat_data may also be a generator
+    # over a mapped file (see iter_chunks) that must stay open until the last row
+    idat_chunks = [idat_data] if isinstance(idat_data, (bytes, bytearray, memoryview)) else idat_data
 
-    # Reshape array to (height, width, channels) or (height, width)
-    if color_type in (2, 6):  # RGB/RGBA
-        arr = arr.reshape((height, width, channels))
-    elif color_type in (0, 3, 4):  # Grayscale/Indexed/Grayscale+Alpha
-        if channels > 1:
-            arr = arr.reshape((height, width, channels))
-        else:
-            arr = arr.reshape((height, width))
+    try:
+        for data in idat_chunks:
+            instrumentation.count("png_parser.idat_bytes", len(data))
+            # Fed in bounded pieces, since unconsumed_tail copies whatever input is left
+            data = memoryview(data)
+            for offset in range(0, len(data), INFLATE_BLOCK_SIZE):
+                piece = data[offset:offset + INFLATE_BLOCK_SIZE]
+                while piece and row < height:
+                    with instrumentation.timer("png_parser.inflate"):
+                        pending += decompressor.decompress(piece, strip_size - len(pending))
+                    piece = decompressor.unconsumed_tail
+                    if len(pending) == strip_size:
+                        yield unfilter_pending()
+
+        if row < height:
+            pending += decompressor.flush()
+    except zlib.error as e:
+        raise ValueError(f"Decompression failed: {e}")
+
+    while row < height and len(pending) >= row_size:
+        yield unfilter_pending()
+    if row < height:
+        raise ValueError("Unexpected end of IDAT data")
+    instrumentation.count("png_parser.raw_bytes", height * row_size)
+
+# Inflates and unfilters the whole image straight into a preallocated pixel array (see iter_IDAT_rows).
+# Returns an array of shape (height, width, channels), or (height, width) for single channel images.
+def decode_IDAT(idat_data, width, height, bit_depth, color_type):
+    channels = get_channels_from_color_type(color_type)
+    bytes_per_scanline = (width * channels * bit_depth + 7) // 8
+
+    pixel_rows = np.empty((height, bytes_per_scanline), dtype=np.uint8)
+    for _ in iter_IDAT_rows(idat_data, width, height, bit_depth, color_type, out=pixel_rows):
+        pass
+
+    return _as_pixels(pixel_rows, width, channels, np.uint8 if bit_depth == 8 else '>u2')
+
+# Image statistics of the IDAT stream. `pixels` may hold the already decoded image (e.g. from load_image).
+def parse_IDAT(idat_data, width, height, bit_depth, color_type, histograms=False, pixels=None):
+    idat_chunks = _as_idat_chunks(idat_data)
+    arr = decode_IDAT(idat_chunks, width, height, bit_depth, color_type) if pixels is None else pixels
+    channels = get_channels_from_color_type(color_type)
 
     # Extract image metadata
-    metadata = {
-        "stats": get_image_stats(arr, color_type),
-        "dominant_colors": get_dominant_colors(arr, color_type),
-        "compression": get_compression_info(idat_data),
-        "raw_shape": f"{height}x{width}x{channels}",
-        "has_transparency": has_transparency(arr, color_type)
-    }
+    with instrumentation.timer("png_parser.image_stats"):
+        stats = ImageStats(color_type).update(arr)
+        metadata = {
+            "stats": stats.to_dict(),
+            "dominant_colors": get_dominant_colors(arr, color_type),
+            "compression": get_compression_info(idat_chunks),
+            "raw_shape": f"{height}x{width}x{channels}",
+            "has_transparency": stats.has_transparency()
+        }
+        if histograms:
+            metadata["histograms"] = {name: counts.tolist() for name, counts in get_histograms(arr, color_type).items()}
 
     return metadata
 
+# parse_IDAT of a file, with its chunks and decoded pixels shared through image_cache
+def parse_image(file_path, histograms=False):
+    chunks = load_chunks(file_path)
+    ihdr = parse_IHDR(next(chunk for chunk in chunks if chunk.type == "IHDR"))
+    return parse_IDAT([chunk.data for chunk in chunks if chunk.type == "IDAT"], ihdr["width"], ihdr["height"],
+                      ihdr["bit_depth"], ihdr["color_type"], histograms, pixels=load_image(file_path))
+
+# Writes the chunks to a temporary file next to filename and then renames it over filename,
+# so chunks whose payloads are views into the old file (see iter_chunks) are never truncated
+# while they are being written, and readers never see a partly written file
 def write_chunks(filename, chunks):
-    with open(filename, "wb") as f:
-        f.write(PNG_SIGNATURE)
+    temp_filename = f"{filename}.{os.getpid()}.tmp"
+    try:
+        with open(temp_filename, "wb") as f, instrumentation.timer("png_parser.write_chunks"):
+            f.write(PNG_SIGNATURE)
+
+            for chunk in chunks:
+                f.write(chunk.length.to_bytes(4, "big"))
+                f.write(chunk.type.encode("ascii"))
+                f.write(chunk.data)
+                f.write(chunk.crc.to_bytes(4, "big"))
+
+        os.replace(temp_filename, filename)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_filename)
+        raise
 
-        for chunk in chunks:
-            f.write(chunk.length.to_bytes(4, "big"))
-            f.write(chunk.type.encode("ascii"))
-            f.write(chunk.data)
-            f.write(chunk.crc.to_bytes(4, "big"))
+    image_cache.invalidate(filename)
 
 def get_channels_from_color_type(color_type):
     if color_type == 0:  # Grayscale
@@ -382,63 +800,183 @@ def paeth_predictor(a, b, c):
     else:
         return c
 
+# Vectorized Paeth predictor over int16 arrays of left, up and up-left bytes
+def paeth_predictor_array(a, b, c):
+    pa = np.abs(b - c)
+    pb = np.abs(a - c)
+    pc = np.abs(a + b - 2 * c)
+    return np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+
+# Number of scanlines unfiltered together by the wavefront pass in unfilter_scanlines
+UNFILTER_STRIP_ROWS = 512
+
+# Reconstructs `height` filtered scanlines (filter byte + data) into a (height, bytes_per_scanline) uint8 array.
+# If `out` is given, the rows are written into it instead of a new array.
+def unfilter_scanlines(data, height, bytes_per_scanline, bytes_per_pixel, prev_scanline=None, out=None):
+    if len(data) < height * (bytes_per_scanline + 1):
+        raise ValueError("Unexpected end of IDAT data")
+
+    rows = np.frombuffer(data, dtype=np.uint8, count=height * (bytes_per_scanline + 1))
+    rows = rows.reshape((height, bytes_per_scanline + 1))
+    filter_types = rows[:, 0]
+    filtered = rows[:, 1:]
+
+    unknown = filter_types[filter_types > 4]
+    if len(unknown):
+        raise ValueError(f"Unknown filter type {unknown[0]}")
+
+    result = np.empty((height, bytes_per_scanline), dtype=np.uint8) if out is None else out
+    if prev_scanline is None or len(prev_scanline) == 0:
+        prev = np.zeros(bytes_per_scanline, dtype=np.uint8)
+    else:
+        prev = np.frombuffer(prev_scanline, dtype=np.uint8)
+
+    for start in range(0, height, UNFILTER_STRIP_ROWS):
+        end = min(start + UNFILTER_STRIP_ROWS, height)
+        strip_filters = filter_types[start:end]
+
+        # Average and Paeth depend on the reconstructed left pixel, so they need the wavefront pass
+        if np.any(strip_filters >= 3):
+            _unfilter_wavefront(strip_filters, filtered[start:end], prev, bytes_per_pixel, result[start:end])
+        else:
+            _unfilter_rows(strip_filters, filtered[start:end], prev, bytes_per_pixel, result[start:end])
+
+        prev = result[end - 1]
+
+    return result
+
+# Reconstructs rows filtered with None/Up/Sub, one whole row per NumPy operation
+def _unfilter_rows(filter_types, filtered, prev, bytes_per_pixel, out):
+    for y in range(len(filter_types)):
+        filter_type = filter_types[y]
+        if filter_type == 0:  # None
+            out[y] = filtered[y]
+        elif filter_type == 1:  # Sub - running sum along each pixel column, wrapping at 256
+            np.cumsum(filtered[y].reshape((-1, bytes_per_pixel)), axis=0, dtype=np.uint8,
+                      out=out[y].reshape((-1, bytes_per_pixel)))
+        else:  # Up
+            np.add(filtered[y], prev, out=out[y])
+        prev = out[y]
+
+# Reconstructs a strip of rows with any mix of filters.
+# Pixel (y, x) depends only on (y, x-1), (y-1, x) and (y-1, x-1), so every pixel on the
+# anti-diagonal x + y = k can be computed at once. The strip is stored skewed, with
+# diagonal k at index k + 2 of the first axis, so each step works on contiguous slices.
+def _unfilter_wavefront(filter_types, filtered, prev, bytes_per_pixel, out):
+    height = len(filter_types)
+    columns = filtered.shape[1] // bytes_per_pixel
+    pixels = filtered.reshape((height, columns, bytes_per_pixel))
+
+    # Slot 0 of the second axis holds the previous row, slot y + 1 holds row y
+    skewed = np.zeros((columns + height + 1, height + 1, bytes_per_pixel), dtype=np.uint8)
+    skewed[1:columns + 1, 0] = prev.reshape((columns, bytes_per_pixel))
+    skewed_filtered = np.empty((columns + height - 1, height, bytes_per_pixel), dtype=np.uint8)
+    for y in range(height):
+        skewed_filtered[y:y + columns, y] = pixels[y]
+
+    # None, Sub and Up are Paeth with some neighbours forced to zero: with b = c = 0 it
+    # predicts a, with a = c = 0 it predicts b, and with all three zero it predicts 0
+    row_filters = filter_types.reshape((height, 1))
+    uses_left = np.isin(row_filters, (1, 3, 4)).astype(np.int16)
+    uses_up = np.isin(row_filters, (2, 3, 4)).astype(np.int16)
+    uses_up_left = (row_filters == 4).astype(np.int16)
+    is_average = row_filters == 3
+
+    for k in range(columns + height - 1):
+        lo = max(0, k - columns + 1)
+        hi = min(height, k + 1)
+
+        a = skewed[k + 1, lo + 1:hi + 1] * uses_left[lo:hi]  # left
+        b = skewed[k + 1, lo:hi] * uses_up[lo:hi]  # up
+        c = skewed[k, lo:hi] * uses_up_left[lo:hi]  # up-left
+
+        predictor = np.where(is_average[lo:hi], (a + b) >> 1, paeth_predictor_array(a, b, c))
+
+        skewed[k + 2, lo + 1:hi + 1] = (skewed_filtered[k, lo:hi] + predictor) & 0xFF
+
+    out_pixels = out.reshape((height, columns, bytes_per_pixel))
+    for y in range(height):
+        out_pixels[y] = skewed[y + 2:y + 2 + columns, y + 1]
+
 def undo_filter(filter_type, scanline, prev_scanline, bytes_per_pixel):
-    result = bytearray(len(scanline))
     if filter_type == 0:  # None
         return scanline
-    elif filter_type == 1:  # Sub
-        for i in range(len(scanline)):
-            left = result[i - bytes_per_pixel] if i >= bytes_per_pixel else 0
-            result[i] = (scanline[i] + left) & 0xFF
-    elif filter_type == 2:  # Up
-        for i in range(len(scanline)):
-            up = prev_scanline[i] if prev_scanline else 0
-            result[i] = (scanline[i] + up) & 0xFF
-    elif filter_type == 3:  # Average
-        for i in range(len(scanline)):
-            left = result[i - bytes_per_pixel] if i >= bytes_per_pixel else 0
-            up = prev_scanline[i] if prev_scanline else 0
-            result[i] = (scanline[i] + ((left + up) // 2)) & 0xFF
-    elif filter_type == 4:  # Paeth
-        for i in range(len(scanline)):
-            left = result[i - bytes_per_pixel] if i >= bytes_per_pixel else 0
-            up = prev_scanline[i] if prev_scanline else 0
-            up_left = prev_scanline[i - bytes_per_pixel] if (prev_scanline and i >= bytes_per_pixel) else 0
-            result[i] = (scanline[i] + paeth_predictor(left, up, up_left)) & 0xFF
-    else:
+    if filter_type > 4:
         raise ValueError(f"Unknown filter type {filter_type}")
+
+    row = bytes([filter_type]) + bytes(scanline)
+    result = unfilter_scanlines(row, 1, len(scanline), bytes_per_pixel, prev_scanline)
+    return bytearray(result.tobytes())
+
+# Filter type for apply_png_filters that picks the best filter for every row
+ADAPTIVE_FILTER = "adaptive"
+
+# Number of scanlines filtered together by filter_scanlines
+FILTER_STRIP_ROWS = 512
+
+# Filters a (height, bytes_per_scanline) uint8 array of raw scanlines.
+# Returns a (height, bytes_per_scanline + 1) uint8 array with the filter type byte in front of every row.
+def filter_scanlines(pixel_rows, bytes_per_pixel, filter_type=0, prev_scanline=None):
+    height, bytes_per_scanline = pixel_rows.shape
+    result = np.empty((height, bytes_per_scanline + 1), dtype=np.uint8)
+
+    if prev_scanline is None or len(prev_scanline) == 0:
+        prev = np.zeros(bytes_per_scanline, dtype=np.uint8)
+    else:
+        prev = np.frombuffer(prev_scanline, dtype=np.uint8)
+
+    for start in range(0, height, FILTER_STRIP_ROWS):
+        end = min(start + FILTER_STRIP_ROWS, height)
+        rows = pixel_rows[start:end].astype(np.int16)
+        up = np.empty_like(rows)
+        up[0] = prev
+        up[1:] = rows[:-1]
+
+        if filter_type == ADAPTIVE_FILTER:
+            # libpng heuristic: minimum sum of absolute values, reading filtered bytes as signed
+            candidates = np.stack([_filter_rows(f, rows, up, bytes_per_pixel) for f in range(5)])
+            costs = np.minimum(candidates, 256 - candidates).sum(axis=2)
+            best = np.argmin(costs, axis=0)
+            result[start:end, 0] = best
+            result[start:end, 1:] = candidates[best, np.arange(end - start)]
+        else:
+            result[start:end, 0] = filter_type
+            result[start:end, 1:] = _filter_rows(filter_type, rows, up, bytes_per_pixel)
+
+        prev = pixel_rows[end - 1]
+
     return result
 
-def apply_filter(filter_type, scanline, prev_scanline, bytes_per_pixel):
-    result = bytearray(len(scanline))
-    
+# Applies one filter type to a strip of int16 rows, given the raw rows above them
+def _filter_rows(filter_type, rows, up, bytes_per_pixel):
     if filter_type == 0:  # None
-        return scanline
-    elif filter_type == 1:  # Sub
-        for i in range(len(scanline)):
-            left = scanline[i - bytes_per_pixel] if i >= bytes_per_pixel else 0
-            result[i] = (scanline[i] - left) & 0xFF
+        return rows
+
+    left = np.zeros_like(rows)
+    left[:, bytes_per_pixel:] = rows[:, :-bytes_per_pixel]
+
+    if filter_type == 1:  # Sub
+        predictor = left
     elif filter_type == 2:  # Up
-        for i in range(len(scanline)):
-            up = prev_scanline[i] if prev_scanline else 0
-            result[i] = (scanline[i] - up) & 0xFF
+        predictor = up
     elif filter_type == 3:  # Average
-        for i in range(len(scanline)):
-            left = scanline[i - bytes_per_pixel] if i >= bytes_per_pixel else 0
-            up = prev_scanline[i] if prev_scanline else 0
-            average = (left + up) // 2
-            result[i] = (scanline[i] - average) & 0xFF
+        predictor = (left + up) >> 1
     elif filter_type == 4:  # Paeth
-        for i in range(len(scanline)):
-            left = scanline[i - bytes_per_pixel] if i >= bytes_per_pixel else 0
-            up = prev_scanline[i] if prev_scanline else 0
-            up_left = prev_scanline[i - bytes_per_pixel] if (prev_scanline and i >= bytes_per_pixel) else 0
-            paeth = paeth_predictor(left, up, up_left)
-            result[i] = (scanline[i] - paeth) & 0xFF
+        up_left = np.zeros_like(up)
+        up_left[:, bytes_per_pixel:] = up[:, :-bytes_per_pixel]
+        predictor = paeth_predictor_array(left, up, up_left)
     else:
         raise ValueError(f"Unknown filter type {filter_type}")
 
-    return result
+    return (rows - predictor) & 0xFF
+
+def apply_filter(filter_type, scanline, prev_scanline, bytes_per_pixel):
+    if filter_type == 0:  # None
+        return scanline
+
+    row = np.frombuffer(bytes(scanline), dtype=np.uint8).reshape((1, -1))
+    result = filter_scanlines(row, bytes_per_pixel, filter_type, prev_scanline)
+    return bytearray(result[0, 1:].tobytes())
 
 def get_bytes_per_scanline(width, color_type, bit_depth):
     channels = get_channels_from_color_type(color_type)
@@ -448,6 +986,7 @@ def get_bytes_per_pixel(color_type, bit_depth):
     channels = get_channels_from_color_type(color_type)
     return (channels * bit_depth + 7) // 8
 
+# Filters raw pixel data for IDAT compression. filter_type is 0-4 or ADAPTIVE_FILTER.
 def apply_png_filters(pixel_data, image_info, filter_type=0):
     width = image_info['width']
     height = image_info['height']
@@ -457,21 +996,14 @@ def apply_png_filters(pixel_data, image_info, filter_type=0):
     bytes_per_pixel = get_bytes_per_pixel(color_type, bit_depth)
     bytes_per_scanline = get_bytes_per_scanline(width, color_type, bit_depth)
 
-    filtered_data = bytearray()
-    prev_scanline = None
-
-    for y in range(height):
-        start = y * bytes_per_scanline
-        end = start + bytes_per_scanline
-        scanline = pixel_data[start:end]
-
-        filtered_scanline = apply_filter(filter_type, scanline, prev_scanline, bytes_per_pixel)
+    # As in libpng, palette and sub-byte images compress best unfiltered
+    if filter_type == ADAPTIVE_FILTER and (color_type == 3 or bit_depth < 8):
+        filter_type = 0
 
-        filtered_data.append(filter_type)
-        filtered_data.extend(filtered_scanline)
-        prev_scanline = scanline
+    pixel_rows = np.frombuffer(pixel_data, dtype=np.uint8, count=height * bytes_per_scanline)
+    pixel_rows = pixel_rows.reshape((height, bytes_per_scanline))
 
-    return bytes(filtered_data)
+    return filter_scanlines(pixel_rows, bytes_per_pixel, filter_type).tobytes()
 
 def remove_png_filters(data, image_info):
     width = image_info['width']
@@ -482,22 +1014,5 @@ def remove_png_filters(data, image_info):
     bytes_per_pixel = get_bytes_per_pixel(color_type, bit_depth)
     bytes_per_scanline = get_bytes_per_scanline(width, color_type, bit_depth)
 
-    pixels = []
-    prev_scanline = None
-    offset = 0
-
-    for _ in range(height):
-        if offset + 1 + bytes_per_scanline > len(data):
-            raise ValueError("Unexpected end of IDAT data")
-
-        filter_type = data[offset]
-        offset += 1
-
-        scanline = data[offset:offset + bytes_per_scanline]
-        offset += bytes_per_scanline
-
-        unfiltered = undo_filter(filter_type, scanline, prev_scanline, bytes_per_pixel)
-        pixels.append(unfiltered)
-        prev_scanline = unfiltered
-
-    return b''.join(pixels)
\ No newline at end of file
+    pixel_rows = unfilter_scanlines(data, height, bytes_per_scanline, bytes_per_pixel)
+    return pixel_rows.tobytes()
\ No newline at end of file
@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+# Version of the stored parse_IDAT results. Rows written under any other version are treated as
+# missing and recomputed (then overwritten), so bump it whenever the analysis output changes:
+# added or renamed fields, or different values for the same image.
+RESULT_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    content_hash TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    image TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    content_hash TEXT NOT NULL
+);
+"""
+
+# SHA-256 of the IHDR payload and the concatenated IDAT stream: everything the decoded image depends on.
+# Ancillary chunks and the way IDAT is split into chunks do not change it.
+def content_hash(chunks):
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        if chunk.type == "IHDR":
+            digest.update(b"IHDR")
+            digest.update(chunk.data)
+            digest.update(b"IDAT")
+        elif chunk.type == "IDAT":
+            digest.update(chunk.data)
+    return digest.hexdigest()
+
+# On-disk store of parse_IDAT results keyed by content_hash, so unchanged or duplicate
+# images are decoded once. A file table remembers the hash of each path by mtime and size,
+# so unchanged files are not even hashed. Safe to open from several processes at once.
+class ResultStore:
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(_SCHEMA)
+
+    # Hash recorded for file_path, or None if the file changed since
+    def get_file_hash(self, file_path):
+        stat = os.stat(file_path)
+        row = self.connection.execute("SELECT mtime_ns, size, content_hash FROM files WHERE path = ?",
+                                      (os.path.realpath(file_path),)).fetchone()
+        if row is None or row[:2] != (stat.st_mtime_ns, stat.st_size):
+            return None
+        return row[2]
+
+    def put_file_hash(self, file_path, content_hash):
+        stat = os.stat(file_path)
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                                    (os.path.realpath(file_path), stat.st_mtime_ns, stat.st_size, content_hash))
+
+    def get(self, content_hash):
+        row = self.connection.execute("SELECT version, image FROM results WHERE content_hash = ?",
+                                      (content_hash,)).fetchone()
+        if row is None or row[0] != RESULT_VERSION:
+            return None
+        return json.loads(row[1])
+
+    def put(self, content_hash, image):
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                                    (content_hash, RESULT_VERSION, json.dumps(image, default=str)))
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,5 +1,24 @@
+import os
 import random
-from sympy import isprime
+import block_engine
+
+# Fork-safe randomness: worker processes searching for p and q in parallel must not share a state
+_random = random.SystemRandom()
+
+# Odd candidates covered by one sieve window during the prime search
+SIEVE_WINDOW = 8192
+
+# Returns all primes below limit (sieve of Eratosthenes)
+def primes_below(limit):
+    sieve = bytearray([1]) * limit
+    sieve[0:2] = b'\x00\x00'
+    for i in range(2, int(limit ** 0.5) + 1):
+        if sieve[i]:
+            sieve[i * i::i] = bytes(len(range(i * i, limit, i)))
+    return [i for i in range(limit) if sieve[i]]
+
+# Odd primes used for trial division before Miller-Rabin
+SMALL_PRIMES = primes_below(1 << 16)[1:]
 
 # Computes the greatest common divisor (GCD) of two integers using Euclidean algorithm
 def gcd(a, b):
@@ -17,20 +36,115 @@ def modinv(a, m):
         x0, x1 = x1 - q * x0, x0
     return x1 % m0
 
-# Generates a random prime number with specified bit length
+# Miller-Rabin rounds for an error probability below 2^-100 on random candidates (FIPS 186-4, C.3)
+def miller_rabin_rounds(bits):
+    if bits >= 1536:
+        return 3
+    if bits >= 1024:
+        return 4
+    if bits >= 512:
+        return 7
+    return 40
+
+# Miller-Rabin probabilistic primality test, base 2 first then random bases
+def is_probable_prime(n, rounds=None):
+    if n < 3:
+        return n == 2
+    if n % 2 == 0:
+        return False
+    for p in SMALL_PRIMES[:16]:
+        if n % p == 0:
+            return n == p
+
+    # n - 1 = d * 2^s with d odd
+    d, s = n - 1, 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+
+    rounds = rounds or miller_rabin_rounds(n.bit_length())
+    bases = [2] + [_random.randrange(3, n - 1) for _ in range(rounds - 1)]
+    for a in bases:
+        x = pow(a, d, n)
+        if x == 1 or x == n - 1:
+            continue
+        for _ in range(s - 1):
+            x = pow(x, 2, n)
+            if x == n - 1:
+                break
+        else:
+            return False
+
+    return True
+
+# Generates a random prime number with specified bit length.
+# Starts from a random odd number and walks upwards through windows of odd candidates;
+# candidates divisible by a small prime are struck out of the window before any Miller-Rabin test.
 def generate_prime(bits):
+    # Too small to sieve: the window would strike out primes from the table itself
+    if 1 << (bits - 1) <= SMALL_PRIMES[-1]:
+        while True:
+            p = _random.getrandbits(bits) | (1 << bits - 1) | 1
+            if is_probable_prime(p):
+                return p
+
     while True:
-        # Generate random odd number with MSB and LSB set to 1
-        p = random.getrandbits(bits)
-        p |= (1 << bits - 1) | 1    # ensure it's odd and has correct bit length
-        if isprime(p):
-            return p
+        # Two top bits set, so p * q has exactly 2 * bits bits; LSB set, so start is odd
+        start = _random.getrandbits(bits) | (3 << bits - 2) | 1
+        while start.bit_length() == bits:
+            window = bytearray([1]) * SIEVE_WINDOW
+            for p in SMALL_PRIMES:
+                # Index k of the first candidate start + 2k divisible by p
+                k = (-start % p) * ((p + 1) // 2) % p
+                window[k::p] = bytes(len(range(k, SIEVE_WINDOW, p)))
+
+            for k in range(SIEVE_WINDOW):
+                candidate = start + 2 * k
+                if window[k] and candidate.bit_length() == bits and is_probable_prime(candidate):
+                    return candidate
+
+            start += 2 * SIEVE_WINDOW
+
+# Searches for one prime per entry of bit_sizes in parallel, one process each
+def generate_primes(bit_sizes, workers=None):
+    workers = workers or min(len(bit_sizes), os.cpu_count() or 1)
+    return block_engine.map_batches(generate_prime, list(bit_sizes), workers)
+
+# RSA private key with the factors of n and the precomputed CRT exponents.
+# Still indexes and unpacks like the old (d, n) tuple.
+class PrivateKey:
+    __slots__ = ("d", "n", "e", "p", "q", "dP", "dQ", "qInv")
+
+    def __init__(self, d, n, e, p, q):
+        self.d = d
+        self.n = n
+        self.e = e
+        self.p = p
+        self.q = q
+        self.dP = d % (p - 1)
+        self.dQ = d % (q - 1)
+        self.qInv = modinv(q, p)
+
+    # Computes c^d mod n using the Chinese Remainder Theorem (two half-size exponentiations)
+    def decrypt(self, c):
+        m1 = pow(c, self.dP, self.p)
+        m2 = pow(c, self.dQ, self.q)
+        h = (self.qInv * (m1 - m2)) % self.p
+        return m2 + h * self.q
+
+    def __getitem__(self, index):
+        return (self.d, self.n)[index]
+
+    def __iter__(self):
+        return iter((self.d, self.n))
+
+    def __len__(self):
+        return 2
 
 # Generates RSA public and private key pair
-def generate_keypair(bits = 512):
-    # Generate two distinct large primes p and q
-    p = generate_prime(bits)
-    q = generate_prime(bits)
+def generate_keypair(bits = 512, workers=None):
+    # Generate two distinct large primes p and q, searched for in parallel
+    p, q = generate_primes((bits, bits), workers)
     while q == p:
         q = generate_prime(bits)
 
@@ -50,4 +164,4 @@ def generate_keypair(bits = 512):
     # Compute private exponent d such that (d * e) % φ(n) = 1
     d = modinv(e, phi)
 
-    return (e, n), (d, n)
+    return (e, n), PrivateKey(d, n, e, p, q)
@@ -1,9 +1,12 @@
 import zlib
+from functools import partial
 from Crypto.PublicKey import RSA
 from Crypto.Cipher import PKCS1_v1_5
 from Crypto.Random import get_random_bytes
 from chunks import PngChunk
 import png_parser
+import block_engine
+import instrumentation
 
 # Computes CRC for a given PNG chunk type and data
 def compute_crc(chunk_type, data):
@@ -11,76 +14,99 @@ def compute_crc(chunk_type, data):
     crc = zlib.crc32(check_bytes) & 0xFFFFFFFF
     return crc
 
-# Encrypt a single PNG chunk using RSA PKCS#1 v1.5 encryption
-def encrypt_chunk_rsa_lib(chunk: PngChunk, public_key) -> PngChunk:
-    # Encrypt only IDAT chunks
-    if chunk.type != 'IDAT':
-        return chunk
-
+# Encrypts consecutive plaintext blocks with PKCS#1 v1.5, runs in block_engine workers
+def encrypt_blocks_rsa_lib(data, public_key, chunk_size):
     e, n = public_key
     rsa_key = RSA.construct((n, e))  # Construct RSA-key from public key
     cipher = PKCS1_v1_5.new(rsa_key)  # Init PKCS#1 v1.5 encryption cipher
-
-    block_size = rsa_key.size_in_bytes()  # RSA block size (in bytes)
-    chunk_size = block_size - 11  # Maximum block size for RSA encryption padding
-    data = zlib.decompress(chunk.data)
     encrypted_data = bytearray()
 
-    # Encrypt data
     for i in range(0, len(data), chunk_size):
         block = data[i:i + chunk_size]
         encrypted_block = cipher.encrypt(block)  # Encrypt using the RSA cipher
         encrypted_data.extend(encrypted_block)
 
-    encrypted_data = zlib.compress(encrypted_data)
+    return bytes(encrypted_data)
+
+# Decrypts consecutive ciphertext blocks with PKCS#1 v1.5, runs in block_engine workers
+def decrypt_blocks_rsa_lib(data, private_key, block_size):
+    # Construct RSA-key from private key, with the factors so the library decrypts using CRT
+    rsa_key = RSA.construct((private_key.n, private_key.e, private_key.d, private_key.p, private_key.q))
+    cipher = PKCS1_v1_5.new(rsa_key)  # Init PKCS#1 v1.5 decryption cipher
+    sentinel = get_random_bytes(8)  # Used to detect decryption failure
+    decrypted_data = bytearray()
+
+    for i in range(0, len(data), block_size):
+        block = data[i:i + block_size]
+        decrypted_block = cipher.decrypt(block, sentinel)  # Decrypt using the RSA cipher with sentinel to detect decryption failure
+        decrypted_data.extend(decrypted_block)
+
+    return bytes(decrypted_data)
+
+# Encrypt a single PNG chunk using RSA PKCS#1 v1.5 encryption
+def encrypt_chunk_rsa_lib(chunk: PngChunk, public_key, workers=None) -> PngChunk:
+    # Encrypt only IDAT chunks
+    if chunk.type != 'IDAT':
+        return chunk
+
+    block_size = (public_key[1].bit_length() + 7) // 8  # RSA block size (in bytes)
+    chunk_size = block_size - 11  # Maximum block size for RSA encryption padding
+    with instrumentation.timer("rsa_lib.inflate"):
+        data = zlib.decompress(chunk.data)
+    instrumentation.count("rsa_lib.bytes", len(data))
+    instrumentation.count("rsa_lib.blocks", -(-len(data) // chunk_size))
+
+    # Encrypt data
+    encrypt_batch = partial(encrypt_blocks_rsa_lib, public_key=public_key, chunk_size=chunk_size)
+    with instrumentation.timer("rsa_lib.encrypt_rsa"):
+        encrypted_data = block_engine.map_blocks(encrypt_batch, data, chunk_size, workers)
+
+    with instrumentation.timer("rsa_lib.deflate"):
+        encrypted_data = zlib.compress(encrypted_data)
     new_crc = compute_crc(chunk.type, encrypted_data)
     return PngChunk(length=len(encrypted_data),chunk_type=chunk.type, data=encrypted_data, crc=new_crc)
 
 # Decrypts a single PNG chunk using the RSA PKCS#1 v1.5 decryption mode
-def decrypt_chunk_rsa_lib(chunk: PngChunk, private_key) -> PngChunk:
+def decrypt_chunk_rsa_lib(chunk: PngChunk, private_key, workers=None) -> PngChunk:
     # Decrypt only IDAT  chunks
     if chunk.type != 'IDAT':
         return chunk
 
-    d, n = private_key
-    e = 65537  # Exponent used in rsa.py
-    rsa_key = RSA.construct((n, e, d))  # Construct RSA-key from private key
-    cipher = PKCS1_v1_5.new(rsa_key)  # Init PKCS#1 v1.5 decryption cipher
-
-    block_size = rsa_key.size_in_bytes()  # RSA block size (in bytes)
-    sentinel = get_random_bytes(8)  # Used to detect decryption failure
-    decrypted_data = bytearray()
-    data = zlib.decompress(chunk.data)
+    block_size = (private_key[1].bit_length() + 7) // 8  # RSA block size (in bytes)
+    with instrumentation.timer("rsa_lib.inflate"):
+        data = zlib.decompress(chunk.data)
+    instrumentation.count("rsa_lib.bytes", len(data))
+    instrumentation.count("rsa_lib.blocks", len(data) // block_size)
 
     # Decrypt data
-    for i in range(0, len(data), block_size):
-        block = data[i:i + block_size]
-        decrypted_block = cipher.decrypt(block, sentinel)  # Decrypt using the RSA cipher with sentinel to detect decryption failure
-        decrypted_data.extend(decrypted_block)
+    decrypt_batch = partial(decrypt_blocks_rsa_lib, private_key=private_key, block_size=block_size)
+    with instrumentation.timer("rsa_lib.decrypt_rsa"):
+        decrypted_data = block_engine.map_blocks(decrypt_batch, data, block_size, workers)
 
-    decrypted_data = zlib.compress(decrypted_data)
+    with instrumentation.timer("rsa_lib.deflate"):
+        decrypted_data = zlib.compress(decrypted_data)
     new_crc = compute_crc(chunk.type, decrypted_data)
     return PngChunk(length=len(decrypted_data), chunk_type=chunk.type, data=decrypted_data, crc=new_crc)
 
 # Encrypt PNG file using RSA library
-def encrypt_png_rsa_lib(input_path: str, output_path: str, public_key) -> None:
-    chunks = png_parser.read_chunks(input_path)
+def encrypt_png_rsa_lib(input_path: str, output_path: str, public_key, workers=None) -> None:
+    chunks = png_parser.load_chunks(input_path)
 
     encrypted_chunks = []
     for chunk in chunks:
-        encrypted_chunk = encrypt_chunk_rsa_lib(chunk, public_key)
+        encrypted_chunk = encrypt_chunk_rsa_lib(chunk, public_key, workers)
         encrypted_chunks.append(encrypted_chunk)
 
     png_parser.write_chunks(output_path, encrypted_chunks)
     print(f"Encrypted with RSA library successfully - {output_path}")
 
 # Decrypt PNG file using RSA library
-def decrypt_png_rsa_lib(input_path: str, output_path: str, private_key) -> None:
-    chunks = png_parser.read_chunks(input_path)
+def decrypt_png_rsa_lib(input_path: str, output_path: str, private_key, workers=None) -> None:
+    chunks = png_parser.load_chunks(input_path)
 
     decrypted_chunks = []
     for chunk in chunks:
-        decrypted_chunk = decrypt_chunk_rsa_lib(chunk, private_key)
+        decrypted_chunk = decrypt_chunk_rsa_lib(chunk, private_key, workers)
         decrypted_chunks.append(decrypted_chunk)
 
     png_parser.write_chunks(output_path, decrypted_chunks)
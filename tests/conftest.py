@@ -0,0 +1,52 @@
+import os
+import sys
+import zlib
+import numpy as np
+import pytest
+
+# The modules live flat in src/ and import each other by name
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+
+from chunks import PngChunk
+import png_parser
+from rsa import generate_keypair
+
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "assets")
+
+# Writes pixels (height, width[, channels]) as a non-interlaced PNG with the IDAT stream split
+# into `idat_chunks` chunks, and returns the path
+def write_png(path, pixels, color_type, bit_depth=8, filter_type=png_parser.ADAPTIVE_FILTER,
+              idat_chunks=1, extra_chunks=()):
+    height, width = pixels.shape[:2]
+    ihdr = width.to_bytes(4, "big") + height.to_bytes(4, "big") + bytes([bit_depth, color_type, 0, 0, 0])
+    raw = np.ascontiguousarray(pixels.astype(">u2" if bit_depth == 16 else np.uint8)).tobytes()
+    image_info = {"width": width, "height": height, "color_type": color_type, "bit_depth": bit_depth}
+    idat = zlib.compress(png_parser.apply_png_filters(raw, image_info, filter_type))
+
+    step = -(-len(idat) // idat_chunks)
+    chunks = [PngChunk(len(ihdr), "IHDR", ihdr), *extra_chunks]
+    chunks += [PngChunk(len(idat[i:i + step]), "IDAT", idat[i:i + step]) for i in range(0, len(idat), step)]
+    chunks.append(PngChunk(0, "IEND", b""))
+    png_parser.write_chunks(str(path), chunks)
+    return str(path)
+
+# Decoded pixels of a PNG file, for comparing images whose IDAT was recompressed
+def decode_png(path):
+    chunks = png_parser.read_chunks(str(path))
+    ihdr = png_parser.parse_IHDR(chunks[0])
+    return png_parser.decode_IDAT([chunk.data for chunk in chunks if chunk.type == "IDAT"],
+                                  ihdr["width"], ihdr["height"], ihdr["bit_depth"], ihdr["color_type"])
+
+def random_pixels(height, width, channels, bit_depth=8, seed=0):
+    rng = np.random.default_rng(seed)
+    shape = (height, width, channels) if channels > 1 else (height, width)
+    return rng.integers(0, 1 << bit_depth, shape)
+
+@pytest.fixture(scope="session")
+def keypair():
+    return generate_keypair(256)
+
+@pytest.fixture
+def rgb_png(tmp_path):
+    return write_png(tmp_path / "rgb.png", random_pixels(24, 40, 3), color_type=2)
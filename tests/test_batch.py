@@ -0,0 +1,52 @@
+import io
+import json
+import batch
+import image_cache
+import main
+from conftest import random_pixels, write_png
+
+def make_tree(tmp_path):
+    (tmp_path / "sub" / "deeper").mkdir(parents=True)
+    paths = [write_png(tmp_path / "a.png", random_pixels(5, 6, 3), 2),
+             write_png(tmp_path / "sub" / "b.png", random_pixels(4, 4, 1), 0),
+             write_png(tmp_path / "sub" / "deeper" / "c.png", random_pixels(3, 7, 4), 6)]
+    broken = tmp_path / "sub" / "broken.png"
+    broken.write_bytes(b"\x89PNG\r\n\x1a\n" + bytes(5))
+    (tmp_path / "notes.txt").write_text("not an image")
+    return paths, str(broken)
+
+def test_find_png_files(tmp_path):
+    paths, broken = make_tree(tmp_path)
+    assert batch.find_png_files(str(tmp_path)) == sorted(paths + [broken])
+    assert batch.find_png_files(str(tmp_path / "sub" / "*.png")) == sorted([paths[1], broken])
+
+def test_analyze_files_reports_every_file(tmp_path):
+    paths, broken = make_tree(tmp_path)
+    results = {result["path"]: result for result in batch.analyze_files(paths + [broken], workers=2, chunksize=1)}
+
+    assert set(results) == set(paths + [broken])
+    assert "error" in results[broken]
+    assert results[paths[2]]["image"]["raw_shape"] == "3x7x4"
+    assert results[paths[0]]["metadata"]["IHDR"]["color_type"] == 2
+
+def test_write_ndjson_counts_failures():
+    output = io.StringIO()
+    failed = batch.write_ndjson([{"path": "a"}, {"path": "b", "error": "bad"}], output)
+
+    assert failed == 1
+    assert [json.loads(line) for line in output.getvalue().splitlines()] == [{"path": "a"}, {"path": "b", "error": "bad"}]
+
+def test_batch_command(tmp_path, capsys):
+    paths, broken = make_tree(tmp_path)
+    assert main.batch_utils([str(tmp_path), "--workers", "1"]) == 1
+
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert sorted(line["path"] for line in lines) == sorted(paths + [broken])
+
+def test_batch_workers_do_not_keep_files_cached(tmp_path):
+    paths = [write_png(tmp_path / f"{i}.png", random_pixels(6, 5, 3, seed=i), 2) for i in range(3)]
+    image_cache.get_cache().clear()
+
+    results = batch._analyze_batch(paths)
+    assert all("error" not in result for result in results)
+    assert image_cache.stats()["entries"] == 0
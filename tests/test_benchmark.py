@@ -0,0 +1,59 @@
+import json
+import numpy as np
+import benchmark
+from conftest import decode_png
+
+def result(stage, min_seconds, input_name="x.png"):
+    return {"stage": stage, "input": input_name, "seconds": min_seconds, "min_seconds": min_seconds}
+
+def test_compare_results_flags_slowdowns_and_errors():
+    baseline = {"results": [result("a", 0.100), result("b", 0.100), result("c", 0.100), result("d", 0.0001)]}
+    results = [result("a", 0.120), result("b", 0.200),
+               {"stage": "c", "input": "x.png", "error": "ValueError: broken"},
+               # Ten times slower, but within timer noise
+               result("d", 0.001),
+               # Not in the baseline
+               result("e", 5.0)]
+
+    regressions = benchmark.compare_results(results, baseline)
+    assert len(regressions) == 2
+    assert regressions[0].startswith("b on x.png: 200.00 ms")
+    assert regressions[1] == "c on x.png: ValueError: broken"
+
+def test_synthetic_image_decodes(tmp_path):
+    path = str(tmp_path / "synthetic.png")
+    benchmark.write_synthetic_image(path, 32)
+    pixels = decode_png(path)
+    assert pixels.shape == (32, 32, 3) and pixels.dtype == np.uint8
+
+def test_run_benchmarks(tmp_path):
+    path = str(tmp_path / "synthetic.png")
+    benchmark.write_synthetic_image(path, 16)
+    stages = ["read_chunks", "remove_png_filters", "rsa_lib_encrypt", "rsa_lib_decrypt"]
+
+    results = benchmark.run_benchmarks([path], stages, repeat=1, key_bits=256)
+    assert [r["stage"] for r in results] == stages
+    for r in results:
+        assert r["input"] == "synthetic.png" and r["raw_bytes"] == 16 * (1 + 16 * 3)
+        assert r["min_seconds"] <= r["seconds"] and r["peak_memory_bytes"] > 0
+
+    (skipped,) = benchmark.run_benchmarks([path], ["rsa_lib_encrypt"], repeat=1, key_bits=256, cipher_max_bytes=0)
+    assert "seconds" not in skipped and skipped["skipped"] == "more than 0 raw bytes"
+
+def test_main_checks_against_saved_baseline(tmp_path, monkeypatch):
+    monkeypatch.setattr(benchmark, "SYNTHETIC_SIZES", (16,))
+    baseline_path = str(tmp_path / "baseline.json")
+    args = ["--stages", "read_chunks", "--inputs", "synthetic", "--repeat", "1"]
+
+    assert benchmark.main(args + ["--save-baseline", baseline_path]) == 0
+    with open(baseline_path) as f:
+        report = json.load(f)
+    assert [(r["stage"], r["input"]) for r in report["results"]] == [("read_chunks", "synthetic_16.png")]
+    assert benchmark.main(args + ["--baseline", baseline_path]) == 0
+
+    report["results"][0]["min_seconds"] = 0.0
+    report["results"][0]["seconds"] = 0.0
+    with open(baseline_path, "w") as f:
+        json.dump(report, f)
+    # Reading a tiny file takes well under MIN_REGRESSION_SECONDS
+    assert benchmark.main(args + ["--baseline", baseline_path]) == 0
@@ -0,0 +1,29 @@
+import threading
+import block_engine
+
+def test_get_executor_keeps_one_pool_per_worker_count():
+    assert block_engine.get_executor(2) is block_engine.get_executor(2)
+    assert block_engine.get_executor(3) is not block_engine.get_executor(2)
+
+def test_map_blocks_joins_batches_in_order():
+    data = bytes(range(256)) * 20
+    assert block_engine.map_blocks(bytes.upper, data, 16, workers=2, blocks_per_batch=4) == data.upper()
+
+def test_map_batches_from_threads_with_different_worker_counts():
+    batches = [bytes(i) for i in range(50)]
+    errors = []
+
+    def run(workers):
+        try:
+            for _ in range(5):
+                assert block_engine.map_batches(len, batches, workers) == list(range(50))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(workers,)) for workers in (2, 3, 2, 3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
@@ -0,0 +1,153 @@
+import contextlib
+import shutil
+import struct
+import zlib
+import pytest
+import png_parser
+from chunks import PngChunk
+from conftest import ASSETS_DIR, random_pixels, write_png
+
+@pytest.fixture
+def sand_copy(tmp_path):
+    path = str(tmp_path / "sand.png")
+    shutil.copy(f"{ASSETS_DIR}/sand.png", path)
+    return path
+
+def read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def test_read_chunks_owns_payloads(sand_copy):
+    chunks = png_parser.read_chunks(sand_copy)
+    assert [chunk.type for chunk in chunks][0] == "IHDR" and chunks[-1].type == "IEND"
+    assert all(isinstance(chunk.data, bytes) for chunk in chunks)
+
+def test_iter_chunks_matches_read_chunks(sand_copy):
+    expected = [(chunk.type, chunk.data, chunk.crc) for chunk in png_parser.read_chunks(sand_copy)]
+    assert [(chunk.type, bytes(chunk.data), chunk.crc) for chunk in png_parser.iter_chunks(sand_copy)] == expected
+
+def test_rewrite_same_path_from_read_chunks(sand_copy):
+    original = read_bytes(sand_copy)
+    png_parser.write_chunks(sand_copy, png_parser.read_chunks(sand_copy))
+    assert read_bytes(sand_copy) == original
+
+def test_rewrite_same_path_from_mapped_views(sand_copy):
+    original = read_bytes(sand_copy)
+    with contextlib.closing(png_parser.iter_chunks(sand_copy)) as chunks:
+        kept = []
+        for chunk in chunks:
+            chunk.data, chunk.crc
+            kept.append(chunk)
+            if chunk.type == "IEND":
+                break
+        png_parser.write_chunks(sand_copy, kept)
+    assert read_bytes(sand_copy) == original
+
+def test_mapped_chunks_expire_with_the_iterator(sand_copy):
+    chunks = list(png_parser.iter_chunks(sand_copy))
+    with pytest.raises(ValueError):
+        chunks[0].data
+
+def test_iter_chunks_rejects_non_png(tmp_path):
+    path = tmp_path / "not.png"
+    path.write_bytes(b"GIF89a" + bytes(20))
+    with pytest.raises(ValueError):
+        list(png_parser.iter_chunks(str(path)))
+
+def metadata_png(tmp_path):
+    extra = [
+        PngChunk(0, "tEXt", b"Title\x00Sand"),
+        PngChunk(0, "tEXt", b"Author\x00Someone"),
+        PngChunk(0, "zTXt", b"Comment\x00\x00" + zlib.compress(b"compressed text")),
+        PngChunk(0, "iTXt", b"Note\x00\x00\x00en\x00Notiz\x00caf\xc3\xa9"),
+        PngChunk(0, "tIME", struct.pack(">HBBBBB", 2024, 5, 6, 7, 8, 9)),
+        PngChunk(0, "pHYs", struct.pack(">IIB", 2835, 2835, 1)),
+    ]
+    for chunk in extra:
+        chunk.length = len(chunk.data)
+    return write_png(tmp_path / "metadata.png", random_pixels(6, 5, 3), 2, extra_chunks=extra)
+
+def test_scan_metadata_matches_extract_metadata(tmp_path):
+    path = metadata_png(tmp_path)
+    metadata = png_parser.scan_metadata(path)
+
+    assert metadata == png_parser.extract_metadata(png_parser.read_chunks(path))
+    assert [entry["keyword"] for entry in metadata["tEXt"]] == ["Title", "Author"]
+    assert metadata["zTXt"][0]["text"] == "compressed text"
+    assert metadata["iTXt"][0]["text"] == "caf\u00e9"
+    assert metadata["tIME"]["year"] == 2024 and metadata["pHYs"]["unit_sepecifier"] == "meter"
+    assert "IDAT" not in metadata
+
+def test_scan_metadata_skips_idat_payloads(tmp_path, monkeypatch):
+    path = write_png(tmp_path / "large.png", random_pixels(200, 200, 3), 2, idat_chunks=3)
+    bytes_read = []
+    real_open = open
+
+    class CountingFile:
+        def __init__(self, f):
+            self.f = f
+        def read(self, size=-1):
+            data = self.f.read(size)
+            bytes_read.append(len(data))
+            return data
+        def __getattr__(self, name):
+            return getattr(self.f, name)
+        def __enter__(self):
+            return self
+        def __exit__(self, *exc_info):
+            self.f.close()
+
+    monkeypatch.setattr(png_parser, "open", lambda *args: CountingFile(real_open(*args)), raising=False)
+    assert png_parser.scan_metadata(path)["IHDR"]["width"] == 200
+    assert sum(bytes_read) < 100
+
+def test_chunk_crc_is_computed_from_data():
+    chunk = PngChunk(4, "tEXt", b"a\x00bc")
+    assert chunk.crc == zlib.crc32(b"tEXta\x00bc")
+
+def test_index_chunks_loads_payloads_lazily(sand_copy):
+    indexed = png_parser.index_chunks(sand_copy)
+    assert all(chunk._data is None and chunk._crc is None for chunk in indexed)
+
+    expected = png_parser.read_chunks(sand_copy)
+    assert [(chunk.type, chunk.length) for chunk in indexed] == [(chunk.type, chunk.length) for chunk in expected]
+    assert indexed[1].data == expected[1].data and indexed[1].crc == expected[1].crc
+
+def test_chunk_without_data_or_source():
+    with pytest.raises(ValueError, match="has no data"):
+        PngChunk(3, "IDAT").data
+
+def test_chunk_has_no_instance_dict():
+    assert not hasattr(PngChunk(0, "IEND", b""), "__dict__")
+
+def flip_byte(path, offset):
+    with open(path, "r+b") as f:
+        f.seek(offset)
+        value = f.read(1)[0]
+        f.seek(offset)
+        f.write(bytes([value ^ 0xFF]))
+
+def test_verify_chunks_accepts_valid_file(sand_copy):
+    assert png_parser.verify_chunks(sand_copy) is None
+
+def test_verify_chunks_reports_first_bad_chunk(sand_copy, monkeypatch):
+    # Small blocks, so the CRC is carried across reads
+    monkeypatch.setattr(png_parser, "VERIFY_BLOCK_SIZE", 1000)
+    idat_index, idat = next((i, chunk) for i, chunk in enumerate(png_parser.index_chunks(sand_copy)) if chunk.type == "IDAT")
+    flip_byte(sand_copy, idat.offset + idat.length // 2)
+
+    report = png_parser.verify_chunks(sand_copy)
+    assert report["index"] == idat_index and report["type"] == "IDAT" and report["offset"] == idat.offset - 8
+    assert report["stored_crc"] == idat.crc != report["computed_crc"]
+
+def test_verify_files_reports_every_file(sand_copy, tmp_path):
+    bad = str(tmp_path / "bad.png")
+    shutil.copy(sand_copy, bad)
+    flip_byte(bad, 20)
+    truncated = tmp_path / "truncated.png"
+    truncated.write_bytes(read_bytes(sand_copy)[:100])
+
+    reports = dict(png_parser.verify_files([sand_copy, bad, str(truncated)], workers=1))
+    assert reports[sand_copy] is None
+    assert reports[bad]["type"] == "IHDR"
+    assert "error" in reports[str(truncated)]
@@ -0,0 +1,61 @@
+import glob
+import zlib
+import numpy as np
+import pytest
+from PIL import Image
+import png_parser
+from conftest import ASSETS_DIR, random_pixels, write_png
+
+def idat_of(path):
+    chunks = png_parser.read_chunks(path)
+    return png_parser.parse_IHDR(chunks[0]), [chunk.data for chunk in chunks if chunk.type == "IDAT"]
+
+def decode_file(path):
+    ihdr, idat = idat_of(path)
+    return png_parser.decode_IDAT(idat, ihdr["width"], ihdr["height"], ihdr["bit_depth"], ihdr["color_type"])
+
+ASSETS = sorted(path for path in glob.glob(f"{ASSETS_DIR}/*.png") if not path.endswith("_encrypted.png"))
+
+@pytest.mark.parametrize("path", ASSETS, ids=lambda path: path.rsplit("/", 1)[-1])
+def test_assets_match_pillow(path):
+    assert np.array_equal(decode_file(path), np.array(Image.open(path)))
+
+@pytest.mark.parametrize("bit_depth", [8, 16])
+@pytest.mark.parametrize("channels, color_type", [(1, 0), (2, 4), (3, 2), (4, 6)])
+def test_synthetic_images_round_trip(tmp_path, channels, color_type, bit_depth, monkeypatch):
+    # Small strips and inflate blocks, so rows cross IDAT chunk, inflate and strip boundaries
+    monkeypatch.setattr(png_parser, "UNFILTER_STRIP_ROWS", 4)
+    monkeypatch.setattr(png_parser, "INFLATE_BLOCK_SIZE", 37)
+    pixels = random_pixels(21, 13, channels, bit_depth)
+    path = write_png(tmp_path / "image.png", pixels, color_type, bit_depth, idat_chunks=5)
+
+    assert np.array_equal(decode_file(path), pixels)
+
+def test_row_strips_match_whole_image(tmp_path, monkeypatch):
+    monkeypatch.setattr(png_parser, "UNFILTER_STRIP_ROWS", 3)
+    path = write_png(tmp_path / "image.png", random_pixels(10, 9, 3), color_type=2, idat_chunks=4)
+    ihdr, idat = idat_of(path)
+
+    # Strips share one buffer, so each is copied before the next is decoded
+    strips = [strip.copy() for strip in png_parser.iter_IDAT_rows(idat, 9, 10, 8, 2)]
+    assert [len(strip) for strip in strips] == [3, 3, 3, 1]
+    assert np.array_equal(np.concatenate(strips), decode_file(path))
+
+def test_joined_and_split_idat_agree(rgb_png):
+    ihdr, idat = idat_of(rgb_png)
+    args = ihdr["width"], ihdr["height"], ihdr["bit_depth"], ihdr["color_type"]
+    assert png_parser.parse_IDAT(b"".join(idat), *args) == png_parser.parse_IDAT(idat, *args)
+
+def test_truncated_idat_is_rejected():
+    # Four of five rows of 1 + 3 bytes
+    data = zlib.compress(bytes(4 * 4))
+    with pytest.raises(ValueError, match="Unexpected end"):
+        png_parser.decode_IDAT(data, 3, 5, 8, 0)
+
+def test_corrupt_idat_is_rejected():
+    with pytest.raises(ValueError, match="Decompression failed"):
+        png_parser.decode_IDAT(b"not zlib data", 3, 5, 8, 0)
+
+def test_unsupported_bit_depth_is_rejected():
+    with pytest.raises(ValueError, match="bit depth"):
+        png_parser.decode_IDAT(zlib.compress(bytes(10)), 8, 5, 1, 0)
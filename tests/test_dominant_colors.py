@@ -0,0 +1,41 @@
+from collections import Counter
+import numpy as np
+import pytest
+import png_parser
+
+def counter_most_common(values, top_n=5):
+    return Counter(values).most_common(top_n)
+
+@pytest.mark.parametrize("seed", range(8))
+@pytest.mark.parametrize("levels", [3, 256])
+@pytest.mark.parametrize("bit_depth", [8, 16])
+def test_rgb_matches_counter(seed, levels, bit_depth):
+    rng = np.random.default_rng(seed)
+    arr = (rng.integers(0, levels, (23, 31, 3)) * ((1 << bit_depth) // 256)).astype(np.uint8 if bit_depth == 8 else ">u2")
+    expected = counter_most_common(tuple(int(v) for v in pixel) for pixel in arr.reshape(-1, 3))
+
+    assert list(png_parser.get_dominant_colors(arr, 2).items()) == [(f"RGB{key}", count) for key, count in expected]
+
+@pytest.mark.parametrize("seed", range(8))
+@pytest.mark.parametrize("color_type, levels", [(0, 4), (0, 256), (3, 5)])
+def test_gray_and_palette_match_counter(seed, color_type, levels):
+    arr = np.random.default_rng(seed).integers(0, levels, (19, 27)).astype(np.uint8)
+    expected = counter_most_common(int(v) for v in arr.ravel())
+    label = "Palette index" if color_type == 3 else "Gray"
+
+    assert list(png_parser.get_dominant_colors(arr, color_type).items()) == [(f"{label} {key}", count) for key, count in expected]
+
+def test_ties_are_ordered_by_first_occurrence(monkeypatch):
+    # Keys far apart, so the scan needs several blocks
+    monkeypatch.setattr(png_parser, "FIRST_OCCURRENCE_BLOCK", 4)
+    keys = np.array([9, 1, 1, 7, 2, 2, 3, 3, 8, 5, 5, 6, 6], dtype=np.uint8)
+    assert png_parser._most_common_keys(keys, 256, 3) == [(1, 2), (2, 2), (3, 2)]
+    assert png_parser._most_common_keys(keys, 256, 8) == [(1, 2), (2, 2), (3, 2), (5, 2), (6, 2), (9, 1), (7, 1), (8, 1)]
+
+def test_histograms_count_every_pixel():
+    arr = np.random.default_rng(0).integers(0, 256, (10, 12, 4)).astype(np.uint8)
+    histograms = png_parser.get_histograms(arr, 6)
+
+    assert list(histograms) == ["R", "G", "B", "A"]
+    for i, counts in enumerate(histograms.values()):
+        assert np.array_equal(counts, np.bincount(arr[..., i].ravel(), minlength=256))
@@ -0,0 +1,121 @@
+import numpy as np
+import pytest
+import png_parser
+from png_parser import paeth_predictor
+
+# Scalar reference of the PNG filters, one byte at a time (PNG specification, section 9)
+def reference_undo_filter(filter_type, scanline, prev_scanline, bytes_per_pixel):
+    result = bytearray(len(scanline))
+    for i in range(len(scanline)):
+        left = result[i - bytes_per_pixel] if i >= bytes_per_pixel else 0
+        up = prev_scanline[i]
+        up_left = prev_scanline[i - bytes_per_pixel] if i >= bytes_per_pixel else 0
+        predictor = (0, left, up, (left + up) // 2, paeth_predictor(left, up, up_left))[filter_type]
+        result[i] = (scanline[i] + predictor) & 0xFF
+    return result
+
+def reference_unfilter(data, height, bytes_per_scanline, bytes_per_pixel):
+    prev = bytearray(bytes_per_scanline)
+    rows = []
+    for y in range(height):
+        row = data[y * (bytes_per_scanline + 1):(y + 1) * (bytes_per_scanline + 1)]
+        prev = reference_undo_filter(row[0], row[1:], prev, bytes_per_pixel)
+        rows.append(bytes(prev))
+    return b"".join(rows)
+
+def filtered_rows(height, bytes_per_scanline, filter_types, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, 256, (height, bytes_per_scanline + 1), dtype=np.uint8)
+    rows[:, 0] = rng.choice(filter_types, height)
+    return rows.tobytes()
+
+@pytest.mark.parametrize("bytes_per_pixel", [1, 2, 3, 4, 6, 8])
+@pytest.mark.parametrize("filter_types", [[0], [1], [2], [3], [4], [0, 1, 2], [0, 1, 2, 3, 4]])
+def test_unfilter_matches_reference(bytes_per_pixel, filter_types, monkeypatch):
+    # Small strips, so rows are carried from one strip to the next
+    monkeypatch.setattr(png_parser, "UNFILTER_STRIP_ROWS", 5)
+    height, bytes_per_scanline = 13, bytes_per_pixel * 7
+    data = filtered_rows(height, bytes_per_scanline, filter_types, seed=bytes_per_pixel)
+
+    result = png_parser.unfilter_scanlines(data, height, bytes_per_scanline, bytes_per_pixel)
+    assert result.tobytes() == reference_unfilter(data, height, bytes_per_scanline, bytes_per_pixel)
+
+def test_unfilter_continues_from_previous_scanline():
+    data = filtered_rows(6, 12, [0, 1, 2, 3, 4], seed=3)
+    whole = png_parser.unfilter_scanlines(data, 6, 12, 3)
+    tail = png_parser.unfilter_scanlines(data[3 * 13:], 3, 12, 3, prev_scanline=whole[2].tobytes())
+    assert np.array_equal(tail, whole[3:])
+
+@pytest.mark.parametrize("filter_type", [0, 1, 2, 3, 4])
+def test_undo_filter_single_row(filter_type):
+    rng = np.random.default_rng(filter_type)
+    scanline, prev = bytearray(rng.integers(0, 256, 24, dtype=np.uint8)), bytearray(rng.integers(0, 256, 24, dtype=np.uint8))
+    assert png_parser.undo_filter(filter_type, scanline, prev, 4) == reference_undo_filter(filter_type, scanline, prev, 4)
+
+def test_unknown_filter_type_is_rejected():
+    data = bytearray(filtered_rows(3, 6, [0]))
+    data[7] = 5
+    with pytest.raises(ValueError, match="Unknown filter type 5"):
+        png_parser.unfilter_scanlines(bytes(data), 3, 6, 1)
+
+def test_truncated_data_is_rejected():
+    with pytest.raises(ValueError, match="Unexpected end"):
+        png_parser.unfilter_scanlines(filtered_rows(3, 6, [0])[:-1], 3, 6, 1)
+
+def reference_apply_filter(filter_type, scanline, prev_scanline, bytes_per_pixel):
+    result = bytearray(len(scanline))
+    for i in range(len(scanline)):
+        left = scanline[i - bytes_per_pixel] if i >= bytes_per_pixel else 0
+        up = prev_scanline[i]
+        up_left = prev_scanline[i - bytes_per_pixel] if i >= bytes_per_pixel else 0
+        predictor = (0, left, up, (left + up) // 2, paeth_predictor(left, up, up_left))[filter_type]
+        result[i] = (scanline[i] - predictor) & 0xFF
+    return result
+
+def raw_rows(height, bytes_per_scanline, seed=0):
+    # Smooth rows with noise, so the filters give different costs
+    rng = np.random.default_rng(seed)
+    ramp = np.add.outer(np.arange(height), np.arange(bytes_per_scanline)) * 3
+    return ((ramp + rng.integers(0, 6, ramp.shape)) & 0xFF).astype(np.uint8)
+
+@pytest.mark.parametrize("bytes_per_pixel", [1, 3, 4, 8])
+@pytest.mark.parametrize("filter_type", [0, 1, 2, 3, 4])
+def test_filter_matches_reference(bytes_per_pixel, filter_type, monkeypatch):
+    monkeypatch.setattr(png_parser, "FILTER_STRIP_ROWS", 4)
+    rows = raw_rows(9, bytes_per_pixel * 5, seed=filter_type)
+    result = png_parser.filter_scanlines(rows, bytes_per_pixel, filter_type)
+
+    prev = bytearray(rows.shape[1])
+    for y, row in enumerate(rows):
+        assert result[y, 0] == filter_type
+        assert result[y, 1:].tobytes() == reference_apply_filter(filter_type, bytearray(row), prev, bytes_per_pixel)
+        prev = bytearray(row)
+
+def test_adaptive_rows_pick_the_cheapest_filter():
+    rows = raw_rows(12, 30, seed=1)
+    result = png_parser.filter_scanlines(rows, 3, png_parser.ADAPTIVE_FILTER)
+
+    prev = bytearray(30)
+    for y, row in enumerate(rows):
+        costs = [sum(min(b, 256 - b) for b in reference_apply_filter(f, bytearray(row), prev, 3)) for f in range(5)]
+        assert result[y, 0] == int(np.argmin(costs))
+        prev = bytearray(row)
+
+@pytest.mark.parametrize("filter_type", [0, 1, 2, 3, 4, png_parser.ADAPTIVE_FILTER])
+@pytest.mark.parametrize("color_type, bit_depth", [(0, 8), (2, 8), (6, 8), (2, 16), (4, 16)])
+def test_filters_round_trip(filter_type, color_type, bit_depth):
+    image_info = {"width": 11, "height": 7, "color_type": color_type, "bit_depth": bit_depth}
+    bytes_per_scanline = png_parser.get_bytes_per_scanline(11, color_type, bit_depth)
+    pixel_data = raw_rows(7, bytes_per_scanline, seed=color_type).tobytes()
+
+    filtered = png_parser.apply_png_filters(pixel_data, image_info, filter_type)
+    assert png_parser.remove_png_filters(filtered, image_info) == pixel_data
+
+def test_adaptive_leaves_palette_rows_unfiltered():
+    image_info = {"width": 16, "height": 4, "color_type": 3, "bit_depth": 8}
+    filtered = png_parser.apply_png_filters(raw_rows(4, 16).tobytes(), image_info, png_parser.ADAPTIVE_FILTER)
+    assert filtered[::17] == bytes(4)
+
+def test_apply_filter_single_row():
+    row, prev = bytearray(raw_rows(1, 12)[0]), bytearray(raw_rows(1, 12, seed=2)[0])
+    assert png_parser.apply_filter(4, row, prev, 3) == reference_apply_filter(4, row, prev, 3)
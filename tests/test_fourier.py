@@ -0,0 +1,121 @@
+import json
+import os
+import numpy as np
+import pytest
+import fourier
+import image_cache
+from chunks import PngChunk
+from conftest import random_pixels, write_png
+
+def test_log_magnitude_matches_full_fft():
+    img = np.random.default_rng(0).integers(0, 256, (17, 22)).astype(np.uint8)
+    expected = np.fft.fftshift(np.log1p(np.abs(np.fft.fft2(img.astype(np.float64)))))
+    assert np.allclose(fourier.log_magnitude_spectrum(fourier.compute_spectrum(img), img.shape), expected, atol=1e-4)
+
+def test_inverse_spectrum_recovers_image():
+    img = np.random.default_rng(1).integers(0, 256, (16, 21)).astype(np.uint8)
+    assert np.allclose(fourier.inverse_spectrum(fourier.compute_spectrum(img), img.shape), img, atol=1e-3)
+
+def test_save_fourier_spectra_keeps_equal_names_apart(tmp_path):
+    inputs = []
+    for seed, directory in enumerate(("a", "b")):
+        (tmp_path / directory).mkdir()
+        inputs.append(write_png(tmp_path / directory / "x.png", random_pixels(8, 8, 1, seed=seed), 0))
+    output_dir = str(tmp_path / "out")
+
+    results = list(fourier.save_fourier_spectra(inputs, output_dir, "npy", workers=1))
+    assert [result["output"] for result in results] == [os.path.join(output_dir, "a", "x_spectrum.npy"),
+                                                         os.path.join(output_dir, "b", "x_spectrum.npy")]
+    assert not np.array_equal(np.load(results[0]["output"]), np.load(results[1]["output"]))
+
+def test_same_image_twice_is_rejected(tmp_path, rgb_png):
+    with pytest.raises(ValueError, match="same output file"):
+        list(fourier.save_fourier_spectra([rgb_png, rgb_png], str(tmp_path / "out")))
+
+def test_saved_png_spectrum_is_an_image(tmp_path, rgb_png):
+    (result,) = fourier.save_fourier_spectra([rgb_png], str(tmp_path / "out"), workers=1)
+    assert result["output"] == str(tmp_path / "out" / "rgb_spectrum.png")
+    assert os.path.getsize(result["output"]) > 0
+
+@pytest.mark.parametrize("channels, color_type, bit_depth", [(1, 0, 8), (2, 4, 8), (3, 2, 8), (4, 6, 8), (3, 2, 16)])
+def test_grayscale_rows_match_load_grayscale(tmp_path, monkeypatch, channels, color_type, bit_depth):
+    monkeypatch.setattr(fourier.png_parser, "UNFILTER_STRIP_ROWS", 4)
+    path = write_png(tmp_path / "img.png", random_pixels(13, 9, channels, bit_depth), color_type, bit_depth)
+
+    shape, strips = fourier.read_grayscale_rows(path)
+    rows = np.concatenate(list(strips))
+    assert shape == (13, 9) and rows.dtype == np.float32
+    # load_grayscale rounds to 8 bits, and keeps only the high byte of 16-bit samples
+    assert np.allclose(rows, fourier.load_grayscale(path) / 255, atol=1.01 / 255)
+
+def test_grayscale_rows_of_split_idat_and_palette(tmp_path, monkeypatch):
+    monkeypatch.setattr(fourier.png_parser, "UNFILTER_STRIP_ROWS", 2)
+    palette = random_pixels(16, 3, 1, seed=3).astype(np.uint8).tobytes()
+    plte = PngChunk(len(palette), "PLTE", palette)
+    path = write_png(tmp_path / "img.png", random_pixels(11, 7, 1, bit_depth=4), 3, idat_chunks=5, extra_chunks=[plte])
+
+    shape, strips = fourier.read_grayscale_rows(path)
+    assert shape == (11, 7)
+    assert np.allclose(np.concatenate(list(strips)), fourier.load_grayscale(path) / 255, atol=1.01 / 255)
+
+def test_welch_spectrum_does_not_use_the_image_cache(tmp_path):
+    path = write_png(tmp_path / "img.png", random_pixels(40, 40, 3), 2, idat_chunks=3)
+    image_cache.get_cache().clear()
+    fourier.spectrum_features(path, tile_size=16)
+    assert image_cache.stats()["entries"] == 0
+
+def test_welch_spectrum_does_not_depend_on_strips(tmp_path, monkeypatch):
+    path = write_png(tmp_path / "img.png", random_pixels(100, 70, 3), 2)
+    power, tiles = fourier.welch_spectrum(path, tile_size=32)
+    # (100 - 32) // 16 + 1 rows of (70 - 32) // 16 + 1 tiles
+    assert power.shape == (32, 17) and tiles == 15
+
+    monkeypatch.setattr(fourier.png_parser, "UNFILTER_STRIP_ROWS", 3)
+    strip_power, strip_tiles = fourier.welch_spectrum(path, tile_size=32)
+    assert strip_tiles == tiles and np.allclose(strip_power, power)
+
+def test_tiles_shrink_to_small_images(tmp_path):
+    path = write_png(tmp_path / "img.png", random_pixels(10, 20, 1), 0)
+    power, tiles = fourier.welch_spectrum(path)
+    assert power.shape == (10, 6) and tiles == 3
+
+def test_white_noise_has_a_flat_spectrum(tmp_path):
+    path = write_png(tmp_path / "noise.png", random_pixels(256, 256, 1), 0)
+    features = fourier.spectrum_features(path, tile_size=64)
+    assert features.shape == (fourier.RADIAL_BINS,) and features.dtype == np.float32
+    # Bin 0 holds the removed tile means; the rest stays within a factor of two
+    assert np.ptp(features[1:]) < np.log10(2)
+
+def test_sinusoid_peaks_at_its_frequency(tmp_path):
+    # 0.25 cycles per pixel along x, the center of bin 16 of 32 between 0 and 0.5
+    x = np.arange(128)
+    row = np.round(127.5 + 100 * np.sin(2 * np.pi * 0.25 * x + 0.3))
+    path = write_png(tmp_path / "wave.png", np.tile(row, (128, 1)), 0)
+
+    features = fourier.spectrum_features(path, tile_size=64)
+    assert np.argmax(features) == 16
+
+def test_radial_power_of_a_constant_spectrum():
+    centers, radial_power = fourier.radial_power_spectrum(np.ones((16, 9)), bins=8)
+    assert np.allclose(centers, (np.arange(8) + 0.5) / 16)
+    assert np.allclose(radial_power, 1)
+
+def test_features_command_writes_ndjson(tmp_path, capsys):
+    import main
+    write_png(tmp_path / "a.png", random_pixels(40, 40, 3), 2)
+    (tmp_path / "b.png").write_bytes(b"not a png")
+
+    assert main.fourier_batch_utils([str(tmp_path), "--features", "--tile-size", "16", "--workers", "1"]) == 1
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [os.path.basename(line["path"]) for line in lines] == ["a.png", "b.png"]
+    assert len(lines[0]["features"]) == fourier.RADIAL_BINS
+    assert "error" in lines[1]
+
+def test_output_paths_of_many_images():
+    image_paths = [os.path.join("in", f"dir{i % 50}", f"img{i}.png") for i in range(5000)]
+    output_paths = fourier.spectrum_output_paths(image_paths, "out", "npy")
+    assert len(set(output_paths)) == 5000
+    assert output_paths[123] == os.path.join("out", "dir23", "img123_spectrum.npy")
+
+    with pytest.raises(ValueError, match=r"dir1.img1_spectrum\.npy$"):
+        fourier.spectrum_output_paths(image_paths + [os.path.join("in", "dir1", "img1.png")], "out", "npy")
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from PIL import Image
+import batch
+import fourier
+import image_cache
+import png_parser
+from conftest import random_pixels, write_png
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    image_cache.get_cache().clear()
+
+def test_load_image_is_decoded_once(rgb_png):
+    first = png_parser.load_image(rgb_png)
+    hits = image_cache.stats()["hits"]
+    assert png_parser.load_image(rgb_png) is first
+    assert image_cache.stats()["hits"] == hits + 1
+    assert not first.flags.writeable
+
+def test_rewritten_file_is_not_served_stale(tmp_path):
+    path = write_png(tmp_path / "image.png", random_pixels(8, 8, 3, seed=1), color_type=2)
+    before = png_parser.load_image(path)
+
+    replacement = random_pixels(8, 8, 3, seed=2)
+    write_png(path, replacement, color_type=2)
+    assert np.array_equal(png_parser.load_image(path), replacement)
+    assert not np.array_equal(before, replacement)
+
+def test_parse_image_matches_parse_IDAT(rgb_png):
+    chunks = png_parser.read_chunks(rgb_png)
+    ihdr = png_parser.parse_IHDR(chunks[0])
+    expected = png_parser.parse_IDAT([chunk.data for chunk in chunks if chunk.type == "IDAT"], ihdr["width"],
+                                     ihdr["height"], ihdr["bit_depth"], ihdr["color_type"])
+    assert png_parser.parse_image(rgb_png) == expected
+
+def test_analysis_and_fourier_share_the_decoded_image(rgb_png):
+    assert "error" not in batch.analyze_file(rgb_png)
+    misses = image_cache.stats()["misses"]
+    fourier.load_grayscale(rgb_png)
+    # Only the grayscale entry itself is new, chunks and pixels come from the cache
+    assert image_cache.stats()["misses"] == misses + 1
+
+@pytest.mark.parametrize("channels, color_type, bit_depth", [(1, 0, 8), (2, 4, 8), (3, 2, 8), (4, 6, 8),
+                                                             (1, 0, 16), (2, 4, 16), (3, 2, 16), (4, 6, 16)])
+def test_load_grayscale_matches_pillow(tmp_path, channels, color_type, bit_depth):
+    path = write_png(tmp_path / "image.png", random_pixels(12, 17, channels, bit_depth), color_type, bit_depth)
+    assert np.array_equal(fourier.load_grayscale(path), np.array(Image.open(path).convert('L')))
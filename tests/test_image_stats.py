@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+import png_parser
+from png_parser import ImageStats
+from conftest import random_pixels
+
+def reference_stats(arr):
+    values = arr.astype(np.float64)
+    return {"min_value": values.min(), "max_value": values.max(), "mean_value": values.mean(), "std_dev": values.std()}
+
+@pytest.mark.parametrize("bit_depth", [8, 16])
+@pytest.mark.parametrize("channels, color_type", [(1, 0), (2, 4), (3, 2), (4, 6)])
+def test_stats_match_numpy(bit_depth, channels, color_type, monkeypatch):
+    # Small strips, so several partial results are merged
+    monkeypatch.setattr(png_parser, "STATS_STRIP_PIXELS", 97)
+    arr = random_pixels(31, 29, channels, bit_depth).astype(np.uint8 if bit_depth == 8 else ">u2")
+    stats = ImageStats(color_type).update(arr)
+
+    for name, value in reference_stats(arr).items():
+        assert stats.to_dict()[name] == pytest.approx(value, rel=1e-12)
+    flat = arr.reshape(-1, channels).astype(np.float64)
+    assert np.allclose(stats.variance(), flat.var(axis=0), rtol=1e-12)
+    assert np.array_equal(stats.min, flat.min(axis=0)) and np.array_equal(stats.max, flat.max(axis=0))
+
+def test_merge_equals_single_pass():
+    arr = random_pixels(40, 30, 3)
+    whole = ImageStats(2).update(arr)
+    merged = ImageStats(2).update(arr[:17]).merge(ImageStats(2).update(arr[17:]))
+
+    assert merged.count == whole.count
+    assert np.allclose(merged.mean, whole.mean) and np.allclose(merged.m2, whole.m2)
+    assert merged.to_dict()["std_dev"] == pytest.approx(whole.to_dict()["std_dev"])
+
+def test_palette_unique_values():
+    arr = np.array([[0, 3, 3], [7, 0, 200]], dtype=np.uint8)
+    assert ImageStats(3).update(arr).to_dict()["unique_values"] == 4
+
+def test_has_transparency():
+    opaque = np.full((4, 4, 4), 255, dtype=np.uint8)
+    assert not png_parser.has_transparency(opaque, 6)
+    opaque[2, 1, 3] = 254
+    assert png_parser.has_transparency(opaque, 6)
+    assert not png_parser.has_transparency(opaque[..., :3], 2)
@@ -0,0 +1,29 @@
+import instrumentation
+import png_parser
+
+def test_metadata_is_silent_unless_logging(rgb_png, capsys):
+    chunks = png_parser.read_chunks(rgb_png)
+    metadata = png_parser.extract_metadata(chunks)
+    assert metadata["IHDR"]["width"] == 40
+    assert capsys.readouterr().out == ""
+
+    with instrumentation.instrument(log=True):
+        png_parser.extract_metadata(chunks)
+    assert "IHDR metadata:" in capsys.readouterr().out
+
+def test_bad_exif_is_logged_not_printed(capsys):
+    chunk = png_parser.PngChunk(4, "eXIf", b"junk")
+    assert png_parser.parse_eXIf(chunk) is None
+    assert capsys.readouterr().out == ""
+
+def test_report_collects_timers_and_counters(rgb_png):
+    with instrumentation.instrument() as report:
+        png_parser.read_chunks(rgb_png)
+    data = report.to_dict()
+    assert data["timers"]["png_parser.read_chunks"]["calls"] == 1
+    assert data["counters"]["png_parser.chunks"] == 3
+    assert 'png_stage_calls_total{stage="png_parser.read_chunks"} 1' in report.to_prometheus()
+
+def test_disabled_instrumentation_records_nothing():
+    assert not instrumentation.enabled()
+    assert instrumentation.timer("anything") is instrumentation._NULL_TIMER
@@ -0,0 +1,50 @@
+import os
+import stat
+import pytest
+import block_engine
+import key_store
+
+def test_save_and_load_keypair(tmp_path, keypair):
+    public_key, private_key = keypair
+    path = str(tmp_path / "keys" / "key.pem")
+    key_store.save_keypair(path, private_key)
+
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    loaded_public, loaded_private = key_store.load_keypair(path)
+    assert loaded_public == public_key
+    assert (loaded_private.d, loaded_private.n, loaded_private.p, loaded_private.q) == \
+           (private_key.d, private_key.n, private_key.p, private_key.q)
+
+def test_passphrase_is_required(tmp_path, keypair):
+    path = str(tmp_path / "key.pem")
+    key_store.save_keypair(path, keypair[1], passphrase="secret")
+
+    assert key_store.load_keypair(path, passphrase="secret")[0] == keypair[0]
+    with pytest.raises(ValueError):
+        key_store.load_keypair(path)
+
+def test_load_or_create_keypair_reuses_the_file(tmp_path):
+    path = str(tmp_path / "key.pem")
+    created = key_store.load_or_create_keypair(path, bits=256)
+    assert key_store.load_or_create_keypair(path, bits=256)[0] == created[0]
+
+def test_key_pool_hands_out_distinct_keypairs():
+    with key_store.KeyPool(size=2, bits=128) as pool:
+        moduli = {pool.get(timeout=30)[0][1] for _ in range(3)}
+    assert len(moduli) == 3
+
+def test_key_pool_survives_other_worker_counts():
+    with key_store.KeyPool(size=1, bits=128, workers=2) as pool:
+        for workers in (3, 2, 3):
+            assert block_engine.map_batches(len, [b"a", b"bb"], workers) == [1, 2]
+            pool.get(timeout=30)
+
+def test_key_pool_get_raises_generation_errors(monkeypatch):
+    def failing_generate_keypair(bits, workers):
+        raise ValueError("no primes today")
+    monkeypatch.setattr(key_store, "generate_keypair", failing_generate_keypair)
+
+    with key_store.KeyPool(size=1) as pool:
+        for _ in range(2):
+            with pytest.raises(ValueError, match="no primes today"):
+                pool.get(timeout=5)
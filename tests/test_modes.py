@@ -0,0 +1,163 @@
+import zlib
+import numpy as np
+import pytest
+import modes_cbc as cbc
+import modes_ctr as ctr
+import modes_ecb as ecb
+import modes_hybrid as hybrid
+import png_parser
+import rsa
+import rsa_lib
+from conftest import decode_png, random_pixels, write_png
+from rsa import generate_keypair
+
+@pytest.fixture
+def large_png(tmp_path):
+    # Enough blocks for several block_engine batches
+    return write_png(tmp_path / "large.png", random_pixels(120, 100, 3), 2)
+
+def round_trip(tmp_path, encrypt, decrypt, source, keypair, **kwargs):
+    encrypted, decrypted = str(tmp_path / "encrypted.png"), str(tmp_path / "decrypted.png")
+    encrypt(source, encrypted, keypair[0], **kwargs)
+    decrypt(encrypted, decrypted, keypair[1], **kwargs)
+    return encrypted, decrypted
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_rsa_lib_round_trip(tmp_path, large_png, keypair, workers):
+    encrypted, decrypted = round_trip(tmp_path, rsa_lib.encrypt_png_rsa_lib, rsa_lib.decrypt_png_rsa_lib,
+                                      large_png, keypair, workers=workers)
+    assert np.array_equal(decode_png(decrypted), decode_png(large_png))
+
+def test_ecb_output_does_not_depend_on_workers(tmp_path, large_png, keypair):
+    outputs = []
+    for workers in (1, 2):
+        ecb.clear_block_caches()
+        output = str(tmp_path / f"ecb_{workers}.png")
+        ecb.encrypt_png_ecb(large_png, output, keypair[0], workers=workers)
+        with open(output, "rb") as f:
+            outputs.append(f.read())
+    ecb.clear_block_caches()
+
+    assert outputs[0] == outputs[1]
+
+def test_hybrid_round_trip(tmp_path, keypair):
+    source = write_png(tmp_path / "split.png", random_pixels(30, 20, 4), 6, idat_chunks=3)
+    encrypted, decrypted = round_trip(tmp_path, hybrid.encrypt_png_hybrid, hybrid.decrypt_png_hybrid, source, keypair)
+
+    assert [chunk.type for chunk in png_parser.read_chunks(encrypted)] == ["IHDR", hybrid.KEY_CHUNK_TYPE, "IDAT", "IEND"]
+    original_idat = b"".join(chunk.data for chunk in png_parser.read_chunks(source) if chunk.type == "IDAT")
+    assert [chunk.data for chunk in png_parser.read_chunks(decrypted) if chunk.type == "IDAT"] == [original_idat]
+
+def test_hybrid_rejects_tampered_data(tmp_path, rgb_png, keypair):
+    encrypted = str(tmp_path / "encrypted.png")
+    hybrid.encrypt_png_hybrid(rgb_png, encrypted, keypair[0])
+
+    chunks = png_parser.read_chunks(encrypted)
+    idat = next(chunk for chunk in chunks if chunk.type == "IDAT")
+    idat.data = bytes([idat.data[0] ^ 1]) + idat.data[1:]
+    idat.crc = None
+    png_parser.write_chunks(encrypted, chunks)
+
+    with pytest.raises(ValueError, match="Decryption failed"):
+        hybrid.decrypt_png_hybrid(encrypted, str(tmp_path / "decrypted.png"), keypair[1])
+
+def test_hybrid_rejects_wrong_key(tmp_path, rgb_png, keypair):
+    encrypted = str(tmp_path / "encrypted.png")
+    hybrid.encrypt_png_hybrid(rgb_png, encrypted, keypair[0])
+    with pytest.raises(ValueError, match="Decryption failed"):
+        hybrid.decrypt_png_hybrid(encrypted, str(tmp_path / "decrypted.png"), generate_keypair(256)[1])
+
+def test_hybrid_needs_key_chunk(tmp_path, rgb_png, keypair):
+    with pytest.raises(ValueError, match="Missing"):
+        hybrid.decrypt_png_hybrid(rgb_png, str(tmp_path / "decrypted.png"), keypair[1])
+
+def test_xor_bytes():
+    a, b = bytes(range(10)), bytes(range(100, 107))
+    assert cbc.xor_bytes(a, b) == bytes(x ^ y for x, y in zip(a, b))
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_cbc_decrypt_inverts_cbc_encrypt(keypair, workers):
+    block_size, chunk_size = cbc.get_block_sizes(keypair[0])
+    data = np.random.default_rng(0).integers(0, 256, chunk_size * 600, dtype=np.uint8).tobytes()
+    iv = bytes(range(chunk_size))
+
+    encrypted = cbc.cbc_encrypt(data, keypair[0], iv, block_size, chunk_size)
+    assert cbc.cbc_decrypt(encrypted, keypair[1], iv, block_size, chunk_size, workers) == data
+
+def test_cbc_round_trip(tmp_path, keypair):
+    pixels = random_pixels(40, 30, 3)
+    # Trailing zero bytes are indistinguishable from padding in this mode
+    pixels[-1, -1] = 255
+    source = write_png(tmp_path / "source.png", pixels, 2)
+
+    encrypted, decrypted = round_trip(tmp_path, cbc.encrypt_png_cbc, cbc.decrypt_png_cbc, source, keypair)
+    assert np.array_equal(decode_png(decrypted), pixels)
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_segmented_cbc_round_trip(tmp_path, keypair, workers, monkeypatch):
+    # Several segments, the last one short
+    monkeypatch.setattr(cbc, "SEGMENT_BLOCKS", 7)
+    source = write_png(tmp_path / "source.png", random_pixels(30, 20, 4), 6, idat_chunks=2)
+
+    encrypted, decrypted = round_trip(tmp_path, cbc.encrypt_png_cbc_segmented, cbc.decrypt_png_cbc_segmented,
+                                      source, keypair, workers=workers)
+    assert [chunk.type for chunk in png_parser.read_chunks(encrypted)] == ["IHDR", cbc.IV_CHUNK_TYPE, "IDAT", "IEND"]
+    assert np.array_equal(decode_png(decrypted), decode_png(source))
+
+def test_segments_decrypt_independently(keypair):
+    block_size, chunk_size = cbc.get_block_sizes(keypair[0])
+    segments = [(bytes([k]) * chunk_size, bytes([k + 1]) * (chunk_size * 3)) for k in range(3)]
+    encrypted = [cbc.encrypt_segment_cbc(segment, keypair[0], block_size, chunk_size) for segment in segments]
+
+    # The last segment alone, without the ones before it
+    assert cbc.decrypt_segment_cbc((segments[2][0], encrypted[2]), keypair[1], block_size, chunk_size) == segments[2][1]
+
+def test_segmented_cbc_needs_iv_chunk(tmp_path, rgb_png, keypair):
+    with pytest.raises(ValueError, match="Missing"):
+        cbc.decrypt_png_cbc_segmented(rgb_png, str(tmp_path / "decrypted.png"), keypair[1])
+
+def inflated_idat(path):
+    return zlib.decompress(b"".join(chunk.data for chunk in png_parser.read_chunks(path) if chunk.type == "IDAT"))
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_ctr_round_trip(tmp_path, large_png, keypair, workers):
+    encrypted, decrypted = round_trip(tmp_path, ctr.encrypt_png_ctr, ctr.decrypt_png_ctr, large_png, keypair, workers=workers)
+
+    assert [chunk.type for chunk in png_parser.read_chunks(encrypted)] == ["IHDR", ctr.KEY_CHUNK_TYPE, "IDAT", "IEND"]
+    assert inflated_idat(encrypted) != inflated_idat(large_png)
+    assert inflated_idat(decrypted) == inflated_idat(large_png)
+
+def test_ctr_without_predicted_length(tmp_path, rgb_png, keypair, monkeypatch):
+    # As for interlaced images: the whole keystream is generated after inflating
+    monkeypatch.setattr(ctr, "expected_idat_length", lambda ihdr: 0)
+    encrypted, decrypted = round_trip(tmp_path, ctr.encrypt_png_ctr, ctr.decrypt_png_ctr, rgb_png, keypair)
+    assert inflated_idat(decrypted) == inflated_idat(rgb_png)
+
+def test_keystream_is_split_consistently(keypair):
+    nonce = bytes(range(32))
+    block_size = ctr.get_keystream_block_size(keypair[0])
+    whole = ctr.generate_keystream(keypair[0], nonce, block_size * 600, workers=2)
+
+    assert whole == ctr.generate_keystream(keypair[0], nonce, block_size * 600, workers=1)
+    assert whole[block_size * 10:] == ctr.generate_keystream(keypair[0], nonce, block_size * 590, workers=1, first_block=10)
+
+@pytest.fixture(scope="module")
+def small_e_keypair():
+    # The fallback exponent of generate_keypair; p and q must not be 1 mod 3
+    p, q = (next(p for p in iter(lambda: rsa.generate_prime(256), None) if p % 3 == 2) for _ in range(2))
+    n, phi = p * q, (p - 1) * (q - 1)
+    return (3, n), rsa.PrivateKey(rsa.modinv(3, phi), n, 3, p, q)
+
+def test_ctr_with_small_exponent(tmp_path, large_png, small_e_keypair):
+    encrypted, decrypted = round_trip(tmp_path, ctr.encrypt_png_ctr, ctr.decrypt_png_ctr, large_png, small_e_keypair)
+    assert inflated_idat(decrypted) == inflated_idat(large_png)
+
+    (e, n), _ = small_e_keypair
+    nonce = bytes(range(32))
+    keystream = ctr.generate_keystream((e, n), nonce, 4 * ctr.get_keystream_block_size((e, n)))
+    blocks = [ctr.counter_block(nonce, counter, n) for counter in range(4)]
+    # Full-width, unrelated inputs that wrap around n when cubed
+    assert all(m ** 3 > n for m in blocks)
+    assert len(set(b - a for a, b in zip(blocks, blocks[1:]))) == 3
+    block_size = ctr.get_keystream_block_size((e, n))
+    assert keystream[:block_size] == (pow(blocks[0], 3, n) % (1 << 8 * block_size)).to_bytes(block_size, "big")
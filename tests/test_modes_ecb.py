@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+import modes_ecb as ecb
+from conftest import decode_png, write_png
+from rsa import generate_keypair
+
+@pytest.fixture
+def flat_png(tmp_path):
+    # 63 rows of 61 bytes: whole 63-byte blocks for a 512-bit modulus, mostly repeated
+    pixels = np.zeros((63, 20, 3), dtype=np.uint8)
+    pixels[::7, ::3] = (200, 10, 90)
+    return write_png(tmp_path / "flat.png", pixels, color_type=2, filter_type=0)
+
+@pytest.fixture(autouse=True)
+def empty_caches():
+    ecb.clear_block_caches()
+    yield
+    ecb.clear_block_caches()
+
+def test_round_trip_with_cache(tmp_path, flat_png, keypair):
+    public_key, private_key = keypair
+    encrypted, decrypted = str(tmp_path / "enc.png"), str(tmp_path / "dec.png")
+
+    ecb.encrypt_png_ecb(flat_png, encrypted, public_key, workers=1)
+    stats = ecb.get_cache_stats()["encrypt"]
+    assert stats["hits"] > stats["misses"]
+
+    ecb.decrypt_png_ecb(encrypted, decrypted, private_key, workers=1)
+    assert np.array_equal(decode_png(decrypted), decode_png(flat_png))
+
+def test_cached_blocks_match_uncached(tmp_path, flat_png, keypair):
+    first, second = str(tmp_path / "first.png"), str(tmp_path / "second.png")
+    ecb.encrypt_png_ecb(flat_png, first, keypair[0], workers=1)
+    ecb.encrypt_png_ecb(flat_png, second, keypair[0], workers=1)
+    assert ecb.get_cache_stats()["encrypt"]["misses"] < ecb.get_cache_stats()["encrypt"]["hits"]
+
+    with open(first, "rb") as a, open(second, "rb") as b:
+        assert a.read() == b.read()
+
+def test_number_of_key_caches_is_bounded():
+    keys = [generate_keypair(64)[0] for _ in range(ecb.BLOCK_CACHE_KEYS + 2)]
+    caches = [ecb.get_block_cache("encrypt", key) for key in keys]
+
+    assert len(ecb._block_caches) == ecb.BLOCK_CACHE_KEYS
+    assert ecb.get_block_cache("encrypt", keys[-1]) is caches[-1]
+    assert ecb.get_block_cache("encrypt", keys[0]) is not caches[0]
+
+def test_clear_block_caches_releases_everything(keypair):
+    ecb.get_block_cache("decrypt", keypair[1]).put(b"block", b"plain")
+    ecb.clear_block_caches()
+    assert ecb.get_cache_stats() == {}
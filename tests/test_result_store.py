@@ -0,0 +1,59 @@
+import shutil
+import pytest
+import batch
+import image_cache
+from chunks import PngChunk
+import png_parser
+import result_store
+from conftest import random_pixels, write_png
+
+@pytest.fixture
+def store(tmp_path):
+    with result_store.ResultStore(str(tmp_path / "results.db")) as store:
+        yield store
+
+def fail_to_decode(*args, **kwargs):
+    raise AssertionError("image decoded although its result is stored")
+
+def test_stored_results_are_reused(store, rgb_png, monkeypatch):
+    first = batch.analyze_file(rgb_png, store)
+    monkeypatch.setattr(png_parser, "parse_image", fail_to_decode)
+    assert batch.analyze_file(rgb_png, store) == first
+
+def test_duplicate_content_is_analyzed_once(tmp_path, store, rgb_png, monkeypatch):
+    first = batch.analyze_file(rgb_png, store)
+    copy = str(tmp_path / "copy.png")
+    shutil.copy(rgb_png, copy)
+
+    monkeypatch.setattr(png_parser, "parse_image", fail_to_decode)
+    assert batch.analyze_file(copy, store)["image"] == first["image"]
+
+def test_unchanged_files_are_not_rehashed(store, rgb_png, monkeypatch):
+    batch.analyze_file(rgb_png, store)
+    monkeypatch.setattr(result_store, "content_hash", fail_to_decode)
+    assert "error" not in batch.analyze_file(rgb_png, store)
+
+def test_unchanged_files_are_not_read_whole(tmp_path, store, monkeypatch):
+    text = b"Comment\x00stored"
+    path = write_png(tmp_path / "text.png", random_pixels(9, 7, 3), 2, idat_chunks=2,
+                     extra_chunks=[PngChunk(len(text), "tEXt", text)])
+    first = batch.analyze_file(path, store)
+    assert first["metadata"] == png_parser.extract_metadata(png_parser.read_chunks(path))
+
+    image_cache.get_cache().clear()
+    monkeypatch.setattr(png_parser, "read_chunks", fail_to_decode)
+    assert batch.analyze_file(path, store) == first
+
+def test_other_versions_are_ignored(store, monkeypatch):
+    store.put("abc", {"stats": 1})
+    assert store.get("abc") == {"stats": 1}
+    monkeypatch.setattr(result_store, "RESULT_VERSION", result_store.RESULT_VERSION + 1)
+    assert store.get("abc") is None
+
+def test_content_hash_ignores_ancillary_chunks_and_idat_split(tmp_path):
+    pixels = random_pixels(16, 16, 3)
+    plain = png_parser.read_chunks(write_png(tmp_path / "plain.png", pixels, 2))
+    text = PngChunk(9, "tEXt", b"Comment\x00x")
+    split = png_parser.read_chunks(write_png(tmp_path / "split.png", pixels, 2, idat_chunks=3, extra_chunks=[text]))
+
+    assert result_store.content_hash(plain) == result_store.content_hash(split)
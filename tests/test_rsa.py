@@ -0,0 +1,69 @@
+import random
+import pytest
+import rsa
+from rsa import PrivateKey
+
+def test_crt_decrypt_matches_plain_exponentiation(keypair):
+    (e, n), private_key = keypair
+    rng = random.Random(0)
+    for _ in range(20):
+        c = rng.randrange(n)
+        assert private_key.decrypt(c) == pow(c, private_key.d, n)
+
+def test_encrypt_then_decrypt(keypair):
+    (e, n), private_key = keypair
+    for m in (0, 1, 2, n - 1, 123456789):
+        assert private_key.decrypt(pow(m, e, n)) == m
+
+def test_private_key_unpacks_like_a_tuple(keypair):
+    private_key = keypair[1]
+    d, n = private_key
+    assert (d, n) == (private_key[0], private_key[1]) == (private_key.d, private_key.n)
+    assert len(private_key) == 2
+
+def test_crt_parameters():
+    # Textbook key: p = 61, q = 53, e = 17, d = 2753
+    private_key = PrivateKey(2753, 3233, 17, 61, 53)
+    assert (private_key.dP, private_key.dQ, private_key.qInv) == (53, 49, 38)
+    assert private_key.decrypt(2790) == 65
+
+def is_prime_by_trial_division(n):
+    return n >= 2 and all(n % p for p in range(2, int(n ** 0.5) + 1))
+
+def test_primes_below_matches_trial_division():
+    assert rsa.primes_below(200) == [n for n in range(200) if is_prime_by_trial_division(n)]
+    assert rsa.primes_below(2) == []
+
+def test_is_probable_prime_small_numbers():
+    assert [n for n in range(5000) if rsa.is_probable_prime(n)] == rsa.primes_below(5000)
+
+@pytest.mark.parametrize("n", [561, 1105, 1729, 2465, 2821, 6601, 8911, 3215031751, 3825123056546413051])
+def test_is_probable_prime_rejects_carmichael_and_strong_pseudoprimes(n):
+    assert not rsa.is_probable_prime(n)
+
+@pytest.mark.parametrize("n", [65537, 2 ** 61 - 1, 2 ** 127 - 1, 2 ** 521 - 1])
+def test_is_probable_prime_accepts_large_primes(n):
+    assert rsa.is_probable_prime(n)
+    assert not rsa.is_probable_prime(n * 65537)
+
+@pytest.mark.parametrize("bits", [8, 16, 24, 64, 256])
+def test_generate_prime_bit_length(bits):
+    # 8 and 16 bits take the unsieved path, larger sizes the sieve windows
+    for _ in range(5):
+        p = rsa.generate_prime(bits)
+        assert p.bit_length() == bits
+        if bits <= 24:
+            assert is_prime_by_trial_division(p)
+        else:
+            assert rsa.is_probable_prime(p, rounds=40)
+
+def test_generate_primes_in_parallel():
+    primes = rsa.generate_primes((64, 96), workers=2)
+    assert [p.bit_length() for p in primes] == [64, 96]
+    assert all(rsa.is_probable_prime(p, rounds=40) for p in primes)
+
+def test_keypair_modulus_has_twice_the_bits(keypair):
+    (e, n), private_key = keypair
+    assert n.bit_length() == 512
+    assert private_key.p * private_key.q == n
+    assert private_key.p != private_key.q